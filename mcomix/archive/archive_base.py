@@ -21,6 +21,9 @@ class BaseArchive(object):
     """ True if concurrent calls to extract is supported. """
     support_concurrent_extractions = False
 
+    """ True if files can be read in memory (see read). """
+    support_in_memory_extraction = False
+
     def __init__(self, archive):
         assert isinstance(archive, unicode), "File should be an Unicode string."
 
@@ -67,6 +70,39 @@ class BaseArchive(object):
             if 0 == len(wanted):
                 break
 
+    def read(self, filename):
+        """ Returns the content of the file specified by <filename> (see
+        extract), without writing it to disk. Only supported if
+        support_in_memory_extraction is True. """
+
+        raise NotImplementedError()
+
+    def iter_read(self, entries):
+        """ Generator to read <entries> from archive (see read), yielding
+        (filename, content) tuples. """
+        wanted = set(entries)
+        for filename in self.iter_contents():
+            if not filename in wanted:
+                continue
+            yield filename, self.read(filename)
+            wanted.remove(filename)
+            if 0 == len(wanted):
+                break
+
+    def get_listing_state(self):
+        """ Returns what was learned while listing the archive contents and
+        is needed for extracting files (e.g. names mapping, solid flag), so
+        it can be given back to restore_listing_state instead of listing the
+        archive again. The state must be picklable. Returns None if not
+        supported. """
+
+        return None
+
+    def restore_listing_state(self, state):
+        """ Restores a <state> returned by get_listing_state. """
+
+        pass
+
     def close(self):
         """ Closes the archive and releases held resources. """
 
@@ -166,6 +202,12 @@ class NonUnicodeArchive(BaseArchive):
         else:
             return i18n.to_utf8(filename)
 
+    def get_listing_state(self):
+        return { 'unicode_mapping': dict(self.unicode_mapping) }
+
+    def restore_listing_state(self, state):
+        self.unicode_mapping.update(state['unicode_mapping'])
+
 class ExternalExecutableArchive(NonUnicodeArchive):
     """ For archives that are extracted by spawning an external
     application. """
@@ -203,6 +245,10 @@ class ExternalExecutableArchive(NonUnicodeArchive):
 
         return line
 
+    def restore_listing_state(self, state):
+        super(ExternalExecutableArchive, self).restore_listing_state(state)
+        self.filenames_initialized = True
+
     def iter_contents(self):
         if not self._get_executable():
             return
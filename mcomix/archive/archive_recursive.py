@@ -3,30 +3,47 @@
 """ Class for transparently handling an archive containing sub-archives. """
 
 from mcomix.archive import archive_base
+from mcomix import archive_toc
 from mcomix import archive_tools
 from mcomix import log
 
 import os
+import threading
 
 class RecursiveArchive(archive_base.BaseArchive):
 
-    def __init__(self, archive, destination_dir):
+    def __init__(self, archive, destination_dir, mime=None):
         super(RecursiveArchive, self).__init__(archive.archive)
         self._main_archive = archive
         self._destination_dir = destination_dir
+        # If known, the table of contents is cached once listed.
+        self._mime = mime
+        # List of archives, by index. Sub-archives of a table of contents
+        # restored from the cache are only opened when needed (None until).
         self._archive_list = []
-        # Map entry name to its archive+name.
+        # Root of each archive.
+        self._archive_roots = []
+        # Parent archive index and name of each sub-archive (None for the
+        # main archive).
+        self._archive_parents = []
+        # Listing state of each archive, when restored from the cache.
+        self._archive_states = []
+        self._archive_lock = threading.RLock()
+        # Map entry name to its archive index+name.
         self._entry_mapping = {}
-        # Map archive to its root.
-        self._archive_root = {}
         self._contents_listed = False
         self._contents = []
+        self._is_solid = None
         # Assume concurrent extractions are not supported.
         self.support_concurrent_extractions = False
+        # Same for in memory extractions.
+        self.support_in_memory_extraction = False
 
-    def _iter_contents(self, archive, root=None):
+    def _iter_contents(self, archive, root=None, parent=None):
+        index = len(self._archive_list)
         self._archive_list.append(archive)
-        self._archive_root[archive] = root
+        self._archive_roots.append(root)
+        self._archive_parents.append(parent)
         sub_archive_list = []
         for f in archive.iter_contents():
             if archive_tools.is_archive_file(f):
@@ -38,33 +55,105 @@ class RecursiveArchive(archive_base.BaseArchive):
             name = f
             if root is not None:
                 name = os.path.join(root, name)
-            self._entry_mapping[name] = (archive, f)
+            self._entry_mapping[name] = (index, f)
             yield name
         for f in sub_archive_list:
-            # Extract sub-archive.
-            destination_dir = self._destination_dir
-            if root is not None:
-                destination_dir = os.path.join(destination_dir, root)
-            archive.extract(f, destination_dir)
-            sub_archive_ext = os.path.splitext(f)[1].lower()[1:]
-            sub_archive_path = os.path.join(
-                self._destination_dir, 'sub-archives',
-                '%04u.%s' % (len(self._archive_list), sub_archive_ext
-            ))
-            self._create_directory(os.path.dirname(sub_archive_path))
-            os.rename(os.path.join(destination_dir, f), sub_archive_path)
-            # And open it and list its contents.
-            sub_archive = archive_tools.get_archive_handler(sub_archive_path)
+            # Extract sub-archive, and open it.
+            sub_archive = self._open_sub_archive(len(self._archive_list),
+                                                 index, f)
             if sub_archive is None:
-                log.warning('Non-supported archive format: %s',
-                            os.path.basename(sub_archive_path))
                 continue
+            # And list its contents.
             sub_root = f
             if root is not None:
                 sub_root = os.path.join(root, sub_root)
-            for name in self._iter_contents(sub_archive, sub_root):
+            for name in self._iter_contents(sub_archive, sub_root, (index, f)):
                 yield name
 
+    def _open_sub_archive(self, index, parent_index, name):
+        """ Extract the sub-archive <name> from the archive <parent_index>,
+        and return a handler for it (None if not supported). """
+        sub_archive_ext = os.path.splitext(name)[1].lower()[1:]
+        sub_archive_path = os.path.join(
+            self._destination_dir, 'sub-archives',
+            '%04u.%s' % (index, sub_archive_ext
+        ))
+        # Only renamed once fully extracted: if already there (e.g. in the
+        # extraction cache, see extraction_cache.py), it can be reused.
+        if not os.path.isfile(sub_archive_path):
+            parent = self._get_archive(parent_index)
+            destination_dir = self._destination_dir
+            root = self._archive_roots[parent_index]
+            if root is not None:
+                destination_dir = os.path.join(destination_dir, root)
+            parent.extract(name, destination_dir)
+            self._create_directory(os.path.dirname(sub_archive_path))
+            os.rename(os.path.join(destination_dir, name), sub_archive_path)
+        else:
+            log.debug('Reusing extracted sub-archive %s', sub_archive_path)
+        sub_archive = archive_tools.get_archive_handler(sub_archive_path)
+        if sub_archive is None:
+            log.warning('Non-supported archive format: %s',
+                        os.path.basename(sub_archive_path))
+        return sub_archive
+
+    def _get_archive(self, index):
+        """ Return the archive <index>, opening it if needed. """
+        with self._archive_lock:
+            archive = self._archive_list[index]
+            if archive is None:
+                parent_index, name = self._archive_parents[index]
+                archive = self._open_sub_archive(index, parent_index, name)
+                if archive is None:
+                    raise IOError('could not open sub-archive %s' % name)
+                archive.restore_listing_state(self._archive_states[index])
+                self._archive_list[index] = archive
+            return archive
+
+    def get_toc(self):
+        """ Return the table of contents of the archive (list of entries,
+        sub-archives, and listing state of each archive), or None if it
+        can't be restored later by set_toc. """
+        if not self._contents_listed:
+            self.list_contents()
+        states = []
+        for index, archive in enumerate(self._archive_list):
+            if archive is None:
+                state = self._archive_states[index]
+            else:
+                state = archive.get_listing_state()
+                if state is None:
+                    return None
+            states.append(state)
+        return {
+            'mime': self._mime,
+            'contents': self._contents[:],
+            'entries': dict(self._entry_mapping),
+            'roots': self._archive_roots[:],
+            'parents': self._archive_parents[:],
+            'states': states,
+            'solid': self.is_solid(),
+            'concurrent_extractions': self.support_concurrent_extractions,
+            'in_memory_extraction': self.support_in_memory_extraction,
+        }
+
+    def set_toc(self, toc):
+        """ Restore a table of contents returned by get_toc, instead of
+        listing the archive: sub-archives will only be extracted if some
+        of their entries are. """
+        self._archive_states = toc['states'][:]
+        self._archive_list = [self._main_archive] + \
+                [None] * (len(self._archive_states) - 1)
+        self._main_archive.restore_listing_state(self._archive_states[0])
+        self._archive_roots = toc['roots'][:]
+        self._archive_parents = toc['parents'][:]
+        self._entry_mapping = dict(toc['entries'])
+        self._contents = toc['contents'][:]
+        self._is_solid = toc['solid']
+        self.support_concurrent_extractions = toc['concurrent_extractions']
+        self.support_in_memory_extraction = toc['in_memory_extraction']
+        self._contents_listed = True
+
     def _check_concurrent_extraction_support(self):
         supported = True
         # We need all archives to support concurrent extractions.
@@ -74,6 +163,15 @@ class RecursiveArchive(archive_base.BaseArchive):
                 break
         self.support_concurrent_extractions = supported
 
+    def _check_in_memory_extraction_support(self):
+        supported = True
+        # Likewise for in memory extractions.
+        for archive in self._archive_list:
+            if not archive.support_in_memory_extraction:
+                supported = False
+                break
+        self.support_in_memory_extraction = supported
+
     def iter_contents(self):
         if self._contents_listed:
             for f in self._contents:
@@ -86,6 +184,11 @@ class RecursiveArchive(archive_base.BaseArchive):
         self._contents_listed = True
         # We can now check if concurrent extractions are really supported.
         self._check_concurrent_extraction_support()
+        self._check_in_memory_extraction_support()
+        if self._mime is not None:
+            toc = self.get_toc()
+            if toc is not None:
+                archive_toc.get_cache().set(self.archive, toc)
 
     def list_contents(self):
         if self._contents_listed:
@@ -95,30 +198,61 @@ class RecursiveArchive(archive_base.BaseArchive):
     def extract(self, filename, destination_dir):
         if not self._contents_listed:
             self.list_contents()
-        archive, name = self._entry_mapping[filename]
-        root = self._archive_root[archive]
+        index, name = self._entry_mapping[filename]
+        archive = self._get_archive(index)
+        root = self._archive_roots[index]
         if root is not None:
             destination_dir = os.path.join(destination_dir, root)
         log.debug('extracting from %s to %s: %s',
                   archive.archive, destination_dir, filename)
         archive.extract(name, destination_dir)
 
-    def iter_extract(self, entries, destination_dir):
+    def read(self, filename):
         if not self._contents_listed:
             self.list_contents()
-        # Unfortunately we can't just rely on BaseArchive default
-        # implementation if solid archives are to be correctly supported:
-        # we need to call iter_extract (not extract) for each archive ourselves.
+        index, name = self._entry_mapping[filename]
+        archive = self._get_archive(index)
+        log.debug('reading from %s: %s', archive.archive, filename)
+        return archive.read(name)
+
+    def _iter_wanted(self, entries):
+        """ Generator yielding (archive index, wanted) for each archive
+        containing some of <entries>, wanted mapping their names in the
+        archive to entry names. """
         wanted = set(entries)
-        for archive in self._archive_list:
+        for index in xrange(len(self._archive_list)):
             archive_wanted = {}
             for name in wanted:
-                name_archive, name_archive_name = self._entry_mapping[name]
-                if name_archive == archive:
+                name_index, name_archive_name = self._entry_mapping[name]
+                if name_index == index:
                     archive_wanted[name_archive_name] = name
             if 0 == len(archive_wanted):
                 continue
-            root = self._archive_root[archive]
+            yield index, archive_wanted
+            wanted -= set(archive_wanted.values())
+            if 0 == len(wanted):
+                break
+
+    def iter_read(self, entries):
+        if not self._contents_listed:
+            self.list_contents()
+        # Like iter_extract, for solid archives support.
+        for index, archive_wanted in self._iter_wanted(entries):
+            archive = self._get_archive(index)
+            log.debug('reading from %s: %s', archive.archive,
+                      ' '.join(archive_wanted.keys()))
+            for f, content in archive.iter_read(archive_wanted.keys()):
+                yield archive_wanted[f], content
+
+    def iter_extract(self, entries, destination_dir):
+        if not self._contents_listed:
+            self.list_contents()
+        # Unfortunately we can't just rely on BaseArchive default
+        # implementation if solid archives are to be correctly supported:
+        # we need to call iter_extract (not extract) for each archive ourselves.
+        for index, archive_wanted in self._iter_wanted(entries):
+            archive = self._get_archive(index)
+            root = self._archive_roots[index]
             archive_destination_dir = destination_dir
             if root is not None:
                 archive_destination_dir = os.path.join(destination_dir, root)
@@ -127,20 +261,21 @@ class RecursiveArchive(archive_base.BaseArchive):
                       ' '.join(archive_wanted.keys()))
             for f in archive.iter_extract(archive_wanted.keys(), archive_destination_dir):
                 yield archive_wanted[f]
-            wanted -= set(archive_wanted.values())
-            if 0 == len(wanted):
-                break
 
     def is_solid(self):
+        if self._is_solid is not None:
+            return self._is_solid
         if not self._contents_listed:
             self.list_contents()
         # We're solid if at least one archive is solid.
+        self._is_solid = False
         for archive in self._archive_list:
             if archive.is_solid():
-                return True
-        return False
+                self._is_solid = True
+                break
+        return self._is_solid
 
     def close(self):
         for archive in self._archive_list:
-            archive.close()
-
+            if archive is not None:
+                archive.close()
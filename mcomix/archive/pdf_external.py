@@ -41,6 +41,10 @@ class PdfArchive(archive_base.BaseArchive):
             proc.stdout.close()
             proc.wait()
 
+    def get_listing_state(self):
+        # Pages names are all we need.
+        return {}
+
     def extract(self, filename, destination_dir):
         self._create_directory(destination_dir)
         destination_path = os.path.join(destination_dir, filename)
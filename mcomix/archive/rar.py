@@ -127,6 +127,12 @@ class RarArchive(archive_base.BaseArchive):
     def is_solid(self):
         return self._is_solid
 
+    def get_listing_state(self):
+        return { 'solid': self._is_solid }
+
+    def restore_listing_state(self, state):
+        self._is_solid = state['solid']
+
     def iter_contents(self):
         """ List archive contents. """
         self._close()
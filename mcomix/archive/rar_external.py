@@ -86,6 +86,19 @@ class RarArchive(archive_base.ExternalExecutableArchive):
     def is_solid(self):
         return self._is_solid
 
+    def get_listing_state(self):
+        state = super(RarArchive, self).get_listing_state()
+        state.update(solid=self._is_solid,
+                     encrypted=self._is_encrypted,
+                     contents=self._contents[:])
+        return state
+
+    def restore_listing_state(self, state):
+        super(RarArchive, self).restore_listing_state(state)
+        self._is_solid = state['solid']
+        self._is_encrypted = state['encrypted']
+        self._contents = state['contents'][:]
+
     def iter_contents(self):
         if not self._get_executable():
             return
@@ -7,6 +7,9 @@ import tarfile
 import archive_base
 
 class TarArchive(archive_base.NonUnicodeArchive):
+
+    support_in_memory_extraction = True
+
     def __init__(self, archive):
         super(TarArchive, self).__init__(archive)
         # Track if archive contents have been listed at least one time: this
@@ -39,13 +42,18 @@ class TarArchive(archive_base.NonUnicodeArchive):
         return [f for f in self.iter_contents()]
 
     def extract(self, filename, destination_dir):
+        content = self.read(filename)
+        new = self._create_file(os.path.join(destination_dir, filename))
+        new.write(content)
+        new.close()
+
+    def read(self, filename):
         if not self._contents_listed:
             self.list_contents()
-        new = self._create_file(os.path.join(destination_dir, filename))
         file_object = self.tar.extractfile(self._original_filename(filename))
-        new.write(file_object.read())
+        content = file_object.read()
         file_object.close()
-        new.close()
+        return content
 
     def iter_extract(self, entries, destination_dir):
         if not self._contents_listed:
@@ -53,6 +61,12 @@ class TarArchive(archive_base.NonUnicodeArchive):
         for f in super(TarArchive, self).iter_extract(entries, destination_dir):
             yield f
 
+    def iter_read(self, entries):
+        if not self._contents_listed:
+            self.list_contents()
+        for f in super(TarArchive, self).iter_read(entries):
+            yield f
+
     def close(self):
         if self.tar is not None:
             self.tar.close()
@@ -2,11 +2,16 @@
 
 """ Unicode-aware wrapper for zipfile.ZipFile. """
 
+import mmap
 import os
+import struct
+import threading
+import zlib
 from contextlib import closing
 
 from mcomix import log
 from mcomix.archive import archive_base
+from mcomix.archive import zip_index
 
 # Try to use czipfile if available as it's much faster at decryption.
 try:
@@ -16,9 +21,20 @@ except ImportError:
     import zipfile
 
 
+def is_zipfile(path):
+    """Check if the file at <path> is a ZIP archive. The central directory
+    index is kept for is_py_supported_zipfile and ZipArchive.
+    """
+    if zip_index.get_index(path) is not None:
+        return True
+    return zipfile.is_zipfile(path)
+
 def is_py_supported_zipfile(path):
     """Check if a given zipfile has all internal files stored with Python supported compression
     """
+    index = zip_index.get_index(path)
+    if index is not None:
+        return index.is_py_supported()
     # Use contextlib's closing for 2.5 compatibility
     with closing(zipfile.ZipFile(path, 'r')) as zip_file:
         for file_info in zip_file.infolist():
@@ -27,29 +43,69 @@ def is_py_supported_zipfile(path):
     return True
 
 class ZipArchive(archive_base.NonUnicodeArchive):
+
+    # Each extraction thread uses its own handle (see _get_zip).
+    support_concurrent_extractions = True
+    support_in_memory_extraction = True
+
     def __init__(self, archive):
         super(ZipArchive, self).__init__(archive)
-        self.zip = zipfile.ZipFile(archive, 'r')
-
-        # Encryption is supported starting with Python 2.6
-        self._encryption_supported = hasattr(self.zip, "setpassword")
+        # Handles of the threads reading from the archive.
+        self._thread_zip = threading.local()
+        self._zip_list = []
+        self._zip_lock = threading.Lock()
         self._password = None
 
+        # Plain archives are read straight from a memory map of the file
+        # (see _read_mapped), zipfile is used for all others.
+        self._index = zip_index.get_index(archive)
+        self._map = None
+        if self._index is not None and \
+           not self._index.is_encrypted() and \
+           self._index.is_py_supported():
+            fp = open(archive, 'rb')
+            try:
+                self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError), e:
+                log.debug('Could not map %s: %s', archive, e)
+            finally:
+                fp.close()
+        if self._map is None:
+            self.zip = zipfile.ZipFile(archive, 'r')
+            self._zip_list.append(self.zip)
+            # Encryption is supported starting with Python 2.6
+            self._encryption_supported = hasattr(self.zip, "setpassword")
+        else:
+            self.zip = None
+            self._encryption_supported = False
+
     def iter_contents(self):
         if self._encryption_supported and self._has_encryption():
             self._get_password()
             self.zip.setpassword(self._password)
 
-        for filename in self.zip.namelist():
+        if self.zip is None:
+            namelist = self._index.namelist()
+        else:
+            namelist = self.zip.namelist()
+        for filename in namelist:
             yield self._unicode_filename(filename)
 
     def extract(self, filename, destination_dir):
+        content = self.read(filename)
         new = self._create_file(os.path.join(destination_dir, filename))
-        content = self.zip.read(self._original_filename(filename))
         new.write(content)
         new.close()
 
-        zipinfo = self.zip.getinfo(self._original_filename(filename))
+    def read(self, filename):
+        if self.zip is None:
+            zipinfo = self._index.getinfo(self._original_filename(filename))
+            content = self._read_mapped(zipinfo)
+        else:
+            zip = self._get_zip()
+            content = zip.read(self._original_filename(filename))
+            zipinfo = zip.getinfo(self._original_filename(filename))
+
         if len(content) != zipinfo.file_size:
             log.warning(_('%(filename)s\'s extracted size is %(actual_size)d bytes,'
                 ' but should be %(expected_size)d bytes.'
@@ -57,14 +113,70 @@ class ZipArchive(archive_base.NonUnicodeArchive):
                 { 'filename' : filename, 'actual_size' : len(content),
                   'expected_size' : zipinfo.file_size })
 
+        return content
 
+    def get_listing_state(self):
+        if self._encryption_supported and self._has_encryption():
+            # The password is only set when listing.
+            return None
+        return super(ZipArchive, self).get_listing_state()
 
     def close(self):
-        self.zip.close()
+        with self._zip_lock:
+            for zip in self._zip_list:
+                zip.close()
+            self._zip_list = []
+        self._thread_zip = threading.local()
+        mapping, self._map = self._map, None
+        if mapping is not None:
+            mapping.close()
+
+    def _read_mapped(self, zipinfo):
+        """ Return the content of the member <zipinfo> (see
+        zip_index.ZipEntry) from the archive memory map. Contents are
+        copied out of the map, so they don't keep the archive open (and
+        can't fault if the file is modified). """
+        mapping = self._map
+        if mapping is None:
+            raise ValueError('archive is closed')
+        header_end = zipinfo.header_offset + zip_index.LOCAL_HEADER_SIZE
+        header = mapping[zipinfo.header_offset:header_end]
+        if len(header) != zip_index.LOCAL_HEADER_SIZE or \
+           header[:4] != zip_index.LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipfile('Bad magic number for file header')
+        fields = struct.unpack(zip_index.LOCAL_HEADER_FORMAT, header)
+        name_size, extra_size = fields[-2:]
+        start = header_end + name_size + extra_size
+        if start + zipinfo.compress_size > len(mapping):
+            raise zipfile.BadZipfile('Truncated file data')
+        if zipinfo.compress_type == zip_index.ZIP_DEFLATED:
+            # Negative window size: raw stream, without zlib header.
+            data = zlib.decompress(buffer(mapping, start, zipinfo.compress_size),
+                                   -15, max(zipinfo.file_size, 1))
+        else:
+            data = mapping[start:start + zipinfo.compress_size]
+        if zlib.crc32(data) & 0xffffffff != zipinfo.crc:
+            raise zipfile.BadZipfile('Bad CRC-32 for file %r' % zipinfo.filename)
+        return data
+
+    def _get_zip(self):
+        """ Return the handle of the calling thread, opening it if needed,
+        so concurrent reads don't share the same file object. """
+        zip = getattr(self._thread_zip, 'zip', None)
+        if zip is None:
+            zip = zipfile.ZipFile(self.archive, 'r')
+            if self._encryption_supported and self._password is not None:
+                zip.setpassword(self._password)
+            with self._zip_lock:
+                self._zip_list.append(zip)
+            self._thread_zip.zip = zip
+        return zip
 
     def _has_encryption(self):
         """ Checks all files in the archive for encryption.
         Returns True if at least one encrypted file was found. """
+        if self._index is not None:
+            return self._index.is_encrypted()
         for zipinfo in self.zip.infolist():
             if zipinfo.flag_bits & 0x1: # File is encrypted
                 return True
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+""" Index of the central directory of ZIP archives, shared between archive
+type detection and extraction. """
+
+from __future__ import with_statement
+
+import os
+import struct
+import threading
+from collections import namedtuple
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
+from mcomix import log
+
+#: Number of indexes kept in memory.
+MAX_INDEXES = 16
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+_END_OF_CENTRAL_DIRECTORY_FORMAT = '<4s4H2LH'
+_END_OF_CENTRAL_DIRECTORY_SIZE = struct.calcsize(_END_OF_CENTRAL_DIRECTORY_FORMAT)
+_END_OF_CENTRAL_DIRECTORY_SIGNATURE = 'PK\005\006'
+_ZIP64_LOCATOR_SIZE = 20
+_ZIP64_LOCATOR_SIGNATURE = 'PK\006\007'
+_CENTRAL_DIRECTORY_FORMAT = '<4s4B4HL2L5H2L'
+_CENTRAL_DIRECTORY_SIZE = struct.calcsize(_CENTRAL_DIRECTORY_FORMAT)
+_CENTRAL_DIRECTORY_SIGNATURE = 'PK\001\002'
+LOCAL_HEADER_FORMAT = '<4s2B4HL2L2H'
+LOCAL_HEADER_SIZE = struct.calcsize(LOCAL_HEADER_FORMAT)
+LOCAL_HEADER_SIGNATURE = 'PK\003\004'
+#: Maximum size of the archive comment.
+_MAX_COMMENT_SIZE = 0xffff
+
+#: Information about an archive member: offset of its local header,
+#: compression type, sizes, CRC and flags.
+ZipEntry = namedtuple('ZipEntry', 'filename header_offset compress_type '
+                      'compress_size file_size crc flag_bits')
+
+
+class UnsupportedZipFile(Exception):
+    """ Indicate a ZIP archive that can't be indexed (e.g. zip64 or multi-disk
+    archives): zipfile must be used instead. """
+    pass
+
+
+class ZipIndex(object):
+
+    """ Index of the members of a ZIP archive, built from its central
+    directory. Names are the same as the ones used by zipfile. """
+
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            entries = _read_central_directory(fp)
+        #: List of members, in the archive order.
+        self.entries = entries
+        self._entries = dict([(entry.filename, entry) for entry in entries])
+
+    def namelist(self):
+        return [entry.filename for entry in self.entries]
+
+    def getinfo(self, name):
+        """ Return the ZipEntry for member <name> (KeyError if not found). """
+        return self._entries[name]
+
+    def is_encrypted(self):
+        """ Return True if at least one member is encrypted. """
+        for entry in self.entries:
+            if entry.flag_bits & 0x1:
+                return True
+        return False
+
+    def is_py_supported(self):
+        """ Return True if all members are stored or deflated. """
+        for entry in self.entries:
+            if entry.compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+                return False
+        return True
+
+
+def _read_central_directory(fp):
+    """ Return the list of ZipEntry from the central directory of the
+    archive <fp>. Raise UnsupportedZipFile if it can't be read. """
+    fp.seek(0, os.SEEK_END)
+    file_size = fp.tell()
+    # Usually, there's no archive comment.
+    tail_size = min(file_size, _END_OF_CENTRAL_DIRECTORY_SIZE + _MAX_COMMENT_SIZE +
+                    _ZIP64_LOCATOR_SIZE)
+    fp.seek(file_size - tail_size)
+    tail = fp.read(tail_size)
+    position = len(tail) - _END_OF_CENTRAL_DIRECTORY_SIZE
+    while True:
+        position = tail.rfind(_END_OF_CENTRAL_DIRECTORY_SIGNATURE, 0, position + 4)
+        if -1 == position:
+            raise UnsupportedZipFile('no central directory')
+        record = tail[position:position + _END_OF_CENTRAL_DIRECTORY_SIZE]
+        if len(record) == _END_OF_CENTRAL_DIRECTORY_SIZE:
+            fields = struct.unpack(_END_OF_CENTRAL_DIRECTORY_FORMAT, record)
+            comment_size = fields[7]
+            if position + _END_OF_CENTRAL_DIRECTORY_SIZE + comment_size <= len(tail):
+                break
+        position -= 1
+    (signature, disk, directory_disk, disk_count, count,
+     directory_size, directory_offset, comment_size) = fields
+    if position >= _ZIP64_LOCATOR_SIZE and \
+       tail[position - _ZIP64_LOCATOR_SIZE:
+            position - _ZIP64_LOCATOR_SIZE + 4] == _ZIP64_LOCATOR_SIGNATURE:
+        raise UnsupportedZipFile('zip64 archive')
+    if 0 != disk or 0 != directory_disk or disk_count != count:
+        raise UnsupportedZipFile('multi-disk archive')
+    if 0xffffffff in (directory_size, directory_offset):
+        raise UnsupportedZipFile('zip64 archive')
+    record_offset = file_size - tail_size + position
+    # Data prepended to the archive (e.g. self-extracting archive).
+    concat = record_offset - directory_size - directory_offset
+    if concat < 0:
+        raise UnsupportedZipFile('invalid central directory')
+    fp.seek(directory_offset + concat)
+    directory = fp.read(directory_size)
+    if len(directory) != directory_size:
+        raise UnsupportedZipFile('truncated central directory')
+    entries = []
+    position = 0
+    while position < directory_size:
+        record = directory[position:position + _CENTRAL_DIRECTORY_SIZE]
+        if len(record) != _CENTRAL_DIRECTORY_SIZE or \
+           record[:4] != _CENTRAL_DIRECTORY_SIGNATURE:
+            raise UnsupportedZipFile('invalid central directory')
+        fields = struct.unpack(_CENTRAL_DIRECTORY_FORMAT, record)
+        flag_bits, compress_type = fields[5], fields[6]
+        crc, compress_size, file_size = fields[9:12]
+        name_size, extra_size, comment_size = fields[12:15]
+        header_offset = fields[18]
+        if 0xffffffff in (compress_size, file_size, header_offset):
+            raise UnsupportedZipFile('zip64 archive')
+        position += _CENTRAL_DIRECTORY_SIZE
+        filename = directory[position:position + name_size]
+        position += name_size + extra_size + comment_size
+        # Same as zipfile.ZipInfo.
+        null_byte = filename.find(chr(0))
+        if null_byte >= 0:
+            filename = filename[0:null_byte]
+        if os.sep != '/' and os.sep in filename:
+            filename = filename.replace(os.sep, '/')
+        if flag_bits & 0x800:
+            filename = filename.decode('utf-8')
+        entries.append(ZipEntry(filename, header_offset + concat,
+                                compress_type, compress_size, file_size,
+                                crc, flag_bits))
+    if len(entries) != count:
+        raise UnsupportedZipFile('invalid central directory')
+    return entries
+
+_indexes = OrderedDict() if OrderedDict is not None else {}
+_indexes_lock = threading.Lock()
+
+def get_index(path):
+    """ Return the ZipIndex of the ZIP archive at <path>, or None if <path>
+    is not a ZIP archive or can't be indexed (see UnsupportedZipFile).
+
+    Indexes of recently used archives are kept in memory, so the central
+    directory is only read once, e.g. when detecting the archive type, then
+    opening it. """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    path = os.path.abspath(path)
+    key = (stat.st_size, stat.st_mtime)
+    with _indexes_lock:
+        if path in _indexes:
+            cached_key, index = _indexes.pop(path)
+            if cached_key == key:
+                _indexes[path] = (cached_key, index)
+                return index
+    try:
+        index = ZipIndex(path)
+    except (UnsupportedZipFile, IOError, struct.error), e:
+        log.debug('Not indexing %s: %s', path, e)
+        index = None
+    with _indexes_lock:
+        _indexes[path] = (key, index)
+        while len(_indexes) > MAX_INDEXES:
+            if OrderedDict is not None:
+                _indexes.popitem(last=False)
+            else:
+                _indexes.popitem()
+    return index
+
+# vim: expandtab:sw=4:ts=4
@@ -30,13 +30,24 @@ class Extractor(object):
     def __init__(self):
         self._setupped = False
 
-    def setup(self, src, dst, type=None):
+    def setup(self, src, dst, type=None, blob_store=None, cached_book=None):
         """Setup the extractor with archive <src> and destination dir <dst>.
         Return a threading.Condition related to the is_ready() method, or
         None if the format of <src> isn't supported.
+
+        If <blob_store> (a blob_store.BlobStore) is specified, and the
+        archive format supports it, files are extracted to the store instead
+        of <dst>, keyed by the path they would have in <dst>.
+
+        If <cached_book> (an extraction_cache.CachedBook for <dst>) is
+        specified, files already extracted there are ready as soon as the
+        archive contents are listed, and files extracted to <dst> are
+        recorded in the cache.
         """
         self._src = src
         self._dst = dst
+        self._blob_store = blob_store
+        self._cached_book = cached_book
         self._files = []
         self._extracted = set()
         self._archive = archive_tools.get_recursive_archive_handler(src, dst, type=type)
@@ -158,7 +169,14 @@ class Extractor(object):
         if self._archive:
             self._archive.close()
 
-    def _extraction_finished(self, name):
+    def _in_memory(self):
+        """Return True if files are extracted to the blob store."""
+        return self._blob_store is not None and \
+                self._archive.support_in_memory_extraction
+
+    def _extraction_finished(self, name, on_disk=True):
+        if on_disk and self._cached_book is not None:
+            self._cached_book.add(name)
         with self._condition:
             self._files.remove(name)
             self._extracted.add(name)
@@ -174,6 +192,15 @@ class Extractor(object):
             files.sort()
 
         try:
+            if self._in_memory():
+                log.debug(u'Extracting from "%s" to memory: "%s"', self._src, '", "'.join(files))
+                for f, content in self._archive.iter_read(files):
+                    if self._extract_thread.must_stop():
+                        return
+                    in_memory = self._blob_store.put(os.path.join(self._dst, f),
+                                                     content)
+                    self._extraction_finished(f, on_disk=not in_memory)
+                return
             log.debug(u'Extracting from "%s" to "%s": "%s"', self._src, self._dst, '", "'.join(files))
             for f in self._archive.iter_extract(files, self._dst):
                 if self._extract_thread.must_stop():
@@ -194,9 +221,16 @@ class Extractor(object):
         returned by setup().
         """
 
+        on_disk = False
         try:
-            log.debug(u'Extracting from "%s" to "%s": "%s"', self._src, self._dst, name)
-            self._archive.extract(name, self._dst)
+            if self._in_memory():
+                log.debug(u'Extracting from "%s" to memory: "%s"', self._src, name)
+                on_disk = not self._blob_store.put(os.path.join(self._dst, name),
+                                                   self._archive.read(name))
+            else:
+                log.debug(u'Extracting from "%s" to "%s": "%s"', self._src, self._dst, name)
+                self._archive.extract(name, self._dst)
+                on_disk = True
 
         except Exception, ex:
             # Better to ignore any failed extractions (e.g. from a corrupt
@@ -208,7 +242,7 @@ class Extractor(object):
 
         if self._extract_thread.must_stop():
             return
-        self._extraction_finished(name)
+        self._extraction_finished(name, on_disk=on_disk)
 
     def _list_contents(self, archive):
         files = []
@@ -216,10 +250,23 @@ class Extractor(object):
             if self._list_thread.must_stop():
                 return
             files.append(f)
+        if self._cached_book is not None:
+            cached_files = self._cached_book.get_files().intersection(files)
+        else:
+            cached_files = set()
         with self._condition:
             self._files = files
+            # Files already extracted by a previous session are ready.
+            self._extracted.update(cached_files)
             self._contents_listed = True
+            self._condition.notifyAll()
         self.contents_listed(self, files)
+        if cached_files:
+            log.debug(u'%u file(s) from "%s" already extracted',
+                      len(cached_files), self._src)
+        for name in files:
+            if name in cached_files:
+                self.file_extracted(self, name)
 
 class ArchiveException(Exception):
     """ Indicate error during extraction operations. """
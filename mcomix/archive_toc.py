@@ -0,0 +1,131 @@
+"""archive_toc.py - Persistent cache of archives table of contents."""
+from __future__ import with_statement
+
+import cPickle
+import os
+import threading
+
+from mcomix import constants
+from mcomix import log
+
+try:
+    from sqlite3 import dbapi2
+except ImportError:
+    try:
+        from pysqlite2 import dbapi2
+    except ImportError:
+        log.warning( _('! Could neither find pysqlite2 nor sqlite3.') )
+        dbapi2 = None
+
+
+class TocCache(object):
+
+    """Cache of the table of contents of archives, as returned by
+    archive_recursive.RecursiveArchive.get_toc, so reopening an archive
+    does not need to list its contents again (which for some formats
+    means running an external program).
+
+    Entries are keyed by the archive path, size and modification time:
+    a modified archive is listed again.
+    """
+
+    #: Maximum number of archives kept in the database.
+    MAX_ARCHIVES = 5000
+
+    def __init__(self, database_path=constants.ARCHIVE_TOC_DATABASE_PATH):
+        self._database_path = database_path
+        self._con = None
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Return the table of contents of the archive at <path>, or None
+        if not cached (or modified since)."""
+        key = _get_key(path)
+        if key is None:
+            return None
+        path, size, mtime = key
+        with self._lock:
+            con = self._connect()
+            if con is None:
+                return None
+            try:
+                row = con.execute('''select size, mtime, toc from archive
+                                     where path = ?''', (path,)).fetchone()
+                if row is None or tuple(row[:2]) != (size, mtime):
+                    return None
+                con.execute('''update archive set accessed = julianday('now')
+                               where path = ?''', (path,))
+            except dbapi2.Error, e:
+                log.error(_('! Could not read archive contents cache: %s'), e)
+                return None
+        try:
+            toc = cPickle.loads(str(row[2]))
+        except Exception, e:
+            log.warning('! Invalid cached contents for %s: %s', path, e)
+            return None
+        log.debug('Loaded cached contents of %s', path)
+        return toc
+
+    def set(self, path, toc):
+        """Store the table of contents <toc> of the archive at <path>."""
+        key = _get_key(path)
+        if key is None:
+            return
+        path, size, mtime = key
+        data = buffer(cPickle.dumps(toc, cPickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            con = self._connect()
+            if con is None:
+                return
+            try:
+                con.execute('begin')
+                con.execute('''insert or replace into archive
+                               (path, size, mtime, accessed, toc)
+                               values (?, ?, ?, julianday('now'), ?)''',
+                            (path, size, mtime, data))
+                # Forget about the least recently accessed archives.
+                con.execute('''delete from archive where path not in (
+                               select path from archive
+                               order by accessed desc limit ?)''',
+                            (self.MAX_ARCHIVES,))
+                con.execute('commit')
+            except dbapi2.Error, e:
+                con.execute('rollback')
+                log.error(_('! Could not save archive contents: %s'), e)
+                return
+        log.debug('Saved contents of %s', path)
+
+    def _connect(self):
+        if self._con is None and dbapi2 is not None:
+            try:
+                self._con = dbapi2.connect(self._database_path,
+                    check_same_thread=False, isolation_level=None)
+                self._con.execute('''create table if not exists archive (
+                    path text primary key,
+                    size integer,
+                    mtime real,
+                    accessed real,
+                    toc blob)''')
+            except dbapi2.Error, e:
+                log.error(_('! Could not open archive contents cache: %s'), e)
+                self._con = None
+        return self._con
+
+
+def _get_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return os.path.abspath(path), stat.st_size, stat.st_mtime
+
+_cache = None
+
+def get_cache():
+    """Return the shared TocCache instance."""
+    global _cache
+    if _cache is None:
+        _cache = TocCache()
+    return _cache
+
+# vim: expandtab:sw=4:ts=4
@@ -3,11 +3,11 @@
 import os
 import re
 import shutil
-import zipfile
 import tarfile
 import tempfile
 import operator
 
+from mcomix import archive_toc
 from mcomix import image_tools
 from mcomix import constants
 from mcomix import log
@@ -125,7 +125,7 @@ def archive_mime_type(path):
             if not os.access(path, os.R_OK):
                 return None
 
-            if zipfile.is_zipfile(path):
+            if zip.is_zipfile(path):
                 if zip.is_py_supported_zipfile(path):
                     return constants.ZIP
                 else:
@@ -174,6 +174,13 @@ def get_archive_info(path):
     """Return a tuple (mime, num_pages, size) with info about the archive
     at <path>, or None if <path> doesn't point to a supported
     """
+    toc = archive_toc.get_cache().get(path)
+    if toc is not None:
+        # No need to open the archive.
+        num_pages = len(filter(image_tools.SUPPORTED_IMAGE_REGEX.search,
+                               toc['contents']))
+        return (toc['mime'], num_pages, os.stat(path).st_size)
+
     cleanup = []
     try:
         tmpdir = tempfile.mkdtemp(prefix=u'mcomix_archive_info.')
@@ -213,12 +220,28 @@ def get_archive_handler(path, type=None):
 def get_recursive_archive_handler(path, destination_dir, type=None):
     """ Same as <get_archive_handler> but the handler will transparently handle
     archives within archives.
+
+    The archive table of contents is cached (see archive_toc), so archives
+    already listed before are not listed again.
     """
+    toc = archive_toc.get_cache().get(path)
+    if toc is not None and type in (None, toc['mime']):
+        type = toc['mime']
+    else:
+        toc = None
+        if type is None:
+            type = archive_mime_type(path)
+            if type is None:
+                return None
     archive = get_archive_handler(path, type=type)
     if archive is None:
         return None
     # XXX: Deferred import to avoid circular dependency
     from mcomix.archive import archive_recursive
-    return archive_recursive.RecursiveArchive(archive, destination_dir)
+    archive = archive_recursive.RecursiveArchive(archive, destination_dir,
+                                                 mime=type)
+    if toc is not None:
+        archive.set_toc(toc)
+    return archive
  
 # vim: expandtab:sw=4:ts=4
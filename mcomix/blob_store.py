@@ -0,0 +1,100 @@
+"""blob_store.py - Memory bounded store for extracted files."""
+from __future__ import with_statement
+
+import errno
+import os
+import threading
+
+from mcomix import log
+
+
+class BlobStore(object):
+
+    """A thread-safe store for the content of files extracted from an
+    archive, so pages can be decoded straight from memory.
+
+    Contents are keyed by the path the file would have once extracted.
+    Once the store budget is reached, new files are written to their path
+    on disk instead, as if extracted normally. Files kept in memory are
+    only written to disk on demand, for consumers needing an actual file
+    (see materialize).
+    """
+
+    def __init__(self, max_size=0):
+        """Create a new empty store, with a budget of <max_size> bytes: a
+        value of 0 (or less) means all files are written to disk."""
+        self._max_size = max_size
+        self._size = 0
+        #: Map path > content.
+        self._blobs = {}
+        #: Set of paths kept in memory that were also written to disk.
+        self._materialized = set()
+        self._lock = threading.Lock()
+
+    def set_max_size(self, max_size):
+        """Set the store budget to <max_size> bytes. Files already stored
+        are kept, even if over the new budget."""
+        self._max_size = max_size
+
+    def get_size(self):
+        """Return the total size of the contents kept in memory."""
+        return self._size
+
+    def put(self, path, data):
+        """Store <data> as the content of the file at <path>, or write it
+        to <path> if over budget. Return True if kept in memory."""
+        with self._lock:
+            if self._size + len(data) <= self._max_size:
+                old_data = self._blobs.get(path)
+                if old_data is not None:
+                    self._size -= len(old_data)
+                self._blobs[path] = data
+                self._size += len(data)
+                return True
+        log.debug('Extraction store full, writing %s to disk', path)
+        _write_file(path, data)
+        return False
+
+    def get(self, path):
+        """Return the content of the file at <path> if kept in memory,
+        None otherwise."""
+        with self._lock:
+            return self._blobs.get(path)
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self._blobs
+
+    def materialize(self, path):
+        """Make sure the file at <path> exists on disk, writing it from
+        memory if needed, and return <path>."""
+        with self._lock:
+            data = self._blobs.get(path)
+            if data is not None and path not in self._materialized:
+                log.debug('Writing %s to disk', path)
+                _write_file(path, data)
+                self._materialized.add(path)
+        return path
+
+    def clear(self):
+        """Drop all the contents kept in memory."""
+        with self._lock:
+            self._blobs.clear()
+            self._materialized.clear()
+            self._size = 0
+
+
+def _write_file(path, data):
+    """Write <data> to <path>, making sure its directory exists."""
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            # Can happen with concurrent calls.
+            if e.errno != errno.EEXIST:
+                raise
+    with open(path, 'wb') as fp:
+        fp.write(data)
+
+# vim: expandtab:sw=4:ts=4
@@ -32,7 +32,8 @@ class Clipboard(gtk.Clipboard):
         if self._window.filehandler.file_loaded:
             # Get pixbuf for current page
             current_page_pixbufs = self._window.imagehandler.get_pixbufs(
-                2 if self._window.displayed_double() else 1) # XXX limited to at most 2 pages
+                2 if self._window.displayed_double() else 1, # XXX limited to at most 2 pages
+                full=True)
 
             if len(current_page_pixbufs) == 1:
                 pixbuf = current_page_pixbufs[ 0 ]
@@ -43,7 +44,8 @@ class Clipboard(gtk.Clipboard):
                         self._window.is_manga_mode )
 
             # Get path for current page
-            path = self._window.imagehandler.get_path_to_page()
+            path = self._window.filehandler.materialize(
+                self._window.imagehandler.get_path_to_page())
             self.copy(path, pixbuf)
 
     def _copy_windows(self, pixbuf, path):
@@ -13,12 +13,16 @@ VERSION = '1.3.dev0'
 HOME_DIR = tools.get_home_directory()
 CONFIG_DIR = tools.get_config_directory()
 DATA_DIR = tools.get_data_directory()
+CACHE_DIR = tools.get_cache_directory()
 
 BASE_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 THUMBNAIL_PATH = os.path.join(HOME_DIR, '.thumbnails/normal')
 LIBRARY_DATABASE_PATH = os.path.join(DATA_DIR, 'library.db')
 LASTPAGE_DATABASE_PATH = os.path.join(DATA_DIR, 'lastreadpage.db')
+GEOMETRY_DATABASE_PATH = os.path.join(DATA_DIR, 'geometry.db')
+ARCHIVE_TOC_DATABASE_PATH = os.path.join(DATA_DIR, 'archive_toc.db')
 LIBRARY_COVERS_PATH = os.path.join(DATA_DIR, 'library_covers')
+EXTRACTION_CACHE_PATH = os.path.join(CACHE_DIR, 'extracted')
 PREFERENCE_PATH = os.path.join(CONFIG_DIR, 'preferences.conf')
 KEYBINDINGS_CONF_PATH = os.path.join(CONFIG_DIR, 'keybindings.conf')
 
@@ -0,0 +1,503 @@
+"""continuous_view.py - Continuous vertical strip of pages."""
+
+import bisect
+import math
+import operator
+import gtk
+import gobject
+
+from mcomix.preferences import prefs
+from mcomix import constants
+from mcomix import image_tools
+from mcomix import layout
+from mcomix import log
+from mcomix import tools
+
+#: Delay (in milliseconds) before laying out the strip again when the
+#: geometry of some pages becomes known.
+RELAYOUT_DELAY = 100
+
+
+class ContinuousView(object):
+
+    """Displays all the pages of a book end to end, in a single vertical
+    strip that is scrolled through (e.g. for webtoons).
+
+    Pages are laid out from their indexed geometry (estimated for pages
+    not probed yet), but only the ones intersecting the viewport (plus a
+    margin) get a gtk.Image attached. The current page, and so decoding
+    and extraction priorities, follows the scroll position. Pages shown
+    at a huge size (e.g. long webtoon slices) are rendered by tiles.
+
+    Note: like the lens, page images are put directly in the main layout
+    area of the main window.
+    """
+
+    def __init__(self, window):
+        self._window = window
+        self._area = window._main_layout
+        self._hadjust, self._vadjust = window.get_scroll_adjustments()
+        #: Layout of the strip, None if not displayed.
+        self._layout = None
+        #: Size of the viewport used for the layout.
+        self._viewport_size = (0, 0)
+        #: Raw size (rotated), scaled size and rotation of each page.
+        self._sizes = []
+        self._scaled_sizes = []
+        self._rotations = []
+        #: Top and bottom of each page in the strip.
+        self._tops = []
+        self._bottoms = []
+        #: Set of page indices which size has been estimated.
+        self._estimated = set()
+        #: Map page index > attached gtk.Image.
+        self._images = {}
+        #: Detached gtk.Image widgets, kept for reuse.
+        self._free_images = []
+        #: Map page index > TiledRendering, for attached pages rendered
+        #: by tiles (drawn by the main window, see MainWindow._draw_tiles).
+        self._tiled = {}
+        #: Set of page indices displayed with their final rendering.
+        self._rendered = set()
+        #: Current page index and set of attached page indices last passed
+        #: to the renderer.
+        self._render_state = None
+        #: Last page made current by the view, and number of pages shown.
+        self._page = None
+        self._shown = 0
+        #: True while laying out, to ignore scroll changes.
+        self._drawing = False
+        #: Timeout source ID for laying out the strip again.
+        self._relayout_id = None
+
+        self._vadjust.connect('value-changed', self._scrolled)
+        window.imagehandler.page_available += self._page_available
+        window.imagehandler.page_decoded += self._page_decoded
+        window.imagehandler.page_probed += self._page_probed
+        window.renderer.page_rendered += self._page_rendered
+
+    def draw(self, scroll_to=None):
+        """Lay out all the pages and display the visible ones.
+
+        If the current page was changed from outside (e.g. page flipping),
+        scroll to its start (or end if <scroll_to> is SCROLL_TO_END).
+        Otherwise, the scroll position relative to the current page is
+        kept, so pages getting their real size do not move the view.
+        """
+        window = self._window
+        imagehandler = window.imagehandler
+        number_of_pages = imagehandler.get_number_of_pages()
+        current_page = imagehandler.get_current_page()
+        if not number_of_pages or not current_page:
+            self.clear()
+            return
+
+        index = current_page - 1
+        if self._layout is not None and current_page == self._page and \
+           index < len(self._tops):
+            anchor = self._get_anchor(index)
+        else:
+            anchor = None
+
+        if self._relayout_id is not None:
+            gobject.source_remove(self._relayout_id)
+            self._relayout_id = None
+
+        constraints = window.get_viewport_constraints()
+        imagehandler.set_decode_size(constraints[0])
+        self._layout_pages(number_of_pages, constraints)
+        log.debug('Laid out %u page(s) in strip, %u estimated',
+                  number_of_pages, len(self._estimated))
+
+        for image in window.images:
+            image.hide()
+            image.clear()
+            image.set_size_request(-1, -1)
+        window.set_tiled_pages([])
+        self._tiled.clear()
+        self._rendered.clear()
+        # The renderer state may have been reset (e.g. by a change of
+        # view parameters).
+        self._render_state = None
+
+        self._drawing = True
+        self._area.window.freeze_updates()
+        self._area.set_size(*self._layout.get_union_box().get_size())
+        width, height = self._viewport_size
+        union_width = self._layout.get_union_box().get_size()[0]
+        if anchor is not None:
+            y = self._get_anchored_position(index, anchor)
+        elif constants.SCROLL_TO_END == scroll_to:
+            y = self._bottoms[index] - height
+        else:
+            y = self._tops[index]
+        y = max(0, min(y, self._bottoms[-1] - height))
+        x = max(0, min(self._hadjust.get_value(), union_width - width))
+        self._hadjust.set_value(x)
+        self._vadjust.set_value(y)
+        self._page = current_page
+        self._update()
+        self._area.window.thaw_updates()
+        self._drawing = False
+
+    def clear(self):
+        """Remove the strip from the main layout area."""
+        if self._relayout_id is not None:
+            gobject.source_remove(self._relayout_id)
+            self._relayout_id = None
+        for index in self._images.keys():
+            self._detach(index)
+        self._layout = None
+        self._sizes = []
+        self._scaled_sizes = []
+        self._rotations = []
+        self._tops = []
+        self._bottoms = []
+        self._estimated.clear()
+        self._render_state = None
+        self._page = None
+        self._shown = 0
+
+    def get_visible_pages(self):
+        """Return the list of pages intersecting the viewport."""
+        if self._layout is None:
+            return []
+        top = int(self._vadjust.get_value())
+        first = bisect.bisect_right(self._bottoms, top)
+        last = bisect.bisect_left(self._tops, top + self._viewport_size[1])
+        return range(first + 1, last + 1)
+
+    def is_at_end(self):
+        """Return True if the end of the strip is visible."""
+        if self._layout is None:
+            return False
+        top = int(self._vadjust.get_value())
+        return top + self._viewport_size[1] >= self._bottoms[-1]
+
+    def _layout_pages(self, number_of_pages, constraints):
+        """Compute the strip layout for <constraints> (see
+        MainWindow.get_viewport_constraints)."""
+        size_list = [None] * number_of_pages
+        rotation_list = [0] * number_of_pages
+        self._estimated = set()
+        for index in xrange(number_of_pages):
+            known = self._get_page_size(index)
+            if known is None:
+                self._estimated.add(index)
+            else:
+                size_list[index], rotation_list[index] = known
+        self._estimate_sizes(size_list, rotation_list, constraints)
+        self._scaled_sizes = []
+        self._place_pages(size_list, rotation_list, constraints)
+
+    def _get_page_size(self, index):
+        """Return the size (rotated) and rotation of page <index>, or None
+        if its geometry is not known yet. Never blocks."""
+        window = self._window
+        imagehandler = window.imagehandler
+        page = index + 1
+        geometry = imagehandler.get_page_geometry(page, probe=False)
+        if geometry is not None:
+            size = [geometry.width, geometry.height]
+            rotation = geometry.rotation
+        else:
+            # Not indexed yet, but maybe already decoded.
+            pixbuf = imagehandler.get_cached_pixbuf(page)
+            if pixbuf is None:
+                return None
+            size = list(image_tools.get_original_size(pixbuf))
+            rotation = imagehandler.get_page_rotation(page)
+        if not prefs['auto rotate from exif']:
+            rotation = 0
+        if rotation in (90, 270):
+            size.reverse()
+        # Unlike spreads, each page is rotated on its own.
+        extra_rotation = (window.get_size_rotation(*size) +
+                          prefs['rotation']) % 360
+        if extra_rotation in (90, 270):
+            size.reverse()
+        return size, (rotation + extra_rotation) % 360
+
+    def _estimate_sizes(self, size_list, rotation_list, constraints):
+        """Fill in the size and rotation of the pages which geometry is
+        not known yet (see _estimated)."""
+        # Pages of unknown size are assumed to be like the previous ones
+        # (slices of a webtoon usually share the same width).
+        estimate = None
+        for index, size in enumerate(size_list):
+            if index not in self._estimated:
+                estimate = size
+                break
+        if estimate is None:
+            estimate = list(constraints[0])
+        for index in xrange(len(size_list)):
+            if index in self._estimated:
+                size_list[index] = list(estimate)
+                rotation_list[index] = prefs['rotation'] % 360
+            else:
+                estimate = size_list[index]
+
+    def _place_pages(self, size_list, rotation_list, constraints):
+        """Lay out pages of <size_list> in the strip. The scaled size of
+        pages which size did not change since the last layout is kept."""
+        window = self._window
+        # Fit each page on its own, adding the vertical scrollbar (and
+        # possibly the horizontal one) if needed.
+        viewport_size = ()
+        scrollbar_requests = [False] * len(constraints[1])
+        while True:
+            new_viewport_size = window.get_viewport_size(constraints,
+                                                          scrollbar_requests)
+            if new_viewport_size == viewport_size:
+                break
+            viewport_size = new_viewport_size
+            scaled_sizes = []
+            for index, size in enumerate(size_list):
+                if viewport_size == self._viewport_size and \
+                   index < len(self._scaled_sizes) and \
+                   size == self._sizes[index]:
+                    scaled_sizes.append(self._scaled_sizes[index])
+                    continue
+                scaled_sizes.append(window.zoom.get_zoomed_size(
+                    [size], viewport_size, constants.HEIGHT_AXIS)[0])
+            strip = layout.FiniteLayout(scaled_sizes,
+                                        viewport_size,
+                                        constants.WESTERN_ORIENTATION,
+                                        window.get_page_spacing(),
+                                        False,
+                                        constants.HEIGHT_AXIS,
+                                        constants.WIDTH_AXIS)
+            union_size = strip.get_union_box().get_size()
+            scrollbar_requests = map(operator.or_, scrollbar_requests,
+                tools.smaller(viewport_size, union_size))
+        window.show_scrollbars(scrollbar_requests)
+
+        self._layout = strip
+        window.layout = strip
+        self._viewport_size = viewport_size
+        self._sizes = size_list
+        self._scaled_sizes = scaled_sizes
+        self._rotations = rotation_list
+        self._tops = []
+        self._bottoms = []
+        for box in strip.get_content_boxes():
+            top = box.get_position()[1]
+            self._tops.append(top)
+            self._bottoms.append(top + box.get_size()[1])
+
+    def _get_anchor(self, index):
+        """Return the scroll position relative to page <index> (0 at its
+        top, 1 at its bottom)."""
+        top = self._tops[index]
+        return tools.div(self._vadjust.get_value() - top,
+                         max(1, self._bottoms[index] - top))
+
+    def _get_anchored_position(self, index, anchor):
+        """Return the scroll position at <anchor> (see _get_anchor) in
+        page <index>."""
+        return self._tops[index] + anchor * (self._bottoms[index] -
+                                             self._tops[index])
+
+    def _update(self):
+        """Attach the pages intersecting the viewport (plus a margin of half
+        a viewport on each side), detach the others, and make the page at
+        the top of the viewport the current one."""
+        window = self._window
+        top = int(self._vadjust.get_value())
+        height = self._viewport_size[1]
+        margin = height // 2
+        first = bisect.bisect_right(self._bottoms, top - margin)
+        last = bisect.bisect_left(self._tops, top + height + margin)
+        attached = frozenset(xrange(first, last))
+        current = min(bisect.bisect_right(self._bottoms, top),
+                      len(self._bottoms) - 1)
+        if (current, attached) != self._render_state:
+            # Attached pages are pinned in the render cache, and keep their
+            # pending final rendering while they stay attached.
+            self._render_state = (current, attached)
+            window.renderer.set_current(current, sorted(attached))
+
+        for index in self._images.keys():
+            if index not in attached:
+                self._detach(index)
+        boxes = self._layout.get_content_boxes()
+        for index in sorted(attached):
+            if index in self._rendered:
+                continue
+            image = self._images.get(index)
+            if image is None:
+                if self._free_images:
+                    image = self._free_images.pop()
+                else:
+                    image = gtk.Image()
+                    self._area.put(image, 0, 0)
+                self._images[index] = image
+            self._area.move(image, *boxes[index].get_position())
+            self._render(index)
+            image.show()
+
+        shown = max(1, bisect.bisect_left(self._tops, top + height) - current)
+        page = current + 1
+        if page == window.imagehandler.get_current_page() and \
+           shown == self._shown:
+            return
+        changed = page != window.imagehandler.get_current_page()
+        self._page = page
+        self._shown = shown
+        window.imagehandler.set_page(page, count=shown)
+        if changed:
+            window.page_changed()
+        scale = math.sqrt(tools.div(tools.volume(self._scaled_sizes[current]),
+                                    tools.volume(self._sizes[current])))
+        window.statusbar.set_resolution((list(self._sizes[current]) + [scale],))
+        window.statusbar.update()
+
+    def _render(self, index):
+        """Display page <index> in its image: its rendering if the page has
+        been decoded, a placeholder otherwise. A fast rendering may be shown
+        first, the final one is swapped in by _page_rendered."""
+        window = self._window
+        image = self._images[index]
+        size = self._scaled_sizes[index]
+        rotation = self._rotations[index]
+        pixbuf = None
+        if index not in self._estimated:
+            pixbuf = window.imagehandler.get_cached_pixbuf(index + 1)
+        if pixbuf is None:
+            window.set_placeholder(image, size)
+            return
+        if window.renderer.use_tiles(size):
+            # Tall slices: don't render them (and their fast rendering)
+            # at full size, only the tiles that are shown.
+            self._tiled[index] = window.renderer.render_tiled(index, pixbuf,
+                                                              size, rotation)
+            self._update_tiled_pages()
+            image.set_size_request(-1, -1)
+            image.clear()
+            self._rendered.add(index)
+            self._area.queue_draw()
+            return
+        pixbuf = window.renderer.render(index, pixbuf, size, rotation,
+                                        progressive=True)
+        if pixbuf is None:
+            # Not rendered yet (see Renderer.render).
+            window.set_placeholder(image, size, index + 1)
+            return
+        image.set_size_request(*size)
+        image.set_from_pixbuf(pixbuf)
+        if window.renderer.is_rendered(index, size, rotation):
+            self._rendered.add(index)
+
+    def _update_tiled_pages(self):
+        """Update the list of pages the main window draws by tiles."""
+        boxes = self._layout.get_content_boxes()
+        self._window.set_tiled_pages([(boxes[index].get_position(), tiled)
+                                      for index, tiled
+                                      in sorted(self._tiled.iteritems())])
+
+    def _detach(self, index):
+        image = self._images.pop(index)
+        image.hide()
+        image.clear()
+        image.set_size_request(-1, -1)
+        self._free_images.append(image)
+        self._rendered.discard(index)
+        if self._tiled.pop(index, None) is not None:
+            self._update_tiled_pages()
+
+    def _scrolled(self, adjustment):
+        if self._layout is None or self._drawing:
+            return
+        if not prefs['default continuous mode']:
+            return
+        self._update()
+
+    def _schedule_relayout(self):
+        if self._relayout_id is None:
+            self._relayout_id = gobject.timeout_add(RELAYOUT_DELAY,
+                                                    self._relayout)
+
+    def _relayout(self):
+        """Lay out the strip again once the real size of some estimated
+        pages is known. Only the pages which size changed are rendered
+        again, and the scroll position is kept relative to the current
+        page."""
+        self._relayout_id = None
+        if self._layout is None or not prefs['default continuous mode']:
+            return False
+        known = {}
+        for index in self._estimated:
+            page_size = self._get_page_size(index)
+            if page_size is not None:
+                known[index] = page_size
+        if not known:
+            return False
+        window = self._window
+        current = self._page - 1
+        anchor = self._get_anchor(current)
+        old_scaled_sizes = self._scaled_sizes
+        old_rotations = list(self._rotations)
+        size_list = list(self._sizes)
+        rotation_list = list(self._rotations)
+        for index, (size, rotation) in known.iteritems():
+            size_list[index], rotation_list[index] = size, rotation
+            self._estimated.discard(index)
+        constraints = window.get_viewport_constraints()
+        self._estimate_sizes(size_list, rotation_list, constraints)
+        self._place_pages(size_list, rotation_list, constraints)
+        log.debug('Laid out %u page(s) again in strip, %u estimated',
+                  len(known), len(self._estimated))
+
+        self._drawing = True
+        self._area.window.freeze_updates()
+        self._area.set_size(*self._layout.get_union_box().get_size())
+        boxes = self._layout.get_content_boxes()
+        for index, image in self._images.iteritems():
+            if self._scaled_sizes[index] != old_scaled_sizes[index] or \
+               self._rotations[index] != old_rotations[index]:
+                self._rendered.discard(index)
+                self._tiled.pop(index, None)
+            self._area.move(image, *boxes[index].get_position())
+        self._update_tiled_pages()
+        height = self._viewport_size[1]
+        y = self._get_anchored_position(current, anchor)
+        self._vadjust.set_value(max(0, min(y, self._bottoms[-1] - height)))
+        self._update()
+        self._area.window.thaw_updates()
+        self._drawing = False
+        if self._tiled:
+            self._area.queue_draw()
+        return False
+
+    def _page_available(self, page):
+        if self._layout is None:
+            return
+        if page - 1 in self._estimated and \
+           self._window.imagehandler.get_page_geometry(page,
+                                                       probe=False) is not None:
+            # Already indexed, otherwise it is probed in the background
+            # (see _page_probed).
+            self._schedule_relayout()
+
+    def _page_probed(self, page):
+        if self._layout is None:
+            return
+        if page - 1 in self._estimated:
+            self._schedule_relayout()
+
+    def _page_rendered(self, index):
+        if self._layout is None:
+            return
+        if index in self._images and index not in self._rendered:
+            self._render(index)
+
+    def _page_decoded(self, page):
+        if self._layout is None:
+            return
+        index = page - 1
+        if index in self._estimated:
+            self._schedule_relayout()
+        elif index in self._images and index not in self._rendered:
+            self._render(index)
+
+# vim: expandtab:sw=4:ts=4
@@ -60,6 +60,7 @@ class _CommentArea(gtk.VBox):
           self._edit_dialog.file_handler.get_number_of_comments() + 1):
 
             path = self._edit_dialog.file_handler.get_comment_name(num)
+            self._edit_dialog.file_handler.materialize(path)
             size = '%.1f KiB' % (os.stat(path).st_size / 1024.0)
             self._liststore.append([os.path.basename(path), size, path])
 
@@ -89,6 +89,9 @@ class _EditArchiveDialog(gtk.Dialog):
 
         image_files = self._image_area.get_file_listing()
         comment_files = self._comment_area.get_file_listing()
+        # Files extracted in memory must be written to disk for the packer.
+        for path in image_files + comment_files:
+            self._window.filehandler.materialize(path)
 
         try:
             fd, tmp_path = tempfile.mkstemp(
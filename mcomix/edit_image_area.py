@@ -86,6 +86,8 @@ class _ImageArea(gtk.ScrolledWindow):
         except KeyError:
             # Not a page from the current archive, ignore.
             pass
+        else:
+            self._window.filehandler.materialize(path)
         pixbuf = self._thumbnailer.thumbnail(path)
         if pixbuf is None:
             pixbuf = image_tools.MISSING_IMAGE_ICON
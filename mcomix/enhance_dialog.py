@@ -17,6 +17,8 @@ class _EnhanceImageDialog(gtk.Dialog):
         super(_EnhanceImageDialog, self).__init__(_('Enhance image'), window, 0)
 
         self._window = window
+        #: Map page > histogram data, for the current book.
+        self._histograms = {}
 
         reset = gtk.Button(None, gtk.STOCK_REVERT_TO_SAVED)
         reset.set_tooltip_text(_('Reset to defaults.'))
@@ -97,6 +99,7 @@ class _EnhanceImageDialog(gtk.Dialog):
         self.show_all()
 
     def _on_book_close(self):
+        self._histograms.clear()
         self.clear_histogram()
 
     def _on_page_change(self):
@@ -104,8 +107,12 @@ class _EnhanceImageDialog(gtk.Dialog):
             self.clear_histogram()
             return
         # XXX transitional(double page limitation)
-        pixbuf = self._window.imagehandler.get_pixbufs(1)[0]
-        self.draw_histogram(pixbuf)
+        page = self._window.imagehandler.get_current_page()
+        hist_data = self._histograms.get(page)
+        if hist_data is None:
+            pixbuf = self._window.imagehandler.get_pixbufs(1)[0]
+            hist_data = self._histograms[page] = histogram.get_histogram(pixbuf)
+        self._draw_histogram_data(hist_data)
 
     def _on_page_available(self, page_number):
         current_page_number = self._window.imagehandler.get_current_page()
@@ -114,7 +121,10 @@ class _EnhanceImageDialog(gtk.Dialog):
 
     def draw_histogram(self, pixbuf):
         """Draw a histogram representing <pixbuf> in the dialog."""
-        histogram_pixbuf = histogram.draw_histogram(pixbuf, text=False)
+        self._draw_histogram_data(histogram.get_histogram(pixbuf))
+
+    def _draw_histogram_data(self, hist_data):
+        histogram_pixbuf = histogram.draw_histogram_data(hist_data, text=False)
         self._hist_image.set_from_pixbuf(histogram_pixbuf)
 
     def clear_histogram(self):
@@ -31,7 +31,7 @@ class EventHandler(object):
         size = (event.width, event.height)
         if size != self._window.previous_size:
             self._window.previous_size = size
-            self._window.draw_image()
+            self._window.resize_redraw()
 
     def window_state_event(self, widget, event):
         is_fullscreen = self._window.is_fullscreen
@@ -176,6 +176,10 @@ class EventHandler(object):
             ['m'],
             self._window.actiongroup.get_action('manga_mode').activate)
 
+        manager.register('continuous_mode',
+            ['v'],
+            self._window.actiongroup.get_action('continuous_mode').activate)
+
         manager.register('invert_scroll',
             ['x'],
             self._window.actiongroup.get_action('invert_scroll').activate)
@@ -665,7 +669,7 @@ class EventHandler(object):
 
         # Scroll to the new position
         new_index = self._window.layout.scroll_smartly(max_scroll, backwards, swap_axes)
-        n = 2 if self._window.displayed_double() else 1 # XXX limited to at most 2 pages
+        n = len(self._window.layout.get_content_boxes())
 
         if new_index == -1:
             self._previous_page_with_protection()
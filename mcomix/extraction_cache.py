@@ -0,0 +1,267 @@
+"""extraction_cache.py - Persistent cache of files extracted from archives."""
+from __future__ import with_statement
+
+import cPickle
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+from mcomix import constants
+from mcomix import i18n
+from mcomix import log
+
+
+#: Suffix of the files listing the files cached for each book.
+MANIFEST_SUFFIX = '.manifest'
+
+#: Prefix of book directories being deleted.
+TRASH_PREFIX = 'trash.'
+
+
+class CachedBook(object):
+
+    """Files extracted from an archive to its directory in the cache (see
+    ExtractionCache.open)."""
+
+    def __init__(self, archive_path, directory, files):
+        #: Path to the archive.
+        self.archive_path = archive_path
+        #: Directory the archive files are extracted to.
+        self.directory = directory
+        #: Map name > size of the files already extracted.
+        self._files = files
+        self._lock = threading.Lock()
+
+    def get_files(self):
+        """Return the set of the names of the files already extracted, and
+        available in the book directory."""
+        with self._lock:
+            return set(self._files.iterkeys())
+
+    def add(self, name):
+        """Record that the file <name> was fully extracted to the book
+        directory."""
+        try:
+            size = os.stat(os.path.join(self.directory, name)).st_size
+        except OSError:
+            return
+        with self._lock:
+            self._files[name] = size
+
+    def _get_manifest(self):
+        with self._lock:
+            return {
+                'path': self.archive_path,
+                'files': dict(self._files),
+            }
+
+
+class ExtractionCache(object):
+
+    """On disk cache of the files extracted from archives, so reopening a
+    recently read book does not need to extract its pages again.
+
+    Each book has its own directory in the cache, keyed by the archive
+    path, size and modification time, and a manifest of the files fully
+    extracted so far. When the cache exceeds its budget, least recently
+    read books are evicted.
+
+    Closing a book (saving its manifest and evicting books) is done by a
+    background thread, using an index of the books size kept in memory:
+    the cache directory is only scanned once.
+    """
+
+    def __init__(self, directory=constants.EXTRACTION_CACHE_PATH, max_size=0):
+        """Create a new cache in <directory>, with a budget of <max_size>
+        bytes (0 disables the cache)."""
+        self._directory = directory
+        self._max_size = max_size
+        #: Map directory > number of times opened, for the books currently
+        #: open (a book can be reopened before its closing is done).
+        self._open_books = {}
+        #: Map directory > (access time, size) of the books in the cache,
+        #: None until the cache directory is scanned (see _get_books).
+        self._books = None
+        self._lock = threading.Lock()
+        #: Held while closing a book, so closings are done one at a time.
+        self._close_lock = threading.Lock()
+
+    def set_max_size(self, max_size):
+        """Set the cache budget to <max_size> bytes. If lower than before,
+        books are evicted when the next book is closed."""
+        self._max_size = max_size
+
+    def open(self, archive_path):
+        """Return a CachedBook for the archive at <archive_path>, or None
+        if the cache is disabled."""
+        if self._max_size <= 0:
+            return None
+        try:
+            stat = os.stat(archive_path)
+        except OSError:
+            return None
+        archive_path = os.path.abspath(archive_path)
+        key = hashlib.sha1(cPickle.dumps((i18n.to_utf8(archive_path),
+                                          stat.st_size, stat.st_mtime),
+                                         cPickle.HIGHEST_PROTOCOL))
+        directory = i18n.to_unicode(os.path.join(self._directory,
+                                                 key.hexdigest()))
+        # Before anything else, so the book can't be evicted meanwhile.
+        with self._lock:
+            self._open_books[directory] = self._open_books.get(directory, 0) + 1
+        files = {}
+        manifest = self._read_manifest(directory)
+        if manifest is not None:
+            for name, size in manifest['files'].iteritems():
+                try:
+                    if os.stat(os.path.join(directory, name)).st_size == size:
+                        files[name] = size
+                except OSError:
+                    pass
+            log.debug('Found %u cached file(s) for %s', len(files), archive_path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            # Update the book access time.
+            with open(directory + MANIFEST_SUFFIX, 'ab'):
+                pass
+            os.utime(directory + MANIFEST_SUFFIX, None)
+        except (IOError, OSError), e:
+            log.warning(_('! Could not use extraction cache: %s'), e)
+            with self._lock:
+                self._release_book(directory)
+            return None
+        return CachedBook(archive_path, directory, files)
+
+    def close(self, book):
+        """Save the manifest of <book>, and evict least recently read books
+        if the cache is over budget. This is done in a background thread."""
+        close_thread = threading.Thread(target=self._close_book,
+                                         args=(book.directory,
+                                               book._get_manifest()))
+        close_thread.name += '-close'
+        close_thread.setDaemon(False)
+        close_thread.start()
+
+    def _close_book(self, directory, manifest):
+        with self._close_lock:
+            size = self._write_manifest(directory, manifest)
+            books = self._get_books()
+            with self._lock:
+                books[directory] = (time.time(), size)
+                self._release_book(directory)
+            self._evict(books)
+
+    def _release_book(self, directory):
+        """Record that the book in <directory> was closed. Must be called
+        with the lock held."""
+        count = self._open_books.pop(directory, 0) - 1
+        if count > 0:
+            self._open_books[directory] = count
+
+    def _read_manifest(self, directory):
+        try:
+            with open(directory + MANIFEST_SUFFIX, 'rb') as fp:
+                return cPickle.load(fp)
+        except Exception:
+            return None
+
+    def _write_manifest(self, directory, manifest):
+        """Write <manifest> for the book in <directory>, and return the
+        book size."""
+        manifest['size'] = _get_directory_size(directory)
+        tmp_path = directory + MANIFEST_SUFFIX + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as fp:
+                cPickle.dump(manifest, fp, cPickle.HIGHEST_PROTOCOL)
+            if os.path.exists(directory + MANIFEST_SUFFIX):
+                # Win32 fails on rename otherwise.
+                os.unlink(directory + MANIFEST_SUFFIX)
+            os.rename(tmp_path, directory + MANIFEST_SUFFIX)
+        except (IOError, OSError), e:
+            log.warning(_('! Could not save extraction cache manifest: %s'), e)
+        return manifest['size']
+
+    def _get_books(self):
+        """Return the index of the books in the cache, scanning the cache
+        directory the first time."""
+        if self._books is not None:
+            return self._books
+        books = {}
+        try:
+            names = os.listdir(self._directory)
+        except OSError:
+            names = []
+        for name in names:
+            directory = os.path.join(self._directory, name)
+            if name.startswith(TRASH_PREFIX):
+                # Left over by an interrupted deletion.
+                _thread_delete(directory)
+                continue
+            if name.endswith(MANIFEST_SUFFIX) or not os.path.isdir(directory):
+                continue
+            manifest = self._read_manifest(directory)
+            if manifest is None:
+                # Incomplete book (e.g. after a crash): remove first.
+                books[directory] = (0, 0)
+                continue
+            accessed = os.stat(directory + MANIFEST_SUFFIX).st_mtime
+            books[directory] = (accessed, manifest.get('size', 0))
+        self._books = books
+        return books
+
+    def _evict(self, books):
+        """Remove least recently read books (from the index <books>, see
+        _get_books) until the cache is within budget."""
+        with self._lock:
+            total_size = sum([size for accessed, size in books.itervalues()])
+            candidates = sorted([(accessed, size, directory)
+                                 for directory, (accessed, size)
+                                 in books.iteritems()
+                                 if directory not in self._open_books])
+            for accessed, size, directory in candidates:
+                if total_size <= self._max_size and 0 != accessed:
+                    break
+                log.debug('Evicting %s from extraction cache', directory)
+                self._remove_book(directory)
+                del books[directory]
+                total_size -= size
+
+    def _remove_book(self, directory):
+        try:
+            if os.path.exists(directory + MANIFEST_SUFFIX):
+                os.unlink(directory + MANIFEST_SUFFIX)
+            # Rename first, so the book can be extracted again while the
+            # old directory is deleted.
+            trash = os.path.join(self._directory, TRASH_PREFIX +
+                                 os.path.basename(directory) +
+                                 '.%u' % int(time.time() * 1000))
+            os.rename(directory, trash)
+        except OSError, e:
+            log.warning(_('! Could not remove %s from extraction cache: %s'),
+                        directory, e)
+            return
+        _thread_delete(trash)
+
+
+def _get_directory_size(directory):
+    """Return the total size of the files under <directory>."""
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for name in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return size
+
+def _thread_delete(path):
+    """Remove the directory tree at <path> in a background thread."""
+    del_thread = threading.Thread(target=shutil.rmtree, args=(path, True))
+    del_thread.name += '-delete'
+    del_thread.setDaemon(False)
+    del_thread.start()
+
+# vim: expandtab:sw=4:ts=4
@@ -12,6 +12,8 @@ import gtk
 from mcomix.preferences import prefs
 from mcomix import archive_extractor
 from mcomix import archive_tools
+from mcomix import blob_store
+from mcomix import extraction_cache
 from mcomix import image_tools
 from mcomix import tools
 from mcomix import constants
@@ -48,12 +50,20 @@ class FileHandler(object):
         self._base_path = None
         #: Temporary directory used for extracting archives.
         self._tmp_dir = None
+        #: Persistent cache of extracted files.
+        self._extraction_cache = extraction_cache.ExtractionCache(
+            max_size=prefs['extraction cache size'] * 1024 * 1024)
+        #: Cached files of the current archive, if the cache is used
+        #: (in which case extracted files are not deleted on close).
+        self._cached_book = None
         #: If C{True}, no longer wait for files to get extracted.
         self._stop_waiting = False
         #: List of comment files inside of the currently opened archive.
         self._comment_files = []
         #: Mapping of absolute paths to archive path names.
         self._name_table = {}
+        #: Contents of archive files extracted in memory.
+        self._blob_store = blob_store.BlobStore()
         #: Archive extractor.
         self._extractor = archive_extractor.Extractor()
         self._extractor.file_extracted += self._extracted_file
@@ -206,6 +216,8 @@ class FileHandler(object):
             self.update_last_read_page()
             if self.archive_type is not None:
                 self._extractor.close()
+                self._blob_store.clear()
+            self._window.renderer.cleanup()
             self._window.imagehandler.cleanup()
             self.file_loaded = False
             self.file_loading = False
@@ -220,9 +232,12 @@ class FileHandler(object):
         while gtk.events_pending():
             gtk.main_iteration_do(False)
         tools.garbage_collect()
-        if self._tmp_dir is not None:
+        if self._cached_book is not None:
+            self._extraction_cache.close(self._cached_book)
+            self._cached_book = None
+        elif self._tmp_dir is not None:
             self.thread_delete(self._tmp_dir)
-            self._tmp_dir = None
+        self._tmp_dir = None
 
     def _initialize_fileprovider(self, path, keep_fileprovider):
         """ Creates the L{file_provider.FileProvider} for C{path}.
@@ -278,12 +293,19 @@ class FileHandler(object):
 
         @return: A tuple containing C{(image_files, image_index)}. """
 
-        self._tmp_dir = tempfile.mkdtemp(prefix=u'mcomix.', suffix=os.sep)
+        self._cached_book = self._extraction_cache.open(path)
+        if self._cached_book is not None:
+            self._tmp_dir = self._cached_book.directory
+        else:
+            self._tmp_dir = tempfile.mkdtemp(prefix=u'mcomix.', suffix=os.sep)
         self._base_path = path
+        self._blob_store.set_max_size(prefs['max extraction memory size'] * 1024 * 1024)
         try:
             self._condition = self._extractor.setup(self._base_path,
                                                 self._tmp_dir,
-                                                self.archive_type)
+                                                self.archive_type,
+                                                blob_store=self._blob_store,
+                                                cached_book=self._cached_book)
         except Exception:
             self._condition = None
             raise
@@ -409,6 +431,9 @@ class FileHandler(object):
         readable.
         """
         self._wait_on_comment(num)
+        text = self._blob_store.get(self._comment_files[num - 1])
+        if text is not None:
+            return text
         try:
             fd = open(self._comment_files[num - 1], 'r')
             text = fd.read()
@@ -421,6 +446,29 @@ class FileHandler(object):
         """Return the filename of comment <num>."""
         return self._comment_files[num - 1]
 
+    def get_file_data(self, path):
+        """Return the content of the file at <path> if it was extracted
+        in memory, None otherwise (i.e. it must be read from disk)."""
+        return self._blob_store.get(path)
+
+    def materialize(self, path):
+        """Make sure the file at <path> exists on disk, even if it was
+        extracted in memory, and return <path>. Must be used before handing
+        the path of an extracted file to code needing an actual file."""
+        if path is not None and self.archive_type is not None:
+            self._blob_store.materialize(path)
+        return path
+
+    def set_extraction_memory_size(self, size):
+        """Set the maximum amount of memory used by files extracted in
+        memory to <size> MiB (0 to always extract to disk)."""
+        self._blob_store.set_max_size(size * 1024 * 1024)
+
+    def set_extraction_cache_size(self, size):
+        """Set the maximum amount of disk space used by the persistent
+        cache of extracted files to <size> MiB (0 to disable it)."""
+        self._extraction_cache.set_max_size(size * 1024 * 1024)
+
     def update_comment_extensions(self):
         """Update the regular expression used to filter out comments in
         archives by their filename.
@@ -441,6 +489,12 @@ class FileHandler(object):
         else:
             return None
 
+    def get_archive_member(self, path):
+        """Return the name of the archive member extracted to <path>,
+        or <path> itself if the current file is not an archive.
+        """
+        return self._name_table.get(path, path)
+
     def get_base_filename(self):
         """Return the filename of the current base (archive filename or
         directory name).
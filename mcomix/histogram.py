@@ -1,11 +1,34 @@
 """histogram.py - Draw histograms (RGB) from pixbufs."""
 
+import math
 import PIL.Image as Image
 import PIL.ImageDraw as ImageDraw
 import PIL.ImageOps as ImageOps
 
 from mcomix import image_tools
 
+#: Histograms of bigger pixbufs are estimated from a view downsampled to
+#: about this number of pixels.
+MAX_PIXELS = 256 * 1024
+
+def get_histogram(pixbuf):
+    """Return the histogram of <pixbuf>, as a list of 768 values (256 for
+    each of the red, green and blue channels).
+
+    For big pixbufs, the histogram is computed from a downsampled view,
+    and scaled back to the number of pixels of <pixbuf>.
+    """
+    im = image_tools.pixbuf_to_pil(pixbuf)
+    width, height = im.size
+    pixels = width * height
+    if pixels <= MAX_PIXELS:
+        return im.histogram()[:768]
+    scale = math.sqrt(float(MAX_PIXELS) / pixels)
+    im = im.resize((max(1, int(width * scale)), max(1, int(height * scale))),
+                   Image.NEAREST)
+    ratio = float(pixels) / (im.size[0] * im.size[1])
+    return [int(count * ratio + 0.5) for count in im.histogram()[:768]]
+
 def draw_histogram(pixbuf, height=170, fill=170, text=True):
     """Draw a histogram from <pixbuf> and return it as another pixbuf.
 
@@ -17,41 +40,49 @@ def draw_histogram(pixbuf, height=170, fill=170, text=True):
     If <text> is True a label with the maximum pixel value will be added to
     one corner.
     """
-    im = Image.new('RGB', (258, height - 4), (30, 30, 30))
-    hist_data = image_tools.pixbuf_to_pil(pixbuf).histogram()
+    return draw_histogram_data(get_histogram(pixbuf), height, fill, text)
+
+def draw_histogram_data(hist_data, height=170, fill=170, text=True):
+    """Same as draw_histogram, from a histogram as returned by get_histogram."""
+    size = (258, height - 4)
+    bottom = height - 5
     maximum = max(hist_data[:768] + [1])
     y_scale = float(height - 6) / maximum
-    r = [int(hist_data[n] * y_scale) for n in xrange(256)]
-    g = [int(hist_data[n] * y_scale) for n in xrange(256, 512)]
-    b = [int(hist_data[n] * y_scale) for n in xrange(512, 768)]
-    im_data = im.getdata()
-    # Draw the filling colours
-    for x in xrange(256):
-        for y in xrange(1, max(r[x], g[x], b[x]) + 1):
-            r_px = y <= r[x] and fill or 0
-            g_px = y <= g[x] and fill or 0
-            b_px = y <= b[x] and fill or 0
-            im_data.putpixel((x + 1, height - 5 - y), (r_px, g_px, b_px))
-    # Draw the outlines
-    for x in xrange(1, 256):
-        for y in range(r[x-1] + 1, r[x] + 1) + [r[x]] * (r[x] != 0):
-            r_px, g_px, b_px = im_data.getpixel((x + 1, height - 5 - y))
-            im_data.putpixel((x + 1, height - 5 - y), (255, g_px, b_px))
-        for y in range(r[x] + 1, r[x-1] + 1):
-            r_px, g_px, b_px = im_data.getpixel((x, height - 5 - y))
-            im_data.putpixel((x, height - 5 - y), (255, g_px, b_px))
-        for y in range(g[x-1] + 1, g[x] + 1) + [g[x]] * (g[x] != 0):
-            r_px, g_px, b_px = im_data.getpixel((x + 1, height - 5 - y))
-            im_data.putpixel((x + 1, height - 5 - y), (r_px, 255, b_px))
-        for y in range(g[x] + 1, g[x-1] + 1):
-            r_px, g_px, b_px = im_data.getpixel((x, height - 5 - y))
-            im_data.putpixel((x, height - 5 - y), (r_px, 255, b_px))
-        for y in range(b[x-1] + 1, b[x] + 1) + [b[x]] * (b[x] != 0):
-            r_px, g_px, b_px = im_data.getpixel((x + 1, height - 5 - y))
-            im_data.putpixel((x + 1, height - 5 - y), (r_px, g_px, 255))
-        for y in range(b[x] + 1, b[x-1] + 1):
-            r_px, g_px, b_px = im_data.getpixel((x, height - 5 - y))
-            im_data.putpixel((x, height - 5 - y), (r_px, g_px, 255))
+    channels = [[int(hist_data[n] * y_scale)
+                 for n in xrange(256 * channel, 256 * (channel + 1))]
+                for channel in xrange(3)]
+    # The graphs are drawn over the area covered by the highest one...
+    mask = Image.new('L', size, 0)
+    draw = ImageDraw.Draw(mask)
+    for x, values in enumerate(zip(*channels)):
+        value = max(values)
+        if value:
+            draw.line(((x + 1, bottom - value), (x + 1, bottom - 1)),
+                      fill=255)
+    # ...each channel on its own layer, then the layers are merged.
+    layers = []
+    for values in channels:
+        layer = Image.new('L', size, 0)
+        draw = ImageDraw.Draw(layer)
+        # Fill the graph...
+        for x, value in enumerate(values):
+            if value:
+                draw.line(((x + 1, bottom - value), (x + 1, bottom - 1)),
+                          fill=fill)
+        # ...and outline it, with vertical steps between columns.
+        for x in xrange(1, 256):
+            previous, value = values[x - 1], values[x]
+            if value > previous:
+                draw.line(((x + 1, bottom - value),
+                           (x + 1, bottom - previous - 1)), fill=255)
+            elif value:
+                draw.point((x + 1, bottom - value), fill=255)
+            if value < previous:
+                draw.line(((x, bottom - previous),
+                           (x, bottom - value - 1)), fill=255)
+        layers.append(layer)
+    im = Image.new('RGB', size, (30, 30, 30))
+    im.paste(Image.merge('RGB', layers), None, mask)
     if text:
         maxstr = 'max: ' + str(maximum)
         draw = ImageDraw.Draw(im)
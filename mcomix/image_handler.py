@@ -1,7 +1,11 @@
 """image_handler.py - Image handler that takes care of cacheing and giving out images."""
 
+from __future__ import with_statement
+
 import os
+import threading
 import traceback
+from cStringIO import StringIO
 
 from mcomix.preferences import prefs
 from mcomix import i18n
@@ -11,8 +15,20 @@ from mcomix import thumbnail_tools
 from mcomix import constants
 from mcomix import callback
 from mcomix import log
+from mcomix import page_geometry
+from mcomix import pixbuf_cache
+from mcomix import prefetch
 from mcomix.worker_thread import WorkerThread
 
+def _covers(pixbuf, size):
+    """Return True if <pixbuf> is big enough for <size> (see
+    image_tools.load_pixbuf_reduced), None meaning full resolution."""
+    if not image_tools.is_reduced(pixbuf):
+        return True
+    if size is None:
+        return False
+    return pixbuf.get_width() >= size[0] and pixbuf.get_height() >= size[1]
+
 class ImageHandler(object):
 
     """The FileHandler keeps track of images, pages, caches and reads files.
@@ -31,9 +47,11 @@ class ImageHandler(object):
         #: Reference to main window
         self._window = window
 
-        #: Caching thread
-        self._thread = WorkerThread(self._cache_pixbuf, name='image',
-                                    sort_orders=True)
+        #: Caching threads
+        self._thread = self._create_thread()
+        #: Map page index > Event set once decoded, for pages being decoded
+        self._decoding = {}
+        self._decoding_lock = threading.Lock()
 
         #: Archive path, if currently opened file is archive
         self._base_path = None
@@ -41,76 +59,260 @@ class ImageHandler(object):
         self._image_files = None
         #: Index of current page
         self._current_image_index = None
+        #: Number of pages displayed from the current one in continuous mode
+        self._displayed_count = 1
         #: Set of images reading for decoding (i.e. already extracted)
         self._available_images = set()
         #: List of pixbufs we want to cache
         self._wanted_pixbufs = []
-        #: Pixbuf map from page > Pixbuf
-        self._raw_pixbufs = {}
+        #: Pixbuf cache from page > Pixbuf
+        self._raw_pixbufs = pixbuf_cache.PixbufCache(name='page')
+        self.set_cache_size(prefs['max page cache size'])
         #: How many pages to keep in cache
         self._cache_pages = prefs['max pages to cache']
-
+        #: Decides which pages to get ready, from the navigation history
+        self._prefetcher = prefetch.Prefetcher()
+        #: Map page index > time it is due for display (see set_deadlines)
+        self._deadlines = {}
+        #: Size pages must at least cover when decoded at reduced size,
+        #: None for always decoding at full resolution
+        self._decode_size = None
+        #: Pages geometry index
+        self._geometry = page_geometry.GeometryIndex(
+            self._probe_geometry, probed=self._geometry_probed)
+
+        self._window.filehandler.file_opened += self._file_opened
         self._window.filehandler.file_available += self._file_available
 
-    def _get_pixbuf(self, index):
+    def _create_thread(self):
+        """Return a new pool of caching threads."""
+        return WorkerThread(self._cache_pixbuf, name='image',
+                            max_threads=prefs['max decode threads'],
+                            sort_orders=True,
+                            get_deadline=self._get_order_deadline)
+
+    def _get_decode_size(self, full=False, min_size=None):
+        """Return the size a page must cover when decoded (see
+        set_decode_size), or None for full resolution. <min_size> can be
+        used to ask for a bigger size than the default one."""
+        if full or self._decode_size is None:
+            return None
+        if min_size is None:
+            return self._decode_size
+        return tuple(map(max, self._decode_size, min_size))
+
+    def _get_pixbuf(self, index, full=False, min_size=None):
         """Return the pixbuf indexed by <index> from cache.
         Pixbufs not found in cache are fetched from disk first.
+        If the page is already being decoded by another thread,
+        wait for it instead of decoding it a second time.
+
+        If <full> is True, the pixbuf is at full resolution; otherwise it
+        may have been decoded at a reduced size covering <min_size> and
+        the current decode size (see set_decode_size).
         """
-        pixbuf = image_tools.MISSING_IMAGE_ICON
+        decode_size = self._get_decode_size(full, min_size)
+        pixbuf = self._raw_pixbufs.get(index)
+        if pixbuf is not None and _covers(pixbuf, decode_size):
+            return pixbuf
 
-        if index not in self._raw_pixbufs:
-            self._wait_on_page(index + 1)
+        self._wait_on_page(index + 1)
 
-            try:
-                pixbuf = image_tools.load_pixbuf(self._image_files[index])
-                self._raw_pixbufs[index] = pixbuf
-                tools.garbage_collect()
-            except Exception, e:
-                self._raw_pixbufs[index] = image_tools.MISSING_IMAGE_ICON
-                log.error('Could not load pixbuf for page %u: %r', index + 1, e)
-        else:
-            try:
-                pixbuf = self._raw_pixbufs[index]
-            except Exception:
-                pass
+        with self._decoding_lock:
+            decoded = self._decoding.get(index)
+            owner = decoded is None
+            if owner:
+                decoded = self._decoding[index] = threading.Event()
+
+        if not owner:
+            decoded.wait()
+            # May have been evicted already, or decoded at a smaller size.
+            return self._get_pixbuf(index, full=full, min_size=min_size)
 
+        try:
+            path = self._image_files[index]
+            data = self._window.filehandler.get_file_data(path)
+            if data is not None:
+                # Extracted in memory.
+                if decode_size is None:
+                    pixbuf = image_tools.load_pixbuf_data(data)
+                else:
+                    pixbuf = image_tools.load_pixbuf_data_reduced(data, *decode_size)
+                data = None
+            elif decode_size is None:
+                pixbuf = image_tools.load_pixbuf(path)
+            else:
+                pixbuf = image_tools.load_pixbuf_reduced(path, *decode_size)
+            self._raw_pixbufs[index] = pixbuf
+            tools.garbage_collect()
+        except Exception, e:
+            pixbuf = image_tools.MISSING_IMAGE_ICON
+            self._raw_pixbufs[index] = pixbuf
+            log.error('Could not load pixbuf for page %u: %r', index + 1, e)
+        finally:
+            with self._decoding_lock:
+                del self._decoding[index]
+            decoded.set()
+
+        if pixbuf is not image_tools.MISSING_IMAGE_ICON:
+            self._record_geometry(index, pixbuf)
+            if prefs['smart bg'] or prefs['smart thumb bg']:
+                # While still in the decoding thread.
+                self._get_edge_colours(index, pixbuf)
+        self.page_decoded(index + 1)
         return pixbuf
 
-    def get_pixbufs(self, number_of_bufs):
+    def _probe_geometry(self, path):
+        """Return the geometry of the image at <path>, see
+        image_tools.get_image_geometry."""
+        data = self._window.filehandler.get_file_data(path)
+        if data is not None:
+            geometry = image_tools.get_image_geometry(StringIO(data))
+            if 0 != geometry[1]:
+                return geometry
+            # Not supported by PIL: needs an actual file.
+            self._window.filehandler.materialize(path)
+        return image_tools.get_image_geometry(path)
+
+    def _geometry_probed(self, name, path):
+        """Called from the geometry thread once the geometry of the page
+        at <path> has been probed in the background."""
+        try:
+            index = self._image_files.index(path)
+        except (AttributeError, ValueError):
+            # Not a page of the current book anymore.
+            return
+        self.page_probed(index + 1)
+
+    @callback.Callback
+    def page_probed(self, page):
+        """ Called whenever the geometry of a page has been probed in the
+        background (see get_page_geometry). """
+        pass
+
+    def _record_geometry(self, index, pixbuf):
+        """Make sure the geometry of page <index> is indexed once decoded
+        to <pixbuf>, so its orientation is only resolved once."""
+        path = self._image_files[index]
+        name = self._window.filehandler.get_archive_member(path)
+        if self._geometry.get(name) is not None:
+            return
+        geometry = self._geometry.probe(name, path, wait=True)
+        if geometry is None or 0 == geometry.width:
+            # Not supported by the probe: use what was decoded.
+            width, height = image_tools.get_original_size(pixbuf)
+            self._geometry.set(name, page_geometry.PageGeometry(
+                None if geometry is None else geometry.format, width, height,
+                image_tools.get_implied_rotation(pixbuf)))
+
+    def get_cached_pixbuf(self, page, min_size=None):
+        """Return the pixbuf of <page> if already decoded (covering the
+        current decode size and <min_size>), None otherwise. Never blocks."""
+        pixbuf = self._raw_pixbufs.get(page - 1)
+        if pixbuf is not None and \
+           _covers(pixbuf, self._get_decode_size(min_size=min_size)):
+            return pixbuf
+        return None
+
+    def decode_pages(self, page, number_of_pages, min_size=None):
+        """Ask for the <number_of_pages> pages starting at <page> to be
+        decoded in the background (covering <min_size>, see get_pixbufs),
+        ahead of other caching orders. page_decoded is emitted for each one
+        once ready. Pages not extracted yet are left to do_cacheing."""
+        orders = []
+        for index in range(page - 1, page - 1 + number_of_pages):
+            if index in self._available_images and \
+               self.get_cached_pixbuf(index + 1, min_size=min_size) is None:
+                orders.append((-1, index, min_size))
+        if len(orders) > 0:
+            self._thread.extend_orders(orders)
+
+    @callback.Callback
+    def page_decoded(self, page):
+        """ Called whenever the pixbuf of a page has been decoded and
+        stored in cache. """
+        pass
+
+    def set_cache_size(self, size):
+        """Set the maximum size of the page cache to <size> MiB
+        (0 means no limit)."""
+        self._raw_pixbufs.set_max_size(size * 1024 * 1024)
+
+    def set_decode_size(self, size):
+        """Set the size (width, height) pages must at least cover when
+        decoded, or None for decoding at full resolution. Only used if
+        the 'decode at display size' preference is set."""
+        if not prefs['decode at display size']:
+            size = None
+        if size is not None:
+            # Make it independent of rotations.
+            size = (max(size),) * 2
+        self._decode_size = size
+
+    def get_pixbufs(self, number_of_bufs, page=None, full=False, min_size=None):
         """Returns number_of_bufs pixbufs for the image(s) that should be
-        currently displayed. This method might fetch images from disk, so make
-        sure that number_of_bufs is as small as possible.
+        currently displayed (or starting at <page> if specified). This method
+        might fetch images from disk, so make sure that number_of_bufs is as
+        small as possible.
+
+        Pixbufs may have been decoded at a reduced size (see
+        image_tools.load_pixbuf_reduced), unless <full> is True. If
+        <min_size> is specified, reduced pixbufs will at least cover it.
         """
+        if page is None:
+            index = self._current_image_index
+        else:
+            index = page - 1
         result = []
         for i in range(number_of_bufs):
-            result.append(self._get_pixbuf(self._current_image_index + i))
+            result.append(self._get_pixbuf(index + i, full=full,
+                                           min_size=min_size))
         return result
 
     def get_pixbuf_auto_background(self, number_of_bufs): # XXX limited to at most 2 pages
         """ Returns an automatically calculated background color
         for the current page(s). """
 
-        pixbufs = self.get_pixbufs(number_of_bufs)
+        edges = [self._get_edge_colours(self._current_image_index + i)
+                 for i in range(number_of_bufs)]
 
-        if len(pixbufs) == 1:
-            auto_bg = image_tools.get_most_common_edge_colour(pixbufs[0])
-        elif len(pixbufs) == 2:
-            left, right = pixbufs
+        if len(edges) == 1:
+            auto_bg = image_tools.get_most_common_colour(edges[0])
+        elif len(edges) == 2:
+            left, right = edges
             if self._window.is_manga_mode:
                 left, right = right, left
 
-            auto_bg = image_tools.get_most_common_edge_colour((left, right))
+            auto_bg = image_tools.get_most_common_colour((left[0], right[1]))
         else:
             assert False, 'Unexpected pixbuf count'
 
         return auto_bg
 
+    def _get_edge_colours(self, index, pixbuf=None):
+        """Return the edge colours (see image_tools.get_edge_colours) of
+        page <index>, only computed the first time (from <pixbuf> if
+        specified)."""
+        name = self._window.filehandler.get_archive_member(self._image_files[index])
+        edges = self._geometry.get_edge_colours(name)
+        if edges is None:
+            if pixbuf is None:
+                pixbuf = self._get_pixbuf(index)
+            edges = image_tools.get_edge_colours(pixbuf)
+            self._geometry.set_edge_colours(name, edges)
+        return edges
+
     def do_cacheing(self):
         """Make sure that the correct pixbufs are stored in cache. These
         are (in the current implementation) the current image(s), and
         if cacheing is enabled, also the one or two pixbufs before and
-        after the current page. All other pixbufs are deleted and garbage
-        collected directly in order to save memory.
+        after the current page. Other pixbufs are kept until the cache
+        size limit is reached, in which case those farthest from the
+        current page are dropped first.
+
+        Caching orders are processed by a pool of threads, the current
+        page(s) first. Orders already picked up by a thread for pages that
+        are not wanted anymore are cancelled before decoding starts.
         """
         if not self._window.filehandler.file_loaded:
             return
@@ -119,30 +321,69 @@ class ImageHandler(object):
         self._thread.clear_orders()
         # Get list of wanted pixbufs.
         wanted_pixbufs = self._ask_for_pages(self.get_current_page())
-        if -1 != self._cache_pages:
-            # We're not caching everything, remove old pixbufs.
-            for index in set(self._raw_pixbufs) - set(wanted_pixbufs):
-                del self._raw_pixbufs[index]
+        # Old pixbufs are not removed right away: they stay in cache until
+        # its size limit is reached, pages farthest from the current one
+        # being evicted first. Never evict the displayed page(s) though.
+        displayed = range(self._current_image_index,
+                          self._current_image_index + self._get_displayed_count())
+        self._raw_pixbufs.set_current(self._current_image_index, displayed)
+        stats = self._raw_pixbufs.get_stats()
+        log.debug('Page cache: %u page(s), %.1f MiB, '
+                  '%u hit(s), %u miss(es), %u eviction(s)',
+                  stats.count, stats.size / 1048576.0,
+                  stats.hits, stats.misses, stats.evictions)
         log.debug('Caching page(s) %s', ' '.join([str(index + 1) for index in wanted_pixbufs]))
         self._wanted_pixbufs = wanted_pixbufs
         # Start caching available images not already in cache.
         wanted_pixbufs = [index for index in wanted_pixbufs
                           if index in self._available_images and not index in self._raw_pixbufs]
-        orders = [(priority, index) for priority, index in enumerate(wanted_pixbufs)]
+        orders = [(priority, index, None)
+                  for priority, index in enumerate(wanted_pixbufs)]
         if len(orders) > 0:
             self._thread.extend_orders(orders)
 
     def _cache_pixbuf(self, wanted):
-        priority, index = wanted
+        priority, index, min_size = wanted
+        if self._thread.must_stop():
+            return
+        if -1 != self._cache_pages and index not in self._wanted_pixbufs and \
+           priority >= 0:
+            # Cancelled by a later call to do_cacheing.
+            log.debug('Not caching page %u anymore', index + 1)
+            return
+        if index in self._raw_pixbufs and \
+           _covers(self._raw_pixbufs[index],
+                   self._get_decode_size(min_size=min_size)):
+            return
         log.debug('Caching page %u', index + 1)
-        self._get_pixbuf(index)
+        self._get_pixbuf(index, min_size=min_size)
+
+    def set_page(self, page_num, count=None, cache=True):
+        """Set up filehandler to the page <page_num>. In continuous mode,
+        <count> is the number of pages displayed starting from <page_num>
+        (if None, the previous count is kept).
 
-    def set_page(self, page_num):
-        """Set up filehandler to the page <page_num>.
+        If <cache> is False (e.g. when flipping past pages quickly), pending
+        caching orders are cancelled, and do_cacheing must be called once
+        the page is settled.
         """
         assert 0 < page_num <= self.get_number_of_pages()
         self._current_image_index = page_num - 1
-        self.do_cacheing()
+        if count is not None:
+            self._displayed_count = max(1, count)
+        self._prefetcher.page_changed(page_num, self._get_displayed_count())
+        if cache:
+            self.do_cacheing()
+        else:
+            self._thread.clear_orders()
+
+    def _get_displayed_count(self):
+        """Return the number of pages displayed from the current one."""
+        if prefs['default continuous mode']:
+            return self._displayed_count
+        if prefs['default double page']:
+            return 2
+        return 1
 
     def get_virtual_double_page(self, page=None):
         """Return True if the current state warrants use of virtual
@@ -165,14 +406,13 @@ class ImageHandler(object):
             return False
 
         for page in (page, page + 1):
-            if not self.page_is_available(page):
+            geometry = self.get_page_geometry(page)
+            if geometry is None:
                 return False
-            pixbuf = self._get_pixbuf(page - 1)
-            width, height = pixbuf.get_width(), pixbuf.get_height()
+            width, height = geometry.width, geometry.height
             if prefs['auto rotate from exif']:
-                rotation = image_tools.get_implied_rotation(pixbuf)
-                assert rotation in (0, 90, 180, 270)
-                if rotation in (90, 270):
+                assert geometry.rotation in (0, 90, 180, 270)
+                if geometry.rotation in (90, 270):
                     width, height = height, width
             if width > height:
                 return True
@@ -195,12 +435,18 @@ class ImageHandler(object):
         self.last_wanted = 1
 
         self._thread.stop()
+        # Start anew: this also applies any change to the pool size.
+        self._thread = self._create_thread()
         self._base_path = None
         self._image_files = []
         self._current_image_index = None
+        self._displayed_count = 1
         self._available_images.clear()
         self._raw_pixbufs.clear()
+        self._geometry.close()
         self._cache_pages = prefs['max pages to cache']
+        self._prefetcher.reset()
+        self._deadlines = {}
 
     def page_is_available(self, page=None):
         """ Returns True if <page> is available and calls to get_pixbufs
@@ -240,7 +486,19 @@ class ImageHandler(object):
             # We're caching everything.
             priority = self.get_number_of_pages()
         if priority is not None:
-            self._thread.append_order((priority, index))
+            self._thread.append_order((priority, index, None))
+        # Index its geometry in the background.
+        path = self._image_files[index]
+        self._geometry.probe(self._window.filehandler.get_archive_member(path),
+                             path)
+
+    def _file_opened(self):
+        """ Called by the filehandler when a new file has been opened. """
+        if self._window.filehandler.archive_type is not None:
+            book_path = self._window.filehandler.get_path_to_base()
+        else:
+            book_path = None
+        self._geometry.open(book_path)
 
     def _file_available(self, filepaths):
         """ Called by the filehandler when a new file becomes available. """
@@ -269,7 +527,9 @@ class ImageHandler(object):
 
     def get_path_to_page(self, page=None):
         """Return the full path to the image file for <page>, or the current
-        page if <page> is None.
+        page if <page> is None. The file may only exist in memory (see
+        FileHandler.get_file_data): use FileHandler.materialize before
+        opening it.
         """
         if page is None:
             index = self._current_image_index
@@ -324,31 +584,51 @@ class ImageHandler(object):
 
         return i18n.to_unicode(name)
 
+    def get_page_geometry(self, page=None, wait=False, probe=True):
+        """Return the geometry (see page_geometry.PageGeometry) of <page>, or
+        of the current page if <page> is None. The geometry is taken from the
+        index if known; otherwise, it is probed from the image header if the
+        page is available (or if <wait> is True, after waiting for it to be),
+        unless <probe> is False.
+        Return None if the geometry cannot be determined.
+        """
+        page_path = self.get_path_to_page(page)
+        if page_path is None:
+            return None
+        name = self._window.filehandler.get_archive_member(page_path)
+        geometry = self._geometry.get(name)
+        if geometry is None and probe and \
+           self._wait_on_page(page, check_only=not wait):
+            geometry = self._geometry.probe(name, page_path, wait=True)
+        return geometry
+
+    def get_page_rotation(self, page=None):
+        """Return the rotation implied by the orientation metadata of <page>
+        (see image_tools.get_implied_rotation), or of the current page if
+        <page> is None. It is taken from the page geometry, so the image
+        metadata is not parsed again."""
+        geometry = self.get_page_geometry(page)
+        if geometry is None:
+            return 0
+        return geometry.rotation
+
     def get_size(self, page=None):
         """Return a tuple (width, height) with the size of <page>. If <page>
         is None, return the size of the current page.
         """
-        self._wait_on_page(page)
-
-        page_path = self.get_path_to_page(page)
-        if page_path is None:
+        geometry = self.get_page_geometry(page, wait=True)
+        if geometry is None:
             return (0, 0)
-
-        format, width, height = image_tools.get_image_info(page_path)
-        return (width, height)
+        return (geometry.width, geometry.height)
 
     def get_mime_name(self, page=None):
         """Return a string with the name of the mime type of <page>. If
         <page> is None, return the mime type name of the current page.
         """
-        self._wait_on_page(page)
-
-        page_path = self.get_path_to_page(page)
-        if page_path is None:
+        geometry = self.get_page_geometry(page, wait=True)
+        if geometry is None:
             return None
-
-        format, width, height = image_tools.get_image_info(page_path)
-        return format
+        return geometry.format
 
     def get_thumbnail(self, page=None, width=128, height=128, create=False,
                       nowait=False):
@@ -369,6 +649,16 @@ class ImageHandler(object):
         if path == None:
             return None
 
+        data = self._window.filehandler.get_file_data(path)
+        if data is not None and not create:
+            try:
+                return image_tools.load_pixbuf_data_size(data, width, height)
+            except Exception:
+                log.debug("Failed to create thumbnail for image `%s':\n%s",
+                          path, traceback.format_exc())
+                return image_tools.MISSING_IMAGE_ICON
+        self._window.filehandler.materialize(path)
+
         try:
             thumbnailer = thumbnail_tools.Thumbnailer(store_on_disk=create,
                                                       size=(width, height))
@@ -400,14 +690,35 @@ class ImageHandler(object):
         self._window.filehandler._wait_on_file(path)
         return True
 
+    def set_deadlines(self, deadlines):
+        """Set when pages are due for display (e.g. by a running slideshow):
+        <deadlines> maps page numbers to times (as returned by time.time).
+
+        Caching orders are processed earliest deadline first, the displayed
+        pages being always due, and pages without deadline last.
+        """
+        self._deadlines = dict([(page - 1, due)
+                                for page, due in deadlines.iteritems()])
+
+    def _get_order_deadline(self, order):
+        priority, index, min_size = order
+        current = self._current_image_index
+        if current is not None and \
+           current <= index < current + self._get_displayed_count():
+            return 0
+        return self._deadlines.get(index)
+
+    def set_slideshow_delay(self, delay):
+        """Set the <delay> (in seconds) between pages flipped by a running
+        slideshow, None if no slideshow is running (see
+        prefetch.Prefetcher)."""
+        self._prefetcher.set_slideshow_delay(delay)
+
     def _ask_for_pages(self, page):
         """Ask for pages around <page> to be given priority extraction.
         """
         files = []
-        if prefs['default double page']:
-            page_width = 2
-        else:
-            page_width = 1
+        page_width = self._get_displayed_count()
         if 0 == self._cache_pages:
             # Only ask for current page.
             num_pages = page_width
@@ -416,15 +727,13 @@ class ImageHandler(object):
             num_pages = min(10, self.get_number_of_pages())
         else:
             num_pages = self._cache_pages
+            if prefs['default continuous mode']:
+                # The visible pages, and as many before and after them.
+                num_pages = max(num_pages, 3 * page_width)
 
-        page_list = [page - 1 - page_width + n for n in xrange(num_pages)]
-
-        # Current and next page first, followed by previous page.
-        previous_page = page_list[0:page_width]
-        del page_list[0:page_width]
-        page_list[2*page_width:2*page_width] = previous_page
-        page_list = [index for index in page_list
-                     if index >= 0 and index < len(self._image_files)]
+        # Sized and oriented after the recent navigation.
+        page_list = self._prefetcher.get_page_list(page, page_width, num_pages,
+                                                   len(self._image_files))
 
         log.debug('Ask for priority extraction around page %u: %s',
                   page, ' '.join([str(n + 1) for n in page_list]))
@@ -4,11 +4,11 @@ from collections import namedtuple
 import binascii
 import re
 import sys
+import math
 import operator
 import gtk
 from PIL import Image
 from PIL import ImageEnhance
-from PIL import ImageOps
 from PIL.JpegImagePlugin import _getexif
 try:
     from PIL import PILLOW_VERSION
@@ -89,11 +89,12 @@ def get_fitting_size(source_size, target_size,
                 width = int(max(src_width * height / src_height, 1))
     return (width, height)
 
-def fit_pixbuf_to_rectangle(src, rect, rotation):
+def fit_pixbuf_to_rectangle(src, rect, rotation, scaling_quality=None):
     return fit_in_rectangle(src, rect[0], rect[1],
                             rotation=rotation,
                             keep_ratio=False,
-                            scale_up=True)
+                            scale_up=True,
+                            scaling_quality=scaling_quality)
 
 def fit_in_rectangle(src, width, height, keep_ratio=True, scale_up=False, rotation=0, scaling_quality=None):
     """Scale (and return) a pixbuf so that it fits in a rectangle with
@@ -169,148 +170,165 @@ def add_border(pixbuf, thickness, colour=0x000000FF):
     return canvas
 
 
-def get_most_common_edge_colour(pixbufs, edge=2):
-    """Return the most commonly occurring pixel value along the four edges
-    of <pixbuf>. The return value is a sequence, (r, g, b), with 16 bit
-    values. If <pixbuf> is a tuple, the edges will be computed from
-    both the left and the right image.
+#: Colours along edges are grouped by rounding them to the nearest multiple
+#: of this value, to compensate for dirty colours where no clear dominating
+#: colour can be made out.
+EDGE_COLOUR_STEPS = 10
 
-    Note: This could be done more cleanly with subpixbuf(), but that
-    doesn't work as expected together with get_pixels().
-    """
+def _round_colour_value(value, steps=EDGE_COLOUR_STEPS):
+    remainder = value % steps
+    if remainder >= steps - steps // 2:
+        value += steps - remainder
+    else:
+        value -= remainder
+    return min(255, value)
 
-    def group_colors(colors, steps=10):
-        """ This rounds a list of colors in C{colors} to the next nearest value,
-        i.e. 128, 83, 10 becomes 130, 85, 10 with C{steps}=5. This compensates for
-        dirty colors where no clear dominating color can be made out.
-
-        @return: The color that appears most often in the prominent group."""
-
-        # Start group
-        group = (0, 0, 0)
-        # List of (count, color) pairs, group contains most colors
-        colors_in_prominent_group = []
-        color_count_in_prominent_group = 0
-        # List of (count, color) pairs, current color group
-        colors_in_group = []
-        color_count_in_group = 0
-
-        for count, color in colors:
-
-            # Round color
-            rounded = [0] * len(color)
-            for i, color_value in enumerate(color):
-                if steps % 2 == 0:
-                    middle = steps // 2
-                else:
-                    middle = steps // 2 + 1
-
-                remainder = color_value % steps
-                if remainder >= middle:
-                    color_value = color_value + (steps - remainder)
-                else:
-                    color_value = color_value - remainder
-
-                rounded[i] = min(255, max(0, color_value))
-
-            # Change prominent group if necessary
-            if rounded == group:
-                # Color still fits in the previous color group
-                colors_in_group.append((count, color))
-                color_count_in_group += count
-            else:
-                # Color group changed, check if current group has more colors
-                # than last group
-                if color_count_in_group > color_count_in_prominent_group:
-                    colors_in_prominent_group = colors_in_group
-                    color_count_in_prominent_group = color_count_in_group
-
-                group = rounded
-                colors_in_group = [ (count, color) ]
-                color_count_in_group = count
-
-        # Cleanup if only one edge color group was found
-        if color_count_in_group > color_count_in_prominent_group:
-            colors_in_prominent_group = colors_in_group
-
-        colors_in_prominent_group.sort(key=operator.itemgetter(0), reverse=True)
-        # List is now sorted by color count, first color appears most often
-        return colors_in_prominent_group[0][1]
-
-    def get_edge_pixbuf(pixbuf, side, edge):
-        """ Returns a pixbuf corresponding to the side passed in <side>.
-        Valid sides are 'left', 'right', 'top', 'bottom'. """
-        width = pixbuf.get_width()
-        height = pixbuf.get_height()
-        edge = min(edge, width, height)
-
-        subpix = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB,
-                pixbuf.get_has_alpha(), 8, edge, height)
-        if side == 'left':
-            pixbuf.copy_area(0, 0, edge, height, subpix, 0, 0)
-        elif side == 'right':
-            pixbuf.copy_area(width - edge, 0, edge, height, subpix, 0, 0)
-        elif side == 'top':
-            pixbuf.copy_area(0, 0, width, edge, subpix, 0, 0)
-        elif side == 'bottom':
-            pixbuf.copy_area(0, height - edge, width, edge, subpix, 0, 0)
-        else:
-            assert False, 'Invalid edge side'
+_EDGE_COLOUR_GROUPS = [_round_colour_value(value) for value in range(256)]
 
-        return subpix
+def get_edge_colours(pixbuf, edge=2):
+    """Return the colours found along the left and right edges of <pixbuf>,
+    <edge> pixels wide, as a tuple (left, right). Each item maps a group of
+    colours (see EDGE_COLOUR_STEPS) to a tuple (count, best_count,
+    best_colour): the number of pixels in the group, and the most common
+    colour of the group along with its own number of pixels.
 
+    This is meant to be computed once per page, the result being used with
+    get_most_common_colour.
+    """
+    im = pixbuf_to_pil(pixbuf)
+    width, height = im.size
+    edge = min(edge, width, height)
+    edges = []
+    for box in ((0, 0, edge, height), (width - edge, 0, width, height)):
+        strip = im.crop(box)
+        if 'RGB' != strip.mode:
+            strip = strip.convert('RGB')
+        groups = {}
+        for count, colour in strip.getcolors(edge * height):
+            group = tuple([_EDGE_COLOUR_GROUPS[value] for value in colour])
+            total, best_count, best_colour = groups.get(group, (0, 0, None))
+            if count > best_count:
+                best_count, best_colour = count, colour
+            groups[group] = (total + count, best_count, best_colour)
+        edges.append(groups)
+    return tuple(edges)
+
+def get_most_common_colour(edges):
+    """Return the most common colour of the group with the most pixels in
+    <edges>, a sequence of edges as returned by get_edge_colours. The return
+    value is a sequence, (r, g, b), with 16 bit values."""
+    totals = {}
+    for groups in edges:
+        for group, (count, best_count, best_colour) in groups.iteritems():
+            totals[group] = totals.get(group, 0) + count
+    if not totals:
+        return (0, 0, 0)
+    group = max(sorted(totals), key=totals.get)
+    colours = {}
+    for groups in edges:
+        if group in groups:
+            count, best_count, best_colour = groups[group]
+            colours[best_colour] = colours.get(best_colour, 0) + best_count
+    colour = max(sorted(colours), key=colours.get)
+    return [value * 257 for value in colour]
+
+def get_most_common_edge_colour(pixbufs, edge=2):
+    """Return the most commonly occurring pixel value along the left and
+    right edges of <pixbuf>. The return value is a sequence, (r, g, b), with
+    16 bit values. If <pixbuf> is a tuple, the edges will be computed from
+    both the left and the right image.
+    """
     if not pixbufs:
         return (0, 0, 0)
 
     if not isinstance(pixbufs, (tuple, list)):
-        left_edge = get_edge_pixbuf(pixbufs, 'left', edge)
-        right_edge = get_edge_pixbuf(pixbufs, 'right', edge)
+        edges = get_edge_colours(pixbufs, edge)
     else:
         assert len(pixbufs) == 2, 'Expected two pages in list'
-        left_edge = get_edge_pixbuf(pixbufs[0], 'left', edge)
-        right_edge = get_edge_pixbuf(pixbufs[1], 'right', edge)
+        edges = (get_edge_colours(pixbufs[0], edge)[0],
+                 get_edge_colours(pixbufs[1], edge)[1])
+    return get_most_common_colour(edges)
 
-    # Find all edge colors. Color count is separate for all four edges
-    ungrouped_colors = []
-    for edge in (left_edge, right_edge):
-        im = pixbuf_to_pil(edge)
-        ungrouped_colors.extend(im.getcolors(im.size[0] * im.size[1]))
+#: PIL modes which pixels can be packed as expected by GdkPixbuf directly,
+#: without converting the whole image first.
+_PIXBUF_PACKABLE_MODES = ('RGB', 'RGBA', 'RGBX')
 
-    # Sum up colors from all edges
-    ungrouped_colors.sort(key=operator.itemgetter(1))
-    most_used = group_colors(ungrouped_colors)
-    return [color * 257 for color in most_used]
-
-def pil_to_pixbuf(im, keep_orientation=False):
-    """Return a pixbuf created from the PIL <im>."""
+def _get_pixbuf_mode(im):
+    """Return the mode ('RGB' or 'RGBA') of a pixbuf created from the
+    PIL <im>."""
     if im.mode.startswith('RGB'):
         has_alpha = im.mode == 'RGBA'
     elif im.mode in ('LA', 'P'):
         has_alpha = True
     else:
         has_alpha = False
-    target_mode = 'RGBA' if has_alpha else 'RGB'
-    if im.mode != target_mode:
-        im = im.convert(target_mode)
+    return 'RGBA' if has_alpha else 'RGB'
+
+def _get_pil_orientation(im):
+    """Return the orientation metadata of the PIL <im>, or None."""
+    orientation = None
+    exif = im.info.get('exif')
+    if exif is not None:
+        exif = _getexif(im)
+        orientation = exif.get(274, None)
+    if orientation is None:
+        # Maybe it's a PNG? Try alternative method.
+        orientation = _get_png_implied_rotation(im)
+    return orientation
+
+def _new_pixbuf_from_data(data, mode, size, orientation=None):
+    """Return a pixbuf of <size> from <data>, pixels packed according to
+    <mode> (see _get_pixbuf_mode)."""
+    has_alpha = 'RGBA' == mode
     pixbuf = gtk.gdk.pixbuf_new_from_data(
-        im.tobytes(), gtk.gdk.COLORSPACE_RGB,
+        data, gtk.gdk.COLORSPACE_RGB,
         has_alpha, 8,
-        im.size[0], im.size[1],
-        (4 if has_alpha else 3) * im.size[0]
+        size[0], size[1],
+        (4 if has_alpha else 3) * size[0]
     )
+    # Always set, so get_implied_rotation does not look for PNG
+    # metadata in pixbufs without orientation.
+    if orientation is None:
+        orientation = '1'
+    setattr(pixbuf, 'orientation', str(orientation))
+    return pixbuf
+
+def pil_to_pixbuf(im, keep_orientation=False):
+    """Return a pixbuf created from the PIL <im>."""
+    mode = _get_pixbuf_mode(im)
+    if im.mode in _PIXBUF_PACKABLE_MODES:
+        data = im.tobytes('raw', mode)
+    else:
+        data = im.convert(mode).tobytes()
     if keep_orientation:
         # Keep orientation metadata.
+        orientation = _get_pil_orientation(im)
+    else:
         orientation = None
-        exif = im.info.get('exif')
-        if exif is not None:
-            exif = _getexif(im)
-            orientation = exif.get(274, None)
-        if orientation is None:
-            # Maybe it's a PNG? Try alternative method.
-            orientation = _get_png_implied_rotation(im)
-        if orientation is not None:
-            setattr(pixbuf, 'orientation', str(orientation))
-    return pixbuf
+    return _new_pixbuf_from_data(data, mode, im.size, orientation)
+
+def _load_pil_pixbuf(source, draft_size=None):
+    """Decode the image from <source> (a path or a file object) with PIL,
+    optionally using PIL's draft mode for <draft_size>, and return it as a
+    pixbuf, keeping orientation metadata.
+
+    Same as pil_to_pixbuf, but intermediate buffers are released as soon
+    as they are not needed anymore: the decoded image is freed before the
+    pixbuf is allocated, lowering the peak memory use of a page from about
+    3 full size buffers to 2.
+    """
+    im = Image.open(source)
+    if draft_size is not None:
+        im.draft(None, draft_size)
+    orientation = _get_pil_orientation(im)
+    mode = _get_pixbuf_mode(im)
+    if im.mode not in _PIXBUF_PACKABLE_MODES:
+        # Note: the original image is released once converted.
+        im = im.convert(mode)
+    size = im.size
+    data = im.tobytes('raw', mode)
+    del im
+    return _new_pixbuf_from_data(data, mode, size, orientation)
 
 def pixbuf_to_pil(pixbuf):
     """Return a PIL image created from <pixbuf>."""
@@ -324,8 +342,7 @@ def pixbuf_to_pil(pixbuf):
 def load_pixbuf(path):
     """ Loads a pixbuf from a given image file. """
     if USE_PIL:
-        im = Image.open(path)
-        pixbuf = pil_to_pixbuf(im, keep_orientation=True)
+        pixbuf = _load_pil_pixbuf(path)
     else:
         pixbuf = gtk.gdk.pixbuf_new_from_file(path)
     return pixbuf
@@ -334,9 +351,7 @@ def load_pixbuf_size(path, width, height):
     """ Loads a pixbuf from a given image file and scale it to fit
     inside (width, height). """
     if USE_PIL:
-        im = Image.open(path)
-        im.draft(None, (width, height))
-        pixbuf = pil_to_pixbuf(im, keep_orientation=True)
+        pixbuf = _load_pil_pixbuf(path, draft_size=(width, height))
     else:
         image_format, image_width, image_height = get_image_info(path)
         # If we could not get the image info, still try to load
@@ -353,10 +368,57 @@ def load_pixbuf_size(path, width, height):
             pixbuf = gtk.gdk.pixbuf_new_from_file_at_size(path, width, height)
     return fit_in_rectangle(pixbuf, width, height, scaling_quality=gtk.gdk.INTERP_BILINEAR)
 
+def load_pixbuf_reduced(path, width, height):
+    """ Loads a pixbuf from a given image file, at a reduced size that
+    still covers (width, height), i.e. both dimensions are at least as big
+    as the target ones (or the original ones if smaller). This is much
+    faster than a full decode for big JPEGs, which can be decoded directly
+    at a reduced scale.
+
+    If the image is loaded at reduced size, its original size is stored
+    in the pixbuf (see get_original_size). """
+    image_format, image_width, image_height = get_image_info(path)
+    reduced_size = _get_reduced_size(image_format, image_width, image_height,
+                                     width, height)
+    if reduced_size is None:
+        return load_pixbuf(path)
+    if USE_PIL:
+        # Note: draft only reduces by powers of 2, and never below the
+        # requested size.
+        pixbuf = _load_pil_pixbuf(path, draft_size=reduced_size)
+    else:
+        pixbuf = gtk.gdk.pixbuf_new_from_file_at_size(path, *reduced_size)
+    if (pixbuf.get_width(), pixbuf.get_height()) != (image_width, image_height):
+        setattr(pixbuf, 'original_size', (image_width, image_height))
+    return pixbuf
+
+def _get_reduced_size(image_format, image_width, image_height, width, height):
+    """Return the size an image of <image_width>x<image_height> should be
+    decoded at to cover (width, height), or None if it must be decoded at
+    full size (see load_pixbuf_reduced)."""
+    if (0, 0) == (image_width, image_height) or 'GIF' == image_format:
+        return None
+    # Note: add a margin, so rounding never makes the result too small.
+    scale = max(float(width + 1) / image_width, float(height + 1) / image_height)
+    if scale >= 1.0:
+        return None
+    return (int(math.ceil(image_width * scale)),
+            int(math.ceil(image_height * scale)))
+
+def get_original_size(pixbuf):
+    """ Return the size of the image <pixbuf> was loaded from, which can
+    be bigger than the pixbuf size (see load_pixbuf_reduced). """
+    return getattr(pixbuf, 'original_size',
+                   (pixbuf.get_width(), pixbuf.get_height()))
+
+def is_reduced(pixbuf):
+    """ Return True if <pixbuf> was loaded at a reduced size. """
+    return hasattr(pixbuf, 'original_size')
+
 def load_pixbuf_data(imgdata):
     """ Loads a pixbuf from the data passed in <imgdata>. """
     if USE_PIL:
-        pixbuf = pil_to_pixbuf(Image.open(StringIO(imgdata)), keep_orientation=True)
+        pixbuf = _load_pil_pixbuf(StringIO(imgdata))
     else:
         loader = gtk.gdk.PixbufLoader()
         loader.write(imgdata, len(imgdata))
@@ -364,21 +426,129 @@ def load_pixbuf_data(imgdata):
         pixbuf = loader.get_pixbuf()
     return pixbuf
 
+def load_pixbuf_data_size(imgdata, width, height):
+    """ Same as load_pixbuf_size, from the data passed in <imgdata>. """
+    if USE_PIL:
+        pixbuf = _load_pil_pixbuf(StringIO(imgdata), draft_size=(width, height))
+    else:
+        pixbuf = load_pixbuf_data(imgdata)
+    return fit_in_rectangle(pixbuf, width, height, scaling_quality=gtk.gdk.INTERP_BILINEAR)
+
+def load_pixbuf_data_reduced(imgdata, width, height):
+    """ Same as load_pixbuf_reduced, from the data passed in <imgdata>.
+    Only reduces with PIL. """
+    if not USE_PIL:
+        return load_pixbuf_data(imgdata)
+    try:
+        im = Image.open(StringIO(imgdata))
+        image_format, (image_width, image_height) = im.format, im.size
+        im = None
+    except IOError:
+        return load_pixbuf_data(imgdata)
+    reduced_size = _get_reduced_size(image_format, image_width, image_height,
+                                     width, height)
+    if reduced_size is None:
+        return load_pixbuf_data(imgdata)
+    pixbuf = _load_pil_pixbuf(StringIO(imgdata), draft_size=reduced_size)
+    if (pixbuf.get_width(), pixbuf.get_height()) != (image_width, image_height):
+        setattr(pixbuf, 'original_size', (image_width, image_height))
+    return pixbuf
+
+def _autocontrast_lut(histogram, cutoff):
+    """Return the lookup table ImageOps.autocontrast would use for a band
+    with <histogram>, ignoring <cutoff> percent of the pixels at each end."""
+    histogram = list(histogram)
+    count = sum(histogram)
+    for bins in (range(256), range(255, -1, -1)):
+        cut = count * cutoff // 100
+        for n in bins:
+            if cut > histogram[n]:
+                cut -= histogram[n]
+                histogram[n] = 0
+            else:
+                histogram[n] -= cut
+                cut = 0
+            if cut <= 0:
+                break
+    used = [n for n in range(256) if histogram[n]]
+    if not used or used[-1] <= used[0]:
+        return range(256)
+    lo, hi = used[0], used[-1]
+    scale = 255.0 / (hi - lo)
+    offset = -lo * scale
+    return [max(0, min(int(n * scale + offset), 255)) for n in range(256)]
+
+def get_enhance_lut(histogram, bands, brightness=1.0, contrast=1.0,
+  autocontrast=False):
+    """Return a lookup table (as expected by Image.point) performing the
+    brightness, contrast and autocontrast operations of <enhance> at once on
+    an image with <bands> (e.g. 'RGB') and <histogram>. The alpha band, if
+    any, is left unchanged.
+
+    The result matches ImageEnhance.Brightness followed by
+    ImageOps.autocontrast or ImageEnhance.Contrast, up to rounding: the
+    histogram of the intermediate image is derived from <histogram>
+    instead of being computed on a new image.
+    """
+    brightness_lut = [min(int(n * brightness), 255) for n in range(256)]
+    colour_bands = [n for n, band in enumerate(bands) if 'A' != band]
+    # Histogram of each band once brightness has been adjusted.
+    histograms = []
+    for n in range(len(bands)):
+        band_histogram = [0] * 256
+        if n in colour_bands:
+            for value, count in enumerate(histogram[256 * n:256 * (n + 1)]):
+                band_histogram[brightness_lut[value]] += count
+        histograms.append(band_histogram)
+    contrast_luts = [range(256)] * len(bands)
+    if autocontrast:
+        for n in colour_bands:
+            contrast_luts[n] = _autocontrast_lut(histograms[n], 0.1)
+    elif contrast != 1.0:
+        # ImageEnhance.Contrast pivots around the mean grey level.
+        means = []
+        for n in colour_bands:
+            count = sum(histograms[n])
+            means.append(sum(value * histograms[n][value]
+                             for value in range(256)) / float(max(1, count)))
+        if 3 == len(means):
+            mean = (means[0] * 299 + means[1] * 587 + means[2] * 114) / 1000.0
+        else:
+            mean = means[0]
+        mean = int(mean + 0.5)
+        lut = [max(0, min(int(mean + contrast * (n - mean)), 255))
+               for n in range(256)]
+        for n in colour_bands:
+            contrast_luts[n] = lut
+    result = []
+    for n in range(len(bands)):
+        if n in colour_bands:
+            result.extend([contrast_luts[n][brightness_lut[value]]
+                           for value in range(256)])
+        else:
+            result.extend(range(256))
+    return result
+
 def enhance(pixbuf, brightness=1.0, contrast=1.0, saturation=1.0,
-  sharpness=1.0, autocontrast=False):
+  sharpness=1.0, autocontrast=False, histogram=None):
     """Return a modified pixbuf from <pixbuf> where the enhancement operations
     corresponding to each argument has been performed. A value of 1.0 means
-    no change. If <autocontrast> is True it overrides the <contrast> value,
-    but only if the image mode is supported by ImageOps.autocontrast (i.e.
-    it is L or RGB.)
+    no change. If <autocontrast> is True it overrides the <contrast> value.
+
+    If <histogram> is given, it is used for contrast instead of the
+    <pixbuf> histogram (e.g. for a part of a page, enhanced like the rest).
+
+    Brightness and contrast are combined into a single lookup table (see
+    get_enhance_lut), applied in one pass over the image; saturation and
+    sharpness need their own pass each.
     """
     im = pixbuf_to_pil(pixbuf)
-    if brightness != 1.0:
-        im = ImageEnhance.Brightness(im).enhance(brightness)
-    if autocontrast and im.mode in ('L', 'RGB'):
-        im = ImageOps.autocontrast(im, cutoff=0.1)
-    elif contrast != 1.0:
-        im = ImageEnhance.Contrast(im).enhance(contrast)
+    if brightness != 1.0 or contrast != 1.0 or autocontrast:
+        if histogram is None:
+            histogram = im.histogram()
+        lut = get_enhance_lut(histogram, im.getbands(), brightness,
+                              contrast, autocontrast)
+        im = im.point(lut)
     if saturation != 1.0:
         im = ImageEnhance.Color(im).enhance(saturation)
     if sharpness != 1.0:
@@ -432,6 +602,10 @@ def get_implied_rotation(pixbuf):
     if orientation is None:
         # Maybe it's a PNG? Try alternative method.
         orientation = _get_png_implied_rotation(pixbuf)
+    return _orientation_to_rotation(orientation)
+
+def _orientation_to_rotation(orientation):
+    """Return the rotation in degrees implied by the Exif <orientation>."""
     if orientation == '3':
         return 180
     elif orientation == '6':
@@ -515,6 +689,31 @@ def get_image_info(path):
         info = (_('Unknown filetype'), 0, 0)
     return info
 
+def get_image_geometry(path):
+    """Return image geometry, without decoding it:
+        (format, width, height, rotation)
+    with <rotation> the implied rotation (see get_implied_rotation).
+    <path> can also be a file object, in which case only formats supported
+    by PIL are recognized.
+    """
+    try:
+        im = Image.open(path)
+    except IOError:
+        if not isinstance(path, basestring):
+            return _('Unknown filetype'), 0, 0, 0
+        format, width, height = get_image_info(path)
+        return format, width, height, 0
+    orientation = None
+    if im.info.get('exif') is not None:
+        exif = _getexif(im)
+        if exif is not None:
+            orientation = exif.get(274, None)
+            if orientation is not None:
+                orientation = str(orientation)
+    if orientation is None and 'PNG' == im.format:
+        orientation = _get_png_implied_rotation(im)
+    return (im.format,) + im.size + (_orientation_to_rotation(orientation),)
+
 def get_supported_formats():
     if USE_PIL:
         # Make sure all supported formats are registered.
@@ -57,7 +57,10 @@ class MagnifyingLens(object):
         with it; <x> and <y> are the positions of the cursor within the
         main window layout area.
         """
-        if not self._window.filehandler.file_loaded or not self._window.images[0].get_pixbuf(): # XXX transitional(double page limitation)
+        if not self._window.filehandler.file_loaded:
+            return
+        if not self._window.imagehandler.page_is_available():
+            # Only placeholders are shown.
             return
 
         rectangle = self._calculate_lens_rect(x, y, prefs['lens size'], prefs['lens size'])
@@ -127,21 +130,29 @@ class MagnifyingLens(object):
             prefs['lens size'], prefs['lens size'])
         canvas.fill(image_tools.convert_rgb16list_to_rgba8int(self._window.get_bg_colour()))
         cb = self._window.layout.get_content_boxes()
-        source_pixbufs = self._window.imagehandler.get_pixbufs(len(cb))
-        for i in range(len(cb)):
-            cpos = cb[i].get_position()
+        if prefs['default continuous mode']:
+            # Only the pages around the cursor, not the whole strip.
+            pages = self._window.continuous.get_visible_pages()
+            cb = [cb[page - 1] for page in pages]
+        else:
+            first_page = self._window.imagehandler.get_current_page()
+            pages = range(first_page, first_page + len(cb))
+        for page, box in zip(pages, cb):
+            source_pixbuf = self._window.imagehandler.get_pixbufs(1, page=page,
+                                                                  full=True)[0]
+            cpos = box.get_position()
             self._add_subpixbuf(canvas, x - cpos[0], y - cpos[1],
-                cb[i].get_size(), source_pixbufs[i])
+                box.get_size(), source_pixbuf, page)
 
         return image_tools.add_border(canvas, 1)
 
-    def _add_subpixbuf(self, canvas, x, y, image_size, source_pixbuf):
+    def _add_subpixbuf(self, canvas, x, y, image_size, source_pixbuf, page):
         """Copy a subpixbuf from <source_pixbuf> to <canvas> as it should
         be in the lens if the coordinates <x>, <y> are the mouse pointer
         position on the main window layout area.
 
-        The displayed image (scaled from the <source_pixbuf>) must have
-        size <image_size>.
+        The displayed image (scaled from the <source_pixbuf>, the pixbuf
+        of <page>) must have size <image_size>.
         """
         # Prevent division by zero exceptions further down
         if not image_size[0]:
@@ -149,7 +160,7 @@ class MagnifyingLens(object):
 
         rotation = prefs['rotation']
         if prefs['auto rotate from exif']:
-            rotation += image_tools.get_implied_rotation(source_pixbuf)
+            rotation += self._window.imagehandler.get_page_rotation(page)
             rotation = rotation % 360
 
         if rotation in [90, 270]:
@@ -3,10 +3,12 @@
 import os
 import shutil
 import threading
+import time
 import gtk
 import gobject
 
 from mcomix import constants
+from mcomix import continuous_view
 from mcomix import cursor_handler
 from mcomix import i18n
 from mcomix import icons
@@ -18,6 +20,7 @@ from mcomix import image_tools
 from mcomix import lens
 from mcomix import preferences
 from mcomix.preferences import prefs
+from mcomix import renderer
 from mcomix import ui
 from mcomix import slideshow
 from mcomix import status
@@ -37,6 +40,19 @@ from mcomix import log
 import math
 import operator
 
+#: Delay (in milliseconds) without resize events after which resizing
+#: is considered over, and pages are rendered at full quality.
+RESIZE_REDRAW_DELAY = 250
+
+#: Page flips less than this many milliseconds apart are part of a burst
+#: (e.g. holding Page Down), and the burst is over after this long
+#: without flipping.
+FLIP_BURST_DELAY = 150
+
+#: Maximum width or height (in pixels) of the placeholder shown in place
+#: of a page that is not available yet: it is centred in the page box.
+PLACEHOLDER_MAX_SIZE = 256
+
 
 class MainWindow(gtk.Window):
 
@@ -65,6 +81,16 @@ class MainWindow(gtk.Window):
         self.layout = _dummy_layout()
         self._spacing = 2
         self._waiting_for_redraw = False
+        #: Timeout source ID for the end of resizing, and True if interim
+        #: renderings were drawn since resizing started.
+        self._resize_timeout_id = None
+        self._resize_interim = False
+        #: Time of the last page flip, and timeout source ID for the end
+        #: of the current burst of page flips (None if not in a burst).
+        self._last_flip_time = 0
+        self._flip_burst_id = None
+        #: List of (position, TiledRendering) for pages rendered by tiles.
+        self._tiled_pages = []
 
         self._image_box = gtk.HBox(False, 2) # XXX transitional(kept for osd.py)
         self._main_layout = gtk.Layout()
@@ -79,6 +105,7 @@ class MainWindow(gtk.Window):
         self.filehandler.file_opened += self._on_file_opened
         self.imagehandler = image_handler.ImageHandler(self)
         self.imagehandler.page_available += self._page_available
+        self.imagehandler.page_decoded += self._page_decoded
         self.thumbnailsidebar = thumbbar.ThumbnailSidebar(self)
 
         self.statusbar = status.Statusbar()
@@ -86,6 +113,9 @@ class MainWindow(gtk.Window):
         self.slideshow = slideshow.Slideshow(self)
         self.cursor_handler = cursor_handler.CursorHandler(self)
         self.enhancer = enhance_backend.ImageEnhancer(self)
+        self.renderer = renderer.Renderer(self)
+        self.renderer.page_rendered += self._page_rendered
+        self.continuous = continuous_view.ContinuousView(self)
         self.lens = lens.MagnifyingLens(self)
         self.osd = osd.OnScreenDisplay(self)
         self.zoom = zoom.ZoomModel()
@@ -146,6 +176,9 @@ class MainWindow(gtk.Window):
         if prefs['default manga mode'] or manga_mode:
             self.actiongroup.get_action('manga_mode').activate()
 
+        if prefs['default continuous mode']:
+            self.actiongroup.get_action('continuous_mode').activate()
+
         # Determine zoom mode. If zoom_mode is passed, it overrides
         # the zoom mode preference.
         zoom_actions = { constants.ZOOM_MODE_BEST : 'best_fit_mode',
@@ -251,6 +284,7 @@ class MainWindow(gtk.Window):
             self._event_handler.mouse_move_event)
         self._main_layout.connect('drag_data_received',
             self._event_handler.drag_n_drop_event)
+        self._main_layout.connect_after('expose_event', self._draw_tiles)
 
         self.uimanager.set_sensitivities()
         self.show()
@@ -307,6 +341,32 @@ class MainWindow(gtk.Window):
             gobject.idle_add(self._draw_image, scroll_to,
                              priority=gobject.PRIORITY_HIGH_IDLE)
 
+    def resize_redraw(self):
+        """Redraw the current pages after the window has been resized.
+
+        When the size keeps changing (e.g. the window border is dragged),
+        pages are only scaled fast from their last rendering, and rendered
+        at full quality once resizing has stopped.
+        """
+        # The first change may be a single one (e.g. maximizing):
+        # it is drawn normally.
+        if self._resize_timeout_id is not None:
+            gobject.source_remove(self._resize_timeout_id)
+            if not self._resize_interim:
+                self._resize_interim = True
+                self.renderer.set_interim(True)
+        self._resize_timeout_id = gobject.timeout_add(RESIZE_REDRAW_DELAY,
+                                                      self._resize_done)
+        self.draw_image()
+
+    def _resize_done(self):
+        self._resize_timeout_id = None
+        if self._resize_interim:
+            self._resize_interim = False
+            self.renderer.set_interim(False)
+            self.draw_image()
+        return False
+
     def _update_toggle_preference(self, preference, toggleaction):
         ''' Update "toggle" widget corresponding <preference>.
 
@@ -358,98 +418,127 @@ class MainWindow(gtk.Window):
             self._waiting_for_redraw = False
             return False
 
-        if self.imagehandler.page_is_available():
-            distribution_axis = constants.DISTRIBUTION_AXIS
-            alignment_axis = constants.ALIGNMENT_AXIS
-            pixbuf_count = 2 if self.displayed_double() else 1 # XXX limited to at most 2 pages
-            pixbuf_list = list(self.imagehandler.get_pixbufs(pixbuf_count))
-            size_list = [[pixbuf.get_width(), pixbuf.get_height()]
-                         for pixbuf in pixbuf_list]
-
-            if self.is_manga_mode:
-                orientation = constants.MANGA_ORIENTATION
-            else:
-                orientation = constants.WESTERN_ORIENTATION
-
-            # Rotation handling:
-            # - apply Exif rotation on individual images
-            # - apply automatic rotation (size based) on whole page
-            # - apply manual rotation on whole page
-            if prefs['auto rotate from exif']:
-                rotation_list = [image_tools.get_implied_rotation(pixbuf)
-                                 for pixbuf in pixbuf_list]
+        if prefs['default continuous mode']:
+            self.continuous.draw(scroll_to)
+            self._waiting_for_redraw = False
+            return False
+        self.continuous.clear()
+
+        pixbuf_count = 2 if self.displayed_double() else 1 # XXX limited to at most 2 pages
+        first_page = self.imagehandler.get_current_page()
+        page_available = self.imagehandler.page_is_available()
+        if page_available:
+            # Don't wait for decoding: placeholders are shown until the
+            # page(s) are decoded (see _page_decoded).
+            self.imagehandler.set_decode_size(
+                self.get_viewport_constraints()[0])
+            if self._flip_burst_id is None:
+                # Otherwise, skimming through pages: decoding is only asked
+                # for once flipping has settled.
+                self.imagehandler.decode_pages(first_page, pixbuf_count)
+            pixbuf_list = [self.imagehandler.get_cached_pixbuf(page)
+                           for page in range(first_page,
+                                             first_page + pixbuf_count)]
+            page_available = None not in pixbuf_list
+        if page_available:
+            geometry_list = None
+        else:
+            # Layout the page(s) before they are decoded if their
+            # geometry is already known, so no relayout is needed
+            # when they become available.
+            geometry_list = [self.imagehandler.get_page_geometry(page)
+                             for page in range(first_page,
+                                               first_page + pixbuf_count)]
+            if None in geometry_list:
+                geometry_list = None
+
+        if page_available or geometry_list is not None:
+            constraints = self.get_viewport_constraints()
+            if page_available:
+                size_list = [list(image_tools.get_original_size(pixbuf))
+                             for pixbuf in pixbuf_list]
+                if prefs['auto rotate from exif']:
+                    rotation_list = [self.imagehandler.get_page_rotation(page)
+                                     for page in range(first_page,
+                                                       first_page + pixbuf_count)]
+                else:
+                    rotation_list = [0] * pixbuf_count
             else:
-                rotation_list = [0] * len(pixbuf_list)
-            virtual_size = [0, 0]
-            for i in range(pixbuf_count):
-                if rotation_list[i] in (90, 270):
-                    size_list[i].reverse()
-                size = size_list[i]
-                virtual_size[distribution_axis] += size[distribution_axis]
-                virtual_size[alignment_axis] = max(virtual_size[alignment_axis],
-                                                   size[alignment_axis])
-            rotation = self._get_size_rotation(*virtual_size)
-            rotation = (rotation + prefs['rotation']) % 360
-            if rotation in (90, 270):
-                distribution_axis, alignment_axis = alignment_axis, distribution_axis
-                orientation = list(orientation)
-                orientation.reverse()
+                size_list = [[geometry.width, geometry.height]
+                             for geometry in geometry_list]
+                if prefs['auto rotate from exif']:
+                    rotation_list = [geometry.rotation
+                                     for geometry in geometry_list]
+                else:
+                    rotation_list = [0] * pixbuf_count
+
+            self.layout, scaled_sizes, rotation_list, size_list, \
+                scrollbar_requests = self.get_page_layout(size_list,
+                                                          rotation_list,
+                                                          constraints)
+            self.show_scrollbars(scrollbar_requests)
+            union_scaled_size = self.layout.get_union_box().get_size()
+
+            first_index = first_page - 1
+            if page_available:
+                # Zoomed in past the size of pages decoded at reduced size?
+                redecoding = set()
                 for i in range(pixbuf_count):
-                    size_list[i].reverse()
-            if rotation in (180, 270):
-                orientation = tools.vector_opposite(orientation)
-            for i in range(pixbuf_count):
-                rotation_list[i] = (rotation_list[i] + rotation) % 360
-            if prefs['vertical flip'] and rotation in (90, 270):
-                orientation = tools.vector_opposite(orientation)
-            if prefs['horizontal flip'] and rotation in (0, 180):
-                orientation = tools.vector_opposite(orientation)
-
-            viewport_size = () # dummy
-            expand_area = False
-            scrollbar_requests = [False] * len(self._scroll)
-            # Visible area size is recomputed depending on scrollbar visibility
-            while True:
-                self._show_scrollbars(scrollbar_requests)
-                new_viewport_size = self.get_visible_area_size()
-                if new_viewport_size == viewport_size:
-                    break
-                viewport_size = new_viewport_size
-                zoom_dummy_size = list(viewport_size)
-                dasize = zoom_dummy_size[distribution_axis] - \
-                    self._spacing * (pixbuf_count - 1)
-                if dasize <= 0:
-                    dasize = 1
-                zoom_dummy_size[distribution_axis] = dasize
-                scaled_sizes = self.zoom.get_zoomed_size(size_list, zoom_dummy_size,
-                    distribution_axis)
-                self.layout = layout.FiniteLayout(scaled_sizes,
-                                                  viewport_size,
-                                                  orientation,
-                                                  self._spacing,
-                                                  expand_area,
-                                                  distribution_axis,
-                                                  alignment_axis)
-                union_scaled_size = self.layout.get_union_box().get_size()
-                scrollbar_requests = map(operator.or_, scrollbar_requests,
-                    tools.smaller(viewport_size, union_scaled_size))
-                if len(filter(None, scrollbar_requests)) > 1 and not expand_area:
-                    expand_area = True
-                    viewport_size = () # start anew
-
-            for i in range(pixbuf_count):
-                pixbuf_list[i] = image_tools.fit_pixbuf_to_rectangle(
-                    pixbuf_list[i], scaled_sizes[i], rotation_list[i])
-
-            for i in range(pixbuf_count):
-                if prefs['horizontal flip']:
-                    pixbuf_list[i] = pixbuf_list[i].flip(horizontal=True)
-                if prefs['vertical flip']:
-                    pixbuf_list[i] = pixbuf_list[i].flip(horizontal=False)
-                pixbuf_list[i] = self.enhancer.enhance(pixbuf_list[i])
+                    pixbuf = pixbuf_list[i]
+                    if not image_tools.is_reduced(pixbuf):
+                        continue
+                    if max(scaled_sizes[i]) > min(pixbuf.get_width(),
+                                                  pixbuf.get_height()):
+                        redecoding.add(i)
+                if len(redecoding) > 0:
+                    # Decode them again in the background (see
+                    # _page_decoded), their last rendering is shown
+                    # scaled in the meantime.
+                    self.imagehandler.decode_pages(first_page, pixbuf_count,
+                        min_size=(max(map(max, scaled_sizes)),) * 2)
+
+                index_list = range(first_index, first_index + pixbuf_count)
+                self.renderer.set_current(first_index, index_list)
+                for i in range(pixbuf_count):
+                    if i in redecoding:
+                        if self.renderer.use_tiles(scaled_sizes[i]):
+                            pixbuf_list[i] = None
+                        else:
+                            pixbuf_list[i] = self.renderer.render_interim(
+                                index_list[i], scaled_sizes[i], rotation_list[i])
+                        continue
+                    if self.renderer.use_tiles(scaled_sizes[i]):
+                        pixbuf_list[i] = self.renderer.render_tiled(index_list[i],
+                                                                    pixbuf_list[i],
+                                                                    scaled_sizes[i],
+                                                                    rotation_list[i])
+                        continue
+                    pixbuf_list[i] = self.renderer.render(index_list[i],
+                                                          pixbuf_list[i],
+                                                          scaled_sizes[i],
+                                                          rotation_list[i],
+                                                          progressive=True)
 
+            content_boxes = self.layout.get_content_boxes()
+            self._tiled_pages = []
             for i in range(pixbuf_count):
-                self.images[i].set_from_pixbuf(pixbuf_list[i])
+                if not page_available:
+                    self.set_placeholder(self.images[i], scaled_sizes[i],
+                                          first_page + i)
+                    continue
+                if isinstance(pixbuf_list[i], renderer.TiledRendering):
+                    # Drawn by _draw_tiles.
+                    self._tiled_pages.append((content_boxes[i].get_position(),
+                                              pixbuf_list[i]))
+                    self.images[i].set_size_request(-1, -1)
+                    self.images[i].clear()
+                elif pixbuf_list[i] is None:
+                    # Not rendered yet (see Renderer.render).
+                    self.set_placeholder(self.images[i], scaled_sizes[i],
+                                          first_page + i)
+                else:
+                    self.images[i].set_size_request(*scaled_sizes[i])
+                    self.images[i].set_from_pixbuf(pixbuf_list[i])
 
             scales = tuple(map(lambda x, y: math.sqrt(tools.div(
                 tools.volume(x), tools.volume(y))), scaled_sizes, size_list))
@@ -462,17 +551,16 @@ class MainWindow(gtk.Window):
 
             smartbg = prefs['smart bg']
             smartthumbbg = prefs['smart thumb bg'] and prefs['show thumbnails']
-            if smartbg or smartthumbbg:
+            if page_available and (smartbg or smartthumbbg):
                 bg_colour = self.imagehandler.get_pixbuf_auto_background(pixbuf_count)
-            if smartbg:
-                self.set_bg_colour(bg_colour)
-            if smartthumbbg:
-                self.thumbnailsidebar.change_thumbnail_background_color(bg_colour)
+                if smartbg:
+                    self.set_bg_colour(bg_colour)
+                if smartthumbbg:
+                    self.thumbnailsidebar.change_thumbnail_background_color(bg_colour)
 
             self._main_layout.window.freeze_updates()
 
             self._main_layout.set_size(*union_scaled_size)
-            content_boxes = self.layout.get_content_boxes()
             for i in range(pixbuf_count):
                 self._main_layout.move(self.images[i],
                     *content_boxes[i].get_position())
@@ -499,6 +587,17 @@ class MainWindow(gtk.Window):
                 self.scroll_to_predefined(destination, index)
 
             self._main_layout.window.thaw_updates()
+
+            if self._tiled_pages:
+                self._main_layout.queue_draw()
+
+            if page_available and self._flip_burst_id is None:
+                # Get the spreads around the current one ready for display.
+                self.renderer.prerender(first_page, constraints)
+            else:
+                # Already scrolled: the page(s) will be swapped in
+                # place once available.
+                self._last_scroll_destination = None
         else:
             # Save scroll destination for when the page becomes available.
             self._last_scroll_destination = scroll_to
@@ -507,12 +606,205 @@ class MainWindow(gtk.Window):
             # XXX How about calling self._clear_main_area?
             for i in range(len(self.images)):
                 self.images[i].hide()
-            self._show_scrollbars([False] * len(self._scroll))
+            self._tiled_pages = []
+            self.show_scrollbars([False] * len(self._scroll))
 
         self._waiting_for_redraw = False
 
         return False
 
+    def _draw_tiles(self, widget, event):
+        """ Draw the tiles of pages rendered by tiles on expose. """
+        bin_window = self._main_layout.get_bin_window()
+        if not self._tiled_pages or event.window is not bin_window:
+            return False
+        area = event.area
+        for (x, y), tiled in self._tiled_pages:
+            rect = (area.x - x, area.y - y, area.width, area.height)
+            for tile_x, tile_y, tile in tiled.get_tiles(rect):
+                bin_window.draw_pixbuf(None, tile, 0, 0,
+                                       x + tile_x, y + tile_y)
+        # Get the tiles around the visible area ready for scrolling.
+        width, height = self.get_visible_area_size()
+        margin = renderer.TILE_SIZE
+        visible = (int(self._hadjust.get_value()) - margin,
+                   int(self._vadjust.get_value()) - margin,
+                   width + 2 * margin, height + 2 * margin)
+        for (x, y), tiled in self._tiled_pages:
+            tiled.queue_tiles((visible[0] - x, visible[1] - y) + visible[2:])
+        return False
+
+    def redraw_tiles(self):
+        """ Redraw the pages rendered by tiles, e.g. once some tiles
+        have been rendered. """
+        if self._tiled_pages:
+            self._main_layout.queue_draw()
+
+    def set_tiled_pages(self, tiled_pages):
+        """ Set the list of pages drawn by tiles, as ((x, y), tiled)
+        tuples: <tiled> is a renderer.TiledRendering drawn at (x, y) in
+        the main layout area. """
+        self._tiled_pages = tiled_pages
+        self.redraw_tiles()
+
+    def get_scroll_adjustments(self):
+        """ Return the horizontal and vertical adjustments of the main
+        layout area. """
+        return self._hadjust, self._vadjust
+
+    def get_page_spacing(self):
+        """ Return the space (in pixels) between laid out pages. """
+        return self._spacing
+
+    def set_placeholder(self, image, size, page=None):
+        """ Show in <image> a placeholder for a page of <size> that is not
+        available yet (see _get_placeholder_pixbuf). The image requests the
+        page size, so the placeholder is centred in the page box. """
+        image.set_from_pixbuf(self._get_placeholder_pixbuf(size, page))
+        image.set_size_request(*size)
+
+    def _get_placeholder_pixbuf(self, size, page=None):
+        """ Return a pixbuf to show in place of a page of <size> that is
+        not available yet: the thumbnail of <page> if there is one, an empty
+        frame otherwise, with the page aspect ratio but no bigger than
+        PLACEHOLDER_MAX_SIZE. """
+        width, height = size
+        scale = min(1.0, tools.div(PLACEHOLDER_MAX_SIZE, max(width, height, 1)))
+        width = max(1, int(width * scale))
+        height = max(1, int(height * scale))
+        if page is not None:
+            thumbnail = self.thumbnailsidebar.get_thumbnail(page)
+            # Don't bother with rotations.
+            if thumbnail is not None and \
+               (thumbnail.get_width() > thumbnail.get_height()) == (width > height):
+                return thumbnail.scale_simple(width, height,
+                                              gtk.gdk.INTERP_BILINEAR)
+        pixbuf = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, False, 8,
+                                max(1, width - 2), max(1, height - 2))
+        pixbuf.fill(image_tools.convert_rgb16list_to_rgba8int(self.get_bg_colour()))
+        colour = image_tools.text_color_for_background_color(self.get_bg_colour())
+        colour = image_tools.convert_rgb16list_to_rgba8int(
+            (colour.red, colour.green, colour.blue))
+        return image_tools.add_border(pixbuf, 1, colour=colour)
+
+    def get_viewport_constraints(self):
+        """ Return the constraints used for laying out pages, as a tuple
+        (size, scrollbar_sizes): <size> is the size of the visible part of
+        the main layout area when no scrollbar is shown, and <scrollbar_sizes>
+        the space taken by each scrollbar when shown (0 if scrollbars are
+        disabled). """
+        dimensions = list(self.get_size())
+        for preference, action, widget_list in self._toggle_list:
+            if 'show scrollbar' == preference:
+                continue
+            for widget in widget_list:
+                if widget.get_visible():
+                    axis = self._toggle_axis[widget]
+                    dimensions[axis] -= widget.size_request()[axis]
+        scrollbar_sizes = [0] * len(self._scroll)
+        if self._should_toggle_be_visible('show scrollbar'):
+            for i, scrollbar in enumerate(self._scroll):
+                axis = self._toggle_axis[scrollbar]
+                scrollbar_sizes[i] = scrollbar.size_request()[axis]
+        return tuple(dimensions), tuple(scrollbar_sizes)
+
+    def get_viewport_size(self, constraints, scrollbar_requests):
+        """ Return the size of the visible area for <constraints> (see
+        get_viewport_constraints) with scrollbars shown according to
+        <scrollbar_requests>. """
+        size, scrollbar_sizes = constraints
+        dimensions = list(size)
+        for i, scrollbar in enumerate(self._scroll):
+            if scrollbar_requests[i]:
+                dimensions[self._toggle_axis[scrollbar]] -= scrollbar_sizes[i]
+        return tuple(dimensions)
+
+    def get_page_layout(self, size_list, rotation_list, constraints):
+        """ Compute how pages of raw sizes <size_list> and implied rotations
+        <rotation_list> (e.g. from Exif data) are displayed with the viewport
+        <constraints> (see get_viewport_constraints).
+
+        No widget is touched, so this can be used (from any thread) to
+        predict the layout of pages other than the current ones.
+
+        Returns a tuple (layout, scaled_sizes, rotation_list, size_list,
+        scrollbar_requests), <rotation_list> being the final rotation of
+        each page, and <size_list> their raw sizes once rotated. """
+        distribution_axis = constants.DISTRIBUTION_AXIS
+        alignment_axis = constants.ALIGNMENT_AXIS
+        pixbuf_count = len(size_list)
+        size_list = [list(size) for size in size_list]
+        rotation_list = list(rotation_list)
+
+        if self.is_manga_mode:
+            orientation = constants.MANGA_ORIENTATION
+        else:
+            orientation = constants.WESTERN_ORIENTATION
+
+        # Rotation handling:
+        # - apply Exif rotation on individual images
+        # - apply automatic rotation (size based) on whole page
+        # - apply manual rotation on whole page
+        virtual_size = [0, 0]
+        for i in range(pixbuf_count):
+            if rotation_list[i] in (90, 270):
+                size_list[i].reverse()
+            size = size_list[i]
+            virtual_size[distribution_axis] += size[distribution_axis]
+            virtual_size[alignment_axis] = max(virtual_size[alignment_axis],
+                                               size[alignment_axis])
+        rotation = self.get_size_rotation(*virtual_size)
+        rotation = (rotation + prefs['rotation']) % 360
+        if rotation in (90, 270):
+            distribution_axis, alignment_axis = alignment_axis, distribution_axis
+            orientation = list(orientation)
+            orientation.reverse()
+            for i in range(pixbuf_count):
+                size_list[i].reverse()
+        if rotation in (180, 270):
+            orientation = tools.vector_opposite(orientation)
+        for i in range(pixbuf_count):
+            rotation_list[i] = (rotation_list[i] + rotation) % 360
+        if prefs['vertical flip'] and rotation in (90, 270):
+            orientation = tools.vector_opposite(orientation)
+        if prefs['horizontal flip'] and rotation in (0, 180):
+            orientation = tools.vector_opposite(orientation)
+
+        viewport_size = () # dummy
+        expand_area = False
+        scrollbar_requests = [False] * len(self._scroll)
+        # Visible area size is recomputed depending on scrollbar visibility
+        while True:
+            new_viewport_size = self.get_viewport_size(constraints,
+                                                        scrollbar_requests)
+            if new_viewport_size == viewport_size:
+                break
+            viewport_size = new_viewport_size
+            zoom_dummy_size = list(viewport_size)
+            dasize = zoom_dummy_size[distribution_axis] - \
+                self._spacing * (pixbuf_count - 1)
+            if dasize <= 0:
+                dasize = 1
+            zoom_dummy_size[distribution_axis] = dasize
+            scaled_sizes = self.zoom.get_zoomed_size(size_list, zoom_dummy_size,
+                distribution_axis)
+            page_layout = layout.FiniteLayout(scaled_sizes,
+                                              viewport_size,
+                                              orientation,
+                                              self._spacing,
+                                              expand_area,
+                                              distribution_axis,
+                                              alignment_axis)
+            union_scaled_size = page_layout.get_union_box().get_size()
+            scrollbar_requests = map(operator.or_, scrollbar_requests,
+                tools.smaller(viewport_size, union_scaled_size))
+            if len(filter(None, scrollbar_requests)) > 1 and not expand_area:
+                expand_area = True
+                viewport_size = () # start anew
+
+        return (page_layout, scaled_sizes, rotation_list, size_list,
+                scrollbar_requests)
+
     def _update_page_information(self):
         """ Updates the window with information that can be gathered
         even when the page pixbuf(s) aren't ready yet. """
@@ -537,7 +829,7 @@ class MainWindow(gtk.Window):
         self.statusbar.update()
         self.update_title()
 
-    def _get_size_rotation(self, width, height):
+    def get_size_rotation(self, width, height):
         """ Determines the rotation to be applied.
         Returns the degree of rotation (0, 90, 180, 270). """
 
@@ -567,9 +859,17 @@ class MainWindow(gtk.Window):
         # Refresh display when currently opened page becomes available.
         current_page = self.imagehandler.get_current_page()
         nb_pages = 2 if self.displayed_double() else 1
-        if current_page <= page < (current_page + nb_pages):
+        if prefs['default continuous mode']:
+            # Handled by the continuous view.
+            pass
+        elif current_page <= page < (current_page + nb_pages):
             self.draw_image(scroll_to=self._last_scroll_destination)
             self._update_page_information()
+        elif ((current_page - 2) <= page < (current_page + nb_pages + 2) and
+              self.imagehandler.page_is_available()):
+            # Part of a neighbouring spread.
+            self.renderer.prerender(current_page,
+                                    self.get_viewport_constraints())
 
         # Use first page as application icon when opening archives.
         if (page == 1
@@ -578,6 +878,21 @@ class MainWindow(gtk.Window):
             pixbuf = self.imagehandler.get_thumbnail(page, 48, 48)
             self.set_icon(pixbuf)
 
+    def _page_decoded(self, page):
+        """ Called whenever a page has been decoded. """
+        current_page = self.imagehandler.get_current_page()
+        nb_pages = 2 if self.displayed_double() else 1
+        if not prefs['default continuous mode'] and \
+           current_page <= page < (current_page + nb_pages):
+            # Handled by the continuous view otherwise.
+            self.draw_image(scroll_to=self._last_scroll_destination)
+
+    def _page_rendered(self, index):
+        """ Called once the final rendering of a displayed page is ready. """
+        if not prefs['default continuous mode']:
+            # Handled by the continuous view otherwise.
+            self.draw_image()
+
     def _on_file_opened(self):
         self.uimanager.set_sensitivities()
         number, count = self.filehandler.get_file_number()
@@ -616,7 +931,7 @@ class MainWindow(gtk.Window):
     def set_page(self, num, at_bottom=False):
         if num == self.imagehandler.get_current_page():
             return
-        self.imagehandler.set_page(num)
+        self.imagehandler.set_page(num, cache=self._flip_burst_id is None)
         self.page_changed()
         self.new_page(at_bottom=at_bottom)
         self.slideshow.update_delay()
@@ -663,15 +978,12 @@ class MainWindow(gtk.Window):
         current_page = self.imagehandler.get_current_page()
         number_of_pages = self.imagehandler.get_number_of_pages()
 
-        new_page = current_page + step
-        if (1 == abs(step) and
-            not single_step and
-            prefs['default double page'] and
-            prefs['double step in double page mode']):
-            if +1 == step and not self.imagehandler.get_virtual_double_page():
-                new_page += 1
-            elif -1 == step and not self.imagehandler.get_virtual_double_page(new_page - 1):
-                new_page -= 1
+        if (1 == step and prefs['default continuous mode'] and
+            self.continuous.is_at_end()):
+            # The last pages are already displayed.
+            return self.next_book()
+
+        new_page = self.get_step_destination(current_page, step, single_step)
 
         if new_page <= 0:
             # Only switch to previous page when flipping one page before the
@@ -687,8 +999,50 @@ class MainWindow(gtk.Window):
             new_page = number_of_pages
 
         if new_page != current_page:
+            self._check_flip_burst()
             self.set_page(new_page, at_bottom=(-1 == step))
 
+    def _check_flip_burst(self):
+        """ Called on each page flip to detect bursts of flips (e.g. holding
+        Page Down, or spinning the mouse wheel). During a burst, only pages
+        already decoded are displayed (placeholders otherwise), and
+        extraction and decoding around the current page are only asked
+        for once flipping has settled. """
+        now = time.time()
+        if self._flip_burst_id is not None:
+            gobject.source_remove(self._flip_burst_id)
+            self._flip_burst_id = None
+        if (now - self._last_flip_time) * 1000 < FLIP_BURST_DELAY and \
+           not prefs['default continuous mode']:
+            self._flip_burst_id = gobject.timeout_add(FLIP_BURST_DELAY,
+                                                      self._flip_burst_done)
+        self._last_flip_time = now
+
+    def _flip_burst_done(self):
+        self._flip_burst_id = None
+        log.debug('Page flipping settled on page %u',
+                  self.imagehandler.get_current_page())
+        if self.filehandler.file_loaded:
+            self.imagehandler.do_cacheing()
+            self.draw_image(scroll_to=self._last_scroll_destination)
+        return False
+
+    def get_step_destination(self, page, step, single_step=False):
+        """ Return the page reached when flipping <step> pages from <page>,
+        taking double page mode into account. The result is not clamped to
+        the valid range of pages. """
+        new_page = page + step
+        if (1 == abs(step) and
+            not single_step and
+            prefs['default double page'] and
+            not prefs['default continuous mode'] and
+            prefs['double step in double page mode']):
+            if +1 == step and not self.imagehandler.get_virtual_double_page(page):
+                new_page += 1
+            elif -1 == step and not self.imagehandler.get_virtual_double_page(new_page - 1):
+                new_page -= 1
+        return new_page
+
     def first_page(self):
         number_of_pages = self.imagehandler.get_number_of_pages()
         if number_of_pages:
@@ -727,6 +1081,12 @@ class MainWindow(gtk.Window):
         self._update_page_information()
         self.draw_image()
 
+    def change_continuous_mode(self, toggleaction):
+        prefs['default continuous mode'] = toggleaction.get_active()
+        self.imagehandler.do_cacheing()
+        self._update_page_information()
+        self.draw_image()
+
     def change_manga_mode(self, toggleaction):
         prefs['default manga mode'] = toggleaction.get_active()
         self.is_manga_mode = toggleaction.get_active()
@@ -807,7 +1167,7 @@ class MainWindow(gtk.Window):
         self.zoom.reset_user_zoom()
         self.draw_image()
 
-    def _show_scrollbars(self, request):
+    def show_scrollbars(self, request):
         """ Enables scroll bars depending on requests and preferences. """
 
         limit = self._should_toggle_be_visible('show scrollbar')
@@ -822,11 +1182,8 @@ class MainWindow(gtk.Window):
         port horizontally and must be scrolled to be viewed completely. """
 
         screen_width, _ = self.get_visible_area_size()
-        left_width = self.images[0].get_pixbuf() and \
-                self.images[0].get_pixbuf().get_width() or 0 # XXX transitional(double page limitation)
-        right_width = self.images[1].get_pixbuf() and \
-                self.images[1].get_pixbuf().get_width() or 0 # XXX transitional(double page limitation)
-        image_width = max(left_width, right_width)
+        image_width = max([box.get_size()[0] for box in
+                           self.layout.get_content_boxes()])
 
         return image_width > screen_width
 
@@ -835,11 +1192,8 @@ class MainWindow(gtk.Window):
         port vertically and must be scrolled to be viewed completely. """
 
         _, screen_height = self.get_visible_area_size()
-        left_height = self.images[0].get_pixbuf() and \
-                self.images[0].get_pixbuf().get_height() or 0 # XXX transitional(double page limitation)
-        right_height = self.images[1].get_pixbuf() and \
-                self.images[1].get_pixbuf().get_height() or 0 # XXX transitional(double page limitation)
-        image_height = max(left_height, right_height)
+        image_height = max([box.get_size()[1] for box in
+                            self.layout.get_content_boxes()])
 
         return image_height > screen_height
 
@@ -875,12 +1229,15 @@ class MainWindow(gtk.Window):
         if bound is not None and self.is_manga_mode:
             bound = {'first': 'second', 'second': 'first'}[bound]
 
-        if bound == 'first':
+        # Note: use the layout rather than the images, since pages
+        # rendered by tiles are not displayed with their image.
+        content_boxes = self.layout.get_content_boxes()
+        if bound == 'first' and len(content_boxes) > 1:
             hadjust_upper = max(0, hadjust_upper -
-                self.images[1].size_request()[0] - 2) # XXX transitional(double page limitation)
+                content_boxes[1].get_size()[0] - 2) # XXX transitional(double page limitation)
 
         elif bound == 'second':
-            hadjust_lower = self.images[0].size_request()[0] + 2 # XXX transitional(double page limitation)
+            hadjust_lower = content_boxes[0].get_size()[0] + 2 # XXX transitional(double page limitation)
 
         new_hadjust = old_hadjust + x
         new_vadjust = old_vadjust + y
@@ -920,17 +1277,24 @@ class MainWindow(gtk.Window):
             i.hide()
         for i in self.images:
             i.clear()
-        self._show_scrollbars([False] * len(self._scroll))
+            i.set_size_request(-1, -1)
+        self._tiled_pages = []
+        self.continuous.clear()
+        self.show_scrollbars([False] * len(self._scroll))
         self.layout = _dummy_layout()
         self._main_layout.set_size(*self.layout.get_union_box().get_size())
         self.set_bg_colour(prefs['bg colour'])
 
-    def displayed_double(self):
-        """Return True if two pages are currently displayed."""
-        return (self.imagehandler.get_current_page() and
+    def displayed_double(self, page=None):
+        """Return True if two pages are currently displayed (or would be
+        displayed, starting from <page>)."""
+        if page is None:
+            page = self.imagehandler.get_current_page()
+        return (page and
                 prefs['default double page'] and
-                not self.imagehandler.get_virtual_double_page() and
-                self.imagehandler.get_current_page() != self.imagehandler.get_number_of_pages())
+                not prefs['default continuous mode'] and
+                not self.imagehandler.get_virtual_double_page(page) and
+                page != self.imagehandler.get_number_of_pages())
 
     def get_visible_area_size(self):
         """Return a 2-tuple with the width and height of the visible part
@@ -1014,7 +1378,8 @@ class MainWindow(gtk.Window):
         save_dialog.set_current_name(suggested_name.encode('utf-8'))
 
         if save_dialog.run() == gtk.RESPONSE_ACCEPT and save_dialog.get_filename():
-            shutil.copy(self.imagehandler.get_path_to_page(),
+            shutil.copy(self.filehandler.materialize(
+                self.imagehandler.get_path_to_page()),
                 save_dialog.get_filename().decode('utf-8'))
 
         save_dialog.destroy()
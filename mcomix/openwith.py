@@ -234,7 +234,8 @@ class OpenWithCommand(object):
         elif identifier == u'D':
             return os.path.normpath(os.path.dirname(window.imagehandler.get_path_to_page()))
         elif identifier == u'F':
-            return os.path.normpath(window.imagehandler.get_path_to_page())
+            return os.path.normpath(window.filehandler.materialize(
+                window.imagehandler.get_path_to_page()))
         elif identifier == u'C':
             return os.path.dirname(window.filehandler.get_path_to_base())
         elif identifier == u'B':
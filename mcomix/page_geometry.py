@@ -0,0 +1,216 @@
+"""page_geometry.py - Persistent index of pages format and dimensions."""
+from __future__ import with_statement
+
+import os
+import threading
+from collections import namedtuple
+
+from mcomix import constants
+from mcomix import log
+from mcomix.worker_thread import WorkerThread
+
+try:
+    from sqlite3 import dbapi2
+except ImportError:
+    try:
+        from pysqlite2 import dbapi2
+    except ImportError:
+        log.warning( _('! Could neither find pysqlite2 nor sqlite3.') )
+        dbapi2 = None
+
+
+#: Geometry of a page: image format, raw dimensions, and implied rotation
+#: (in degrees, from Exif data) as returned by image_tools.get_image_geometry.
+PageGeometry = namedtuple('PageGeometry', 'format width height rotation')
+
+
+class GeometryIndex(object):
+
+    """Index of the geometry of each page of the current book.
+
+    Geometries are probed from image headers (no decoding involved) by a
+    background thread as pages become available. For archives, the index
+    is stored on disk, keyed by the archive path, size and modification
+    time, so reopening a book does not need to probe its pages again.
+
+    Data computed from decoded pages (e.g. edge colours) can be attached
+    to the geometry too, but is only kept in memory.
+    """
+
+    #: Maximum number of books kept in the database.
+    MAX_BOOKS = 1000
+
+    def __init__(self, probe, database_path=constants.GEOMETRY_DATABASE_PATH,
+                 probed=None):
+        """Create a new index: <probe> is called with an image path and must
+        return a sequence (format, width, height, rotation). If specified,
+        <probed> is called (from the background thread) with the name and
+        path of each page which geometry was probed in the background."""
+        self._probe = probe
+        self._probed = probed
+        self._database_path = database_path
+        self._con = None
+        self._lock = threading.Lock()
+        self._thread = WorkerThread(self._probe_order, name='geometry',
+                                    unique_orders=True)
+        #: Key (path, size, mtime) of the current book, None if not stored.
+        self._book = None
+        #: Map page name > PageGeometry.
+        self._geometries = {}
+        #: Map page name > edge colours (see image_tools.get_edge_colours).
+        self._edge_colours = {}
+        #: Set to True when new geometries need to be stored.
+        self._dirty = False
+
+    def open(self, book_path=None):
+        """Start indexing a new book. If <book_path> is specified (i.e. an
+        archive), previously stored geometries for this book are loaded."""
+        self.close()
+        if book_path is None:
+            return
+        try:
+            stat = os.stat(book_path)
+        except OSError:
+            return
+        self._book = (os.path.abspath(book_path), stat.st_size, stat.st_mtime)
+        con = self._connect()
+        if con is None:
+            return
+        path, size, mtime = self._book
+        with self._lock:
+            row = con.execute('''select size, mtime from book where path = ?''',
+                              (path,)).fetchone()
+            if row is None or tuple(row) != (size, mtime):
+                # Unknown book, or modified since last time.
+                return
+            con.execute('''update book set accessed = julianday('now')
+                           where path = ?''', (path,))
+            for name, format, width, height, rotation in con.execute(
+                '''select name, format, width, height, rotation
+                   from page where book = ?''', (path,)):
+                self._geometries[name] = PageGeometry(format, width,
+                                                      height, rotation)
+        log.debug('Loaded geometry of %u page(s)', len(self._geometries))
+
+    def close(self):
+        """Stop indexing the current book, saving new geometries to disk."""
+        self._thread.stop()
+        self._thread = WorkerThread(self._probe_order, name='geometry',
+                                    unique_orders=True)
+        if self._book is not None and self._dirty:
+            self._save()
+        self._book = None
+        self._geometries = {}
+        self._edge_colours = {}
+        self._dirty = False
+
+    def get(self, name):
+        """Return the PageGeometry of page <name> if known, None otherwise."""
+        with self._lock:
+            return self._geometries.get(name, None)
+
+    def set(self, name, geometry):
+        """Record the <geometry> of page <name> (e.g. known from
+        decoding it)."""
+        with self._lock:
+            self._geometries[name] = geometry
+            self._dirty = True
+
+    def get_edge_colours(self, name):
+        """Return the edge colours of page <name> if known, None otherwise."""
+        with self._lock:
+            return self._edge_colours.get(name, None)
+
+    def set_edge_colours(self, name, edge_colours):
+        """Remember the <edge_colours> of page <name>."""
+        with self._lock:
+            self._edge_colours[name] = edge_colours
+
+    def probe(self, name, path, wait=False):
+        """Probe the geometry of page <name> from the image at <path>, if not
+        already known. If <wait> is False, the probing is done in the
+        background, otherwise the PageGeometry is returned."""
+        geometry = self.get(name)
+        if geometry is not None:
+            return geometry
+        if not wait:
+            self._thread.append_order((name, path))
+            return None
+        return self._probe_page((name, path))
+
+    def _probe_order(self, order):
+        geometry = self._probe_page(order)
+        if geometry is not None and 0 != geometry.width and \
+           self._probed is not None:
+            self._probed(*order)
+
+    def _probe_page(self, order):
+        name, path = order
+        try:
+            geometry = PageGeometry(*self._probe(path))
+        except Exception, e:
+            log.debug('Could not get geometry of %s: %s', path, e)
+            return None
+        if 0 == geometry.width:
+            # Unknown format.
+            return geometry
+        with self._lock:
+            self._geometries[name] = geometry
+            self._dirty = True
+        return geometry
+
+    def _connect(self):
+        if self._con is None and dbapi2 is not None:
+            try:
+                self._con = dbapi2.connect(self._database_path,
+                    check_same_thread=False, isolation_level=None)
+                self._con.execute('''create table if not exists book (
+                    path text primary key,
+                    size integer,
+                    mtime real,
+                    accessed real)''')
+                self._con.execute('''create table if not exists page (
+                    book text not null,
+                    name text not null,
+                    format text,
+                    width integer,
+                    height integer,
+                    rotation integer,
+                    primary key (book, name))''')
+            except dbapi2.Error, e:
+                log.error(_('! Could not open geometry database: %s'), e)
+                self._con = None
+        return self._con
+
+    def _save(self):
+        con = self._connect()
+        if con is None:
+            return
+        path, size, mtime = self._book
+        with self._lock:
+            rows = [(path, name) + tuple(geometry)
+                    for name, geometry in self._geometries.iteritems()]
+            try:
+                con.execute('begin')
+                con.execute('''delete from page where book = ?''', (path,))
+                con.execute('''insert or replace into book
+                               (path, size, mtime, accessed)
+                               values (?, ?, ?, julianday('now'))''',
+                            (path, size, mtime))
+                con.executemany('''insert into page
+                                   (book, name, format, width, height, rotation)
+                                   values (?, ?, ?, ?, ?, ?)''', rows)
+                # Forget about the least recently accessed books.
+                con.execute('''delete from book where path not in (
+                               select path from book
+                               order by accessed desc limit ?)''',
+                            (self.MAX_BOOKS,))
+                con.execute('''delete from page where book not in (
+                               select path from book)''')
+                con.execute('commit')
+            except dbapi2.Error, e:
+                con.execute('rollback')
+                log.error(_('! Could not save pages geometry: %s'), e)
+        log.debug('Saved geometry of %u page(s)', len(rows))
+
+# vim: expandtab:sw=4:ts=4
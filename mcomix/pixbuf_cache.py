@@ -0,0 +1,182 @@
+"""pixbuf_cache.py - Memory bounded cache for decoded/rendered pixbufs."""
+from __future__ import with_statement
+
+import threading
+from collections import namedtuple, OrderedDict
+
+from mcomix import log
+
+
+#: Snapshot of a cache usage counters.
+CacheStats = namedtuple('CacheStats', 'count size hits misses evictions')
+
+
+def get_pixbuf_size(pixbuf):
+    """Return the size in bytes of the pixel data of <pixbuf>."""
+    return pixbuf.get_rowstride() * pixbuf.get_height()
+
+
+class PixbufCache(object):
+
+    """A thread-safe cache of pixbufs, bounded by the total size of their
+    pixel data instead of by a number of entries.
+
+    When the cache size grows past its budget, entries are evicted: those
+    for pages farthest from the current page go first, the least recently
+    used one being chosen between pages at the same distance. Entries for
+    pinned pages (i.e. the ones currently displayed) are never evicted,
+    even if that means exceeding the budget.
+    """
+
+    def __init__(self, max_size=0, get_page=None, name=None):
+        """Create a new empty cache.
+
+        <max_size> is the cache budget in bytes, a value of 0 (or less)
+        means the cache is unbounded. <get_page> is used to map an entry key
+        to the page index used for computing its distance to the current
+        page, by default keys are assumed to be page indexes. Optional
+        <name> is used for identifying the cache in log messages.
+        """
+        self._max_size = max_size
+        self._get_page = get_page
+        self._name = name or 'pixbuf'
+        self._lock = threading.Lock()
+        #: Map key > (pixbuf, size), least recently used first.
+        self._entries = OrderedDict()
+        #: Total size of cached pixbufs.
+        self._size = 0
+        #: Index of the current page, reference for eviction distances.
+        self._current = None
+        #: Set of indexes of pages that must not be evicted.
+        self._pinned = frozenset()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, key):
+        with self._lock:
+            pixbuf, size = self._entries[key]
+            return pixbuf
+
+    def __setitem__(self, key, pixbuf):
+        self.put(key, pixbuf)
+
+    def __delitem__(self, key):
+        with self._lock:
+            pixbuf, size = self._entries.pop(key)
+            self._size -= size
+
+    def keys(self):
+        """Return a list of cached keys, least recently used first."""
+        with self._lock:
+            return self._entries.keys()
+
+    def get(self, key, default=None):
+        """Return the pixbuf cached for <key>, or <default> if there is none.
+
+        Unlike other accessors, this method updates the cache statistics and
+        marks the entry as the most recently used one.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._misses += 1
+                return default
+            self._hits += 1
+            self._entries[key] = entry
+            return entry[0]
+
+    def put(self, key, pixbuf):
+        """Add (or replace) the entry for <key>, evicting older entries if
+        necessary to stay within budget."""
+        size = get_pixbuf_size(pixbuf)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry[1]
+            self._entries[key] = (pixbuf, size)
+            self._size += size
+            self._evict()
+
+    def clear(self):
+        """Remove all entries and reset statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._current = None
+            self._pinned = frozenset()
+            self._hits = self._misses = self._evictions = 0
+
+    def get_size(self):
+        """Return the total size in bytes of cached pixbufs."""
+        with self._lock:
+            return self._size
+
+    def get_max_size(self):
+        return self._max_size
+
+    def set_max_size(self, max_size):
+        """Change the cache budget (in bytes), evicting entries if necessary."""
+        with self._lock:
+            self._max_size = max_size
+            self._evict()
+
+    def set_current(self, index, pinned=()):
+        """Set the current page <index>, and the indexes of pages that must
+        stay in cache (<pinned>). Entries are then evicted if needed."""
+        with self._lock:
+            self._current = index
+            self._pinned = frozenset(pinned)
+            self._evict()
+
+    def get_stats(self):
+        """Return a L{CacheStats} snapshot of the cache usage."""
+        with self._lock:
+            return CacheStats(len(self._entries), self._size,
+                              self._hits, self._misses, self._evictions)
+
+    def _page(self, key):
+        if self._get_page is None:
+            return key
+        return self._get_page(key)
+
+    def _evict(self):
+        """Evict entries until the cache fits its budget. Must be called
+        with the lock held."""
+        if self._max_size <= 0:
+            return
+        while self._size > self._max_size:
+            victim = None
+            victim_score = None
+            for age, key in enumerate(reversed(self._entries.keys())):
+                page = self._page(key)
+                if page in self._pinned:
+                    continue
+                if self._current is None:
+                    distance = 0
+                else:
+                    distance = abs(page - self._current)
+                score = (distance, age)
+                if victim_score is None or score > victim_score:
+                    victim, victim_score = key, score
+            if victim is None:
+                # Only pinned entries are left.
+                break
+            pixbuf, size = self._entries.pop(victim)
+            self._size -= size
+            self._evictions += 1
+            log.debug('Evicted %s cache entry %s (%u bytes)',
+                      self._name, victim, size)
+
+# vim: expandtab:sw=4:ts=4
@@ -29,6 +29,7 @@ prefs = {
     'cache': True,
     'stretch': False,
     'default double page': False,
+    'default continuous mode': False,
     'default fullscreen': False,
     'zoom mode': constants.ZOOM_MODE_BEST,
     'default manga mode': False,
@@ -76,6 +77,10 @@ prefs = {
     'sharpness': 1.0,
     'auto contrast': False,
     'max pages to cache': 7,
+    'max page cache size': 512,  # MiB, 0 for no limit
+    'max render cache size': 128,  # MiB, 0 for no limit
+    'max extraction memory size': 256,  # MiB, 0 to always extract to disk
+    'extraction cache size': 0,  # MiB, 0 to disable
     'window x': 0,
     'window y': 0,
     'window height': 600,
@@ -93,6 +98,8 @@ prefs = {
                         constants.STATUS_PATH | constants.STATUS_FILENAME,
     'max threads': 3,
     'max extract threads': 1,
+    'max decode threads': 2,
+    'decode at display size': False,
     'wrap mouse scroll': False,
     'scaling quality': 2,  # gtk.gdk.INTERP_BILINEAR
     'escape quits': False,
@@ -270,6 +270,16 @@ class _PreferencesDialog(gtk.Dialog):
             1, 1, 16, 1, 4, 0,
             _('Set the maximum number of concurrent threads for formats that support it.')))
 
+        page.add_row(gtk.Label(_('Maximum number of concurrent decoding threads:')),
+            self._create_pref_spinner('max decode threads',
+            1, 1, 16, 1, 4, 0,
+            _('Set the maximum number of threads used for decoding pages ahead of time. Changes take effect when the next file is opened.')))
+
+        page.add_row(self._create_pref_check_button(
+            _('Decode big pages at display size'),
+            'decode at display size',
+            _('Decode pages much bigger than the screen at a reduced size, which is faster and uses less memory. Pages are still decoded at full resolution when zooming in, using the magnifying lens, or copying them to the clipboard.')))
+
         page.add_row(self._create_pref_check_button(
             _('Store thumbnails for opened files'),
             'create thumbnails',
@@ -280,6 +290,26 @@ class _PreferencesDialog(gtk.Dialog):
             1, -1, 500, 1, 3, 0,
             _('Set the max number of pages to cache. A value of -1 will cache the entire archive.')))
 
+        page.add_row(gtk.Label(_('Maximum size of the page cache (in MiB):')),
+            self._create_pref_spinner('max page cache size',
+            1, 0, 65536, 16, 128, 0,
+            _('Set the maximum amount of memory used by decoded pages. Pages farthest from the current page are dropped first when the limit is reached. A value of 0 means no limit.')))
+
+        page.add_row(gtk.Label(_('Maximum size of the render cache (in MiB):')),
+            self._create_pref_spinner('max render cache size',
+            1, 0, 65536, 16, 128, 0,
+            _('Set the maximum amount of memory used by pages scaled for display. A value of 0 means no limit.')))
+
+        page.add_row(gtk.Label(_('Maximum memory used for extracting archives (in MiB):')),
+            self._create_pref_spinner('max extraction memory size',
+            1, 0, 65536, 16, 128, 0,
+            _('Set the maximum amount of memory used for keeping files extracted from ZIP and tar archives, instead of writing them to a temporary directory. Once the limit is reached, files are extracted to disk. A value of 0 means files are always extracted to disk.')))
+
+        page.add_row(gtk.Label(_('Maximum size of the extraction cache (in MiB):')),
+            self._create_pref_spinner('extraction cache size',
+            1, 0, 65536, 64, 256, 0,
+            _('Set the maximum amount of disk space used for keeping files extracted from recently read archives, so they do not need to be extracted again when reopened. Extracted pages are then kept on disk after closing an archive. Least recently read archives are removed first. A value of 0 (the default) disables the cache.')))
+
         page.new_section(_('Magnifying Lens'))
 
         page.add_row(gtk.Label(_('Magnifying lens size (in pixels):')),
@@ -695,6 +725,9 @@ class _PreferencesDialog(gtk.Dialog):
             if not prefs['smart bg'] or not self._window.filehandler.file_loaded:
                 self._window.set_bg_colour(prefs['bg colour'])
 
+        elif preference == 'decode at display size':
+            self._window.draw_image()
+
         elif preference == 'smart bg' and button.get_active():
 
             # if the color is no longer using the smart background then return it to the chosen color
@@ -804,6 +837,22 @@ class _PreferencesDialog(gtk.Dialog):
             prefs[preference] = int(value)
             self._window.imagehandler.do_cacheing()
 
+        elif preference == 'max page cache size':
+            prefs[preference] = int(value)
+            self._window.imagehandler.set_cache_size(prefs[preference])
+
+        elif preference == 'max render cache size':
+            prefs[preference] = int(value)
+            self._window.renderer.set_cache_size(prefs[preference])
+
+        elif preference == 'max extraction memory size':
+            prefs[preference] = int(value)
+            self._window.filehandler.set_extraction_memory_size(prefs[preference])
+
+        elif preference == 'extraction cache size':
+            prefs[preference] = int(value)
+            self._window.filehandler.set_extraction_cache_size(prefs[preference])
+
         elif preference == 'number of key presses before page turn':
             prefs['number of key presses before page turn'] = int(value)
             self._window._event_handler._extra_scroll_events = 0
@@ -815,6 +864,9 @@ class _PreferencesDialog(gtk.Dialog):
         elif preference == 'max extract threads':
             prefs[preference] = int(value)
 
+        elif preference == 'max decode threads':
+            prefs[preference] = int(value)
+
 
     def _entry_cb(self, entry, event=None):
         """Callback for entry-type preferences."""
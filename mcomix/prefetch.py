@@ -0,0 +1,163 @@
+"""prefetch.py - Adaptive window of pages to get ready ahead of time."""
+
+import math
+import time
+
+from mcomix import log
+
+
+#: Number of recent page changes used for estimating the navigation
+#: direction and rate.
+HISTORY_SIZE = 8
+
+#: Page changes of more than this many spreads are jumps (e.g. using the
+#: page selector or a bookmark): they reset the navigation history.
+MAX_STEP = 2
+
+#: Page changes older than this many seconds are forgotten.
+HISTORY_TIMEOUT = 120
+
+#: Pages that would be reached within this many seconds at the current
+#: navigation rate are fetched ahead.
+HORIZON = 20
+
+#: Minimum number of spreads fetched ahead, whatever the rate.
+MIN_LEAD = 2
+
+#: Navigation with a direction score at least this high (in absolute
+#: value, see Prefetcher.get_direction) is considered steady.
+STEADY_DIRECTION = 0.75
+
+
+class Prefetcher(object):
+
+    """Tracks recent navigation in a book, to decide which pages around
+    the current one should be extracted and decoded ahead of time.
+
+    Pages are fetched in the direction the reader is moving, as far as
+    needed for the pages reached within HORIZON seconds at the current
+    rate (or the slideshow rate, if one is running), and bounded by the
+    number of pages that can be cached. A spread is kept behind, or more
+    if the reader goes back and forth.
+    """
+
+    def __init__(self, clock=time.time):
+        #: Function returning the current time in seconds.
+        self._clock = clock
+        #: List of recent (time, page) changes, oldest first.
+        self._history = []
+        #: Delay (in seconds) between flips of a running slideshow.
+        self._slideshow_delay = None
+
+    def reset(self):
+        """Forget the navigation history (e.g. on book change)."""
+        self._history = []
+
+    def set_slideshow_delay(self, delay):
+        """Set the <delay> (in seconds) between pages flipped by a running
+        slideshow, None if no slideshow is running."""
+        self._slideshow_delay = delay
+
+    def page_changed(self, page, page_width=1):
+        """Record that <page> is now the current page, <page_width> being
+        the number of pages displayed."""
+        now = self._clock()
+        if self._history:
+            last_time, last_page = self._history[-1]
+            if page == last_page:
+                return
+            if abs(page - last_page) > MAX_STEP * page_width or \
+               now - last_time > HISTORY_TIMEOUT:
+                log.debug('Prefetch: jumped to page %u, '
+                          'forgetting navigation history', page)
+                self._history = []
+        self._history.append((now, page))
+        del self._history[:-HISTORY_SIZE]
+
+    def get_direction(self):
+        """Return a score between -1 (steadily moving backward) and 1
+        (steadily moving forward), recent moves weighting more. Return
+        None if there is no navigation history."""
+        moves = [page - previous_page for (t0, previous_page), (t1, page)
+                 in zip(self._history[:-1], self._history[1:])]
+        if not moves:
+            return None
+        score = total = 0.0
+        weight = 1.0
+        for move in reversed(moves):
+            score += weight * cmp(move, 0)
+            total += weight
+            weight *= 0.7
+        return score / total
+
+    def get_rate(self):
+        """Return the navigation rate in pages per second, None if unknown.
+
+        The time elapsed since the last page change counts, so the rate
+        decreases while the reader is staying on a page."""
+        if len(self._history) < 3:
+            return None
+        pages = sum([abs(page - previous_page) for (t0, previous_page), (t1, page)
+                     in zip(self._history[:-1], self._history[1:])])
+        duration = self._clock() - self._history[0][0]
+        if duration <= 0:
+            return None
+        return pages / duration
+
+    def get_page_list(self, page, page_width, max_pages, number_of_pages):
+        """Return the list of the indexes of the pages to get ready around
+        <page>, by order of priority.
+
+        <page_width> is the number of pages displayed from <page>, and
+        <max_pages> the maximum number of pages to return (including the
+        displayed ones).
+        """
+        first = page - 1
+        remaining = max(0, max_pages - page_width)
+        if self._slideshow_delay is not None:
+            direction = 1.0
+            rate = page_width / float(max(0.001, self._slideshow_delay))
+        else:
+            direction = self.get_direction()
+            rate = self.get_rate()
+
+        if rate is None:
+            reach = remaining
+        else:
+            reach = max(MIN_LEAD * page_width,
+                        int(math.ceil(rate * HORIZON)))
+        if self._slideshow_delay is not None:
+            # Slideshows never go back.
+            behind = 0
+        elif direction is None or abs(direction) >= STEADY_DIRECTION:
+            behind = min(page_width, remaining)
+        else:
+            # Going back and forth.
+            behind = remaining // 2
+        ahead = min(remaining - behind, reach)
+
+        if direction is not None and direction < 0:
+            ahead_list = range(first - 1, first - 1 - ahead, -1)
+            behind_list = range(first + page_width,
+                                first + page_width + behind)
+        else:
+            ahead_list = range(first + page_width,
+                               first + page_width + ahead)
+            behind_list = range(first - 1, first - 1 - behind, -1)
+
+        # Displayed pages first, then the next spread, the previous one,
+        # and the rest.
+        page_list = (range(first, first + page_width) +
+                     ahead_list[:page_width] + behind_list[:page_width] +
+                     ahead_list[page_width:] + behind_list[page_width:])
+        page_list = [index for index in page_list
+                     if 0 <= index < number_of_pages]
+
+        log.debug('Prefetch around page %u: direction %s, rate %s, '
+                  '%u page(s) ahead, %u behind (out of %u)', page,
+                  'unknown' if direction is None else '%+.2f' % direction,
+                  'unknown' if rate is None else '%.2f/s' % rate,
+                  ahead, behind, remaining)
+        return page_list
+
+# vim: expandtab:sw=4:ts=4
@@ -111,6 +111,12 @@ class _PropertiesDialog(gtk.Dialog):
         secondary_info = [
             (_('Location'), i18n.to_unicode(os.path.dirname(location))),
         ]
+        data = self._window.filehandler.get_file_data(location)
+        if data is not None:
+            # Extracted in memory: don't write it to disk just for this.
+            secondary_info.append((_('Size'), _format_size(len(data))))
+            page.set_secondary_info(secondary_info)
+            return
         try:
             stats = os.stat(location)
         except OSError as e:
@@ -120,12 +126,8 @@ class _PropertiesDialog(gtk.Dialog):
             uid = pwd.getpwuid(stats.st_uid)[0]
         else:
             uid = str(stats.st_uid)
-        if stats.st_size > 1048576.0:
-            size = '%.1f MiB' % (stats.st_size / 1048576.0)
-        else:
-            size = '%.1f KiB' % (stats.st_size / 1024.0)
         secondary_info.extend((
-            (_('Size'), size),
+            (_('Size'), _format_size(stats.st_size)),
             (_('Accessed'), time.strftime('%Y-%m-%d, %H:%M:%S',
             time.localtime(stats.st_atime))),
             (_('Modified'), time.strftime('%Y-%m-%d, %H:%M:%S',
@@ -135,4 +137,9 @@ class _PropertiesDialog(gtk.Dialog):
         ))
         page.set_secondary_info(secondary_info)
 
+def _format_size(size):
+    if size > 1048576.0:
+        return '%.1f MiB' % (size / 1048576.0)
+    return '%.1f KiB' % (size / 1024.0)
+
 # vim: expandtab:sw=4:ts=4
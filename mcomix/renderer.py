@@ -0,0 +1,531 @@
+"""renderer.py - Turns raw page pixbufs into display ready pixbufs."""
+
+import operator
+import threading
+import gtk
+
+from mcomix.preferences import prefs
+from mcomix import callback
+from mcomix import histogram
+from mcomix import image_tools
+from mcomix import log
+from mcomix import pixbuf_cache
+from mcomix.worker_thread import WorkerThread
+
+#: Pages with at least this many pixels are not rendered on the main
+#: thread: a fast (but low quality) rendering is displayed first, see
+#: Renderer.render. Below that, the final rendering is cheap enough.
+PROGRESSIVE_MIN_PIXELS = 1024 * 1024
+
+#: Pages rendered at a size of at least this many pixels are rendered
+#: by tiles, see Renderer.render_tiled.
+TILED_MIN_PIXELS = 16 * 1024 * 1024
+
+#: Size of a tile (in pixels).
+TILE_SIZE = 512
+
+#: Tiles are rendered with this many extra pixels on each side when
+#: sharpened, so the filter sees the neighbouring tiles pixels.
+TILE_MARGIN = 2
+
+
+class Renderer(object):
+
+    """The Renderer takes care of the final steps of displaying a page:
+    scaling (and compositing alpha pages), rotation, flipping, and
+    enhancement.
+
+    Rendered pixbufs are cached, keyed by page and view parameters, so that
+    redraws that do not change them (e.g. toggling the statusbar, or a
+    resize event not changing the page size) are only a cache lookup.
+
+    The spreads before and after the current one are also rendered ahead of
+    time by a background thread, so flipping pages does not have to wait for
+    scaling and enhancement.
+
+    Pages that still need rendering when displayed are rendered
+    progressively, so the main thread does not block on scaling: a fast
+    rendering (or the page thumbnail, until it is ready) is displayed
+    first, and the final one swapped in once done. Both are done by
+    another background thread. Final renderings of pages that are no
+    longer displayed (or displayed with other view parameters) are
+    dropped instead of being swapped in.
+
+    While the window is being resized, only interim renderings are done:
+    the last rendering of a page is scaled fast to the new size, and the
+    final rendering is left for when resizing is over.
+
+    Pages displayed at a huge size (e.g. zooming on a webtoon strip) are
+    rendered by tiles instead, only for the parts that are shown. Tiles
+    are rendered in the background too, and drawn once ready.
+    """
+
+    def __init__(self, window):
+        #: Reference to main window
+        self._window = window
+        #: Rendered pixbufs cache, entries are keyed by render key
+        #: (see _get_render_key), the first item being the page index.
+        self._cache = pixbuf_cache.PixbufCache(
+            get_page=operator.itemgetter(0), name='render')
+        #: Rendered tiles cache, entries are keyed by render key + (column, row).
+        self._tiles = pixbuf_cache.PixbufCache(
+            get_page=operator.itemgetter(0), name='tile')
+        self.set_cache_size(prefs['max render cache size'])
+        #: Pre-rendering thread.
+        self._thread = WorkerThread(self._prerender, name='render',
+                                    sort_orders=True)
+        #: Final rendering thread, for progressive rendering.
+        self._quality_thread = WorkerThread(self._render_quality,
+                                            name='render-quality',
+                                            unique_orders=True)
+        #: Tiles rendering thread.
+        self._tile_thread = WorkerThread(self._render_tile_order,
+                                         name='render-tiles',
+                                         unique_orders=True)
+        #: Set of indexes of the displayed pages.
+        self._displayed = frozenset()
+        #: Incremented each time the displayed pages change, so stale
+        #: tiles are not drawn.
+        self._generation = 0
+        #: Map page index > (render key, pixbuf) of the last rendering
+        #: returned for display (pixbuf is None for stand-ins).
+        self._last_rendered = {}
+        #: If True, only do interim renderings (see set_interim).
+        self._interim = False
+        #: Map page index > (raw pixbuf, histogram) of displayed pages,
+        #: so all the tiles of a page are enhanced alike.
+        self._histograms = {}
+        self._histograms_lock = threading.Lock()
+
+    def set_cache_size(self, size):
+        """Set the maximum size of the render cache to <size> MiB
+        (0 means no limit). The tiles cache uses the same limit."""
+        self._cache.set_max_size(size * 1024 * 1024)
+        self._tiles.set_max_size(size * 1024 * 1024)
+
+    def set_current(self, index, displayed):
+        """Set the <index> of the current page, and the list of indexes of
+        the <displayed> pages: the later are never evicted from cache.
+
+        Pending final renderings are only dropped for pages that are no
+        longer displayed, so this can be called on each redraw."""
+        displayed = frozenset(displayed)
+        if displayed != self._displayed:
+            self._displayed = displayed
+            self._generation += 1
+            self._tile_thread.clear_orders()
+        self._cache.set_current(index, displayed)
+        self._tiles.set_current(index)
+        for last_index in self._last_rendered.keys():
+            if last_index not in displayed:
+                del self._last_rendered[last_index]
+        with self._histograms_lock:
+            for histogram_index in self._histograms.keys():
+                if histogram_index not in displayed:
+                    del self._histograms[histogram_index]
+
+    def set_interim(self, interim):
+        """If <interim> is True, progressive renderings (see render) only
+        return a fast rendering, and no final rendering is done (e.g. while
+        the window is being resized). Redraw once set back to False."""
+        self._interim = interim
+
+    def clear(self):
+        """Clear the render cache."""
+        self._cache.clear()
+        self._tiles.clear()
+        self._last_rendered.clear()
+        self._displayed = frozenset()
+        with self._histograms_lock:
+            self._histograms.clear()
+
+    def cleanup(self):
+        """Stop pre-rendering and clear the render cache. Should be called
+        when the current file is closed."""
+        self._generation += 1
+        self._thread.stop()
+        self._thread = WorkerThread(self._prerender, name='render',
+                                    sort_orders=True)
+        self._quality_thread.stop()
+        self._quality_thread = WorkerThread(self._render_quality,
+                                            name='render-quality',
+                                            unique_orders=True)
+        self._tile_thread.stop()
+        self._tile_thread = WorkerThread(self._render_tile_order,
+                                         name='render-tiles',
+                                         unique_orders=True)
+        self.clear()
+
+    def prerender(self, page, constraints):
+        """Render the spreads before and after the one starting at <page>
+        in the background, using the viewport <constraints> (see
+        MainWindow.get_viewport_constraints). Pending pre-rendering orders
+        are cancelled."""
+        self._thread.clear_orders()
+        view = self._get_view_parameters()
+        # Next spread first, the reader is more likely to move forward.
+        self._thread.extend_orders([(0, page, +1, constraints, view),
+                                    (1, page, -1, constraints, view)])
+
+    def _get_view_parameters(self):
+        """Return the current view parameters (flipping, enhancement,
+        scaling quality and background), as used in render keys. Must be
+        called from the main thread."""
+        enhancer = self._window.enhancer
+        return (prefs['horizontal flip'], prefs['vertical flip'],
+                enhancer.brightness, enhancer.contrast,
+                enhancer.saturation, enhancer.sharpness,
+                enhancer.autocontrast,
+                prefs['scaling quality'],
+                prefs['checkered bg for transparent images'])
+
+    def _get_render_key(self, index, size, rotation, view=None):
+        """Return the key identifying the rendering of page <index>
+        at <size> with <rotation> using the view parameters <view>
+        (the current ones if None, see _get_view_parameters)."""
+        if view is None:
+            view = self._get_view_parameters()
+        return (index, tuple(size), rotation) + tuple(view)
+
+    def render(self, index, pixbuf, size, rotation, progressive=False,
+               view=None):
+        """Return the rendering of <pixbuf> (the raw pixbuf for the page
+        <index>), scaled to <size>, rotated by <rotation> degrees, flipped
+        and enhanced according to the current preferences.
+
+        If <progressive> is True (i.e. when called from the main thread)
+        and <pixbuf> is not small, a fast rendering may be returned
+        instead, in which case the final rendering is done in the
+        background, and page_rendered emitted once it is ready. Without
+        any fast rendering at hand, None is returned: the caller is
+        expected to show a placeholder until then.
+
+        Worker threads must pass the view parameters to use in <view>
+        (see _get_view_parameters).
+        """
+        key = self._get_render_key(index, size, rotation, view)
+        rendered = self._cache.get(key)
+        if rendered is None and progressive and \
+           (self._interim or
+            (key[-2] != gtk.gdk.INTERP_NEAREST and
+             pixbuf.get_width() * pixbuf.get_height() >= PROGRESSIVE_MIN_PIXELS)):
+            rendered = self._render_interim(key)
+            if not self._interim:
+                if rendered is None:
+                    # Nothing to show yet: get a fast rendering first.
+                    self._quality_thread.append_order((self._get_fast_key(key),
+                                                       pixbuf))
+                self._quality_thread.append_order((key, pixbuf))
+            if rendered is None:
+                self._last_rendered[index] = (key, None)
+                return None
+        if rendered is None:
+            rendered = self._render(key, pixbuf)
+        if progressive:
+            self._last_rendered[index] = (key, rendered)
+        return rendered
+
+    def _get_fast_key(self, key):
+        """Return the key of the fast (nearest neighbour) rendering
+        corresponding to the render <key>."""
+        return key[:-2] + (gtk.gdk.INTERP_NEAREST, key[-1])
+
+    def _render_interim(self, key):
+        """Return a fast rendering for the render <key>, without any
+        rendering pass over the page: the fast rendering if already done,
+        or the last rendering of the page scaled to the new size if only
+        the size (or scaling quality) changed. Return None otherwise."""
+        rendered = self._cache.get(self._get_fast_key(key))
+        if rendered is not None:
+            return rendered
+        last_key, last_rendered = self._last_rendered.get(key[0], (None, None))
+        if last_rendered is not None and \
+           last_key[2:-2] == key[2:-2] and last_key[-1] == key[-1]:
+            width, height = key[1]
+            if (width, height) == (last_rendered.get_width(),
+                                   last_rendered.get_height()):
+                return last_rendered
+            return last_rendered.scale_simple(width, height,
+                                              gtk.gdk.INTERP_NEAREST)
+        return None
+
+    def is_rendered(self, index, size, rotation):
+        """Return True if the final rendering of page <index> at <size>
+        with <rotation> is ready (i.e. render would return it)."""
+        return self._get_render_key(index, size, rotation) in self._cache
+
+    def render_interim(self, index, size, rotation):
+        """Return a fast rendering of page <index> at <size> with
+        <rotation>, without any rendering pass (see _render_interim), or
+        None. Nothing is rendered in the background: e.g. for a page being
+        decoded again at a bigger size."""
+        return self._render_interim(
+            self._get_render_key(index, size, rotation))
+
+    def use_tiles(self, size):
+        """Return True if a page rendered at <size> should be rendered
+        by tiles (see render_tiled)."""
+        return size[0] * size[1] >= TILED_MIN_PIXELS
+
+    def render_tiled(self, index, pixbuf, size, rotation):
+        """Same as render, but return a L{TiledRendering}: tiles are
+        only rendered on demand."""
+        key = self._get_render_key(index, size, rotation)
+        return TiledRendering(self, key, pixbuf)
+
+    def _render(self, key, pixbuf):
+        """Render <pixbuf> according to the render <key>
+        (see _get_render_key), and add the result to the cache."""
+        size, rotation, hflip, vflip = key[1:5]
+        scaling_quality = key[-2]
+        rendered = image_tools.fit_pixbuf_to_rectangle(pixbuf, size, rotation,
+                                                       scaling_quality)
+        if hflip:
+            rendered = rendered.flip(horizontal=True)
+        if vflip:
+            rendered = rendered.flip(horizontal=False)
+        rendered = _enhance(rendered, key)
+        self._cache[key] = rendered
+        return rendered
+
+    def _is_wanted(self, key):
+        """Return True if the rendering for <key> is the one last requested
+        (or its fast rendering) for a page that is still displayed."""
+        index = key[0]
+        if index not in self._displayed:
+            return False
+        last_key, last_rendered = self._last_rendered.get(index, (None, None))
+        return last_key is not None and \
+            key in (last_key, self._get_fast_key(last_key))
+
+    def _render_quality(self, order):
+        key, pixbuf = order
+        if not self._is_wanted(key):
+            # The user moved on already.
+            return
+        if key not in self._cache:
+            log.debug('Rendering page %u in the background (%s)', key[0] + 1,
+                      'fast' if key[-2] == gtk.gdk.INTERP_NEAREST else 'final')
+            self._render(key, pixbuf)
+        self._quality_rendered(key)
+
+    @callback.Callback
+    def _quality_rendered(self, key):
+        """Called once the final rendering of a displayed page is ready."""
+        if not self._is_wanted(key):
+            return
+        # Swap it in: it's in the cache, so it's only a lookup.
+        self.page_rendered(key[0])
+
+    @callback.Callback
+    def page_rendered(self, index):
+        """Emitted (in the main thread) once the final rendering of the
+        displayed page <index> is ready, after a fast rendering of it
+        was returned by render."""
+        pass
+
+    def _render_tile_order(self, order):
+        tile_key, generation, pixbuf = order
+        if generation != self._generation:
+            return
+        if tile_key not in self._tiles:
+            self._render_tile(tile_key[:-2], pixbuf, *tile_key[-2:])
+        self._tile_rendered(generation)
+
+    @callback.Callback
+    def _tile_rendered(self, generation):
+        """Called once a tile of a displayed page is ready."""
+        if generation != self._generation:
+            return
+        self._window.redraw_tiles()
+
+    def _render_tile(self, key, pixbuf, column, row):
+        """Render the tile at <column>, <row> of <pixbuf> according to the
+        render <key>, and add the result to the tiles cache."""
+        size, rotation, hflip, vflip = key[1:5]
+        contrast, sharpness, autocontrast = key[6], key[8], key[9]
+        scaling_quality = key[-2]
+        width, height = size
+        inner_x, inner_y = column * TILE_SIZE, row * TILE_SIZE
+        inner_width = min(TILE_SIZE, width - inner_x)
+        inner_height = min(TILE_SIZE, height - inner_y)
+        margin = TILE_MARGIN if sharpness != 1.0 else 0
+        x, y = max(0, inner_x - margin), max(0, inner_y - margin)
+        tile_width = min(width, inner_x + inner_width + margin) - x
+        tile_height = min(height, inner_y + inner_height + margin) - y
+        # Undo flipping...
+        if hflip:
+            x = width - x - tile_width
+        if vflip:
+            y = height - y - tile_height
+        # ...and rotation, to get the corresponding
+        # region of the page once scaled.
+        if rotation in (90, 270):
+            width, height = height, width
+        if 0 == rotation:
+            region = x, y, tile_width, tile_height
+        elif 90 == rotation:
+            region = y, height - x - tile_width, tile_height, tile_width
+        elif 180 == rotation:
+            region = (width - x - tile_width, height - y - tile_height,
+                      tile_width, tile_height)
+        elif 270 == rotation:
+            region = width - y - tile_height, x, tile_height, tile_width
+        rx, ry, rw, rh = region
+        scale_x = float(width) / pixbuf.get_width()
+        scale_y = float(height) / pixbuf.get_height()
+        tile = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, False, 8, rw, rh)
+        if pixbuf.get_has_alpha():
+            if key[-1]:
+                check_size, color1, color2 = 8, 0x777777, 0x999999
+            else:
+                check_size, color1, color2 = 1024, 0xFFFFFF, 0xFFFFFF
+            pixbuf.composite_color(tile, 0, 0, rw, rh, -rx, -ry,
+                                   scale_x, scale_y, scaling_quality, 255,
+                                   rx, ry, check_size, color1, color2)
+        else:
+            pixbuf.scale(tile, 0, 0, rw, rh, -rx, -ry,
+                         scale_x, scale_y, scaling_quality)
+        tile = image_tools.rotate_pixbuf(tile, rotation)
+        if hflip:
+            tile = tile.flip(horizontal=True)
+        if vflip:
+            tile = tile.flip(horizontal=False)
+        page_histogram = None
+        if contrast != 1.0 or autocontrast:
+            # Contrast depends on the whole page histogram.
+            page_histogram = self._get_page_histogram(key[0], pixbuf)
+        tile = _enhance(tile, key, page_histogram)
+        if margin:
+            tile = tile.subpixbuf(inner_x - x, inner_y - y,
+                                  inner_width, inner_height).copy()
+        self._tiles[key + (column, row)] = tile
+        return tile
+
+    def _get_page_histogram(self, index, pixbuf):
+        """Return the histogram of the raw <pixbuf> of page <index>
+        (see histogram.get_histogram)."""
+        with self._histograms_lock:
+            entry = self._histograms.get(index)
+        if entry is not None and entry[0] is pixbuf:
+            return entry[1]
+        page_histogram = histogram.get_histogram(pixbuf)
+        with self._histograms_lock:
+            self._histograms[index] = (pixbuf, page_histogram)
+        return page_histogram
+
+    def _prerender(self, order):
+        priority, page, step, constraints, view = order
+        window = self._window
+        imagehandler = window.imagehandler
+        page = window.get_step_destination(page, step)
+        number_of_pages = imagehandler.get_number_of_pages()
+        page = max(1, min(page, number_of_pages))
+        if self._thread.must_stop() or not window.filehandler.file_loaded:
+            return
+        pixbuf_count = 2 if window.displayed_double(page) else 1
+        page_list = range(page, page + pixbuf_count)
+        # Never wait on extraction: only pre-render pages that are ready.
+        for p in page_list:
+            if not imagehandler.page_is_available(p):
+                return
+        if self._thread.must_stop():
+            return
+        log.debug('Pre-rendering page(s) %s',
+                  ' '.join([str(p) for p in page_list]))
+        pixbuf_list = imagehandler.get_pixbufs(pixbuf_count, page=page)
+        size_list = [list(image_tools.get_original_size(pixbuf))
+                     for pixbuf in pixbuf_list]
+        if prefs['auto rotate from exif']:
+            rotation_list = [imagehandler.get_page_rotation(p)
+                             for p in page_list]
+        else:
+            rotation_list = [0] * len(pixbuf_list)
+        layout, scaled_sizes, rotation_list, size_list, scrollbar_requests = \
+            window.get_page_layout(size_list, rotation_list, constraints)
+        for i in range(pixbuf_count):
+            if self._thread.must_stop():
+                return
+            if self.use_tiles(scaled_sizes[i]):
+                # Tiles are rendered on demand.
+                continue
+            self.render(page_list[i] - 1, pixbuf_list[i],
+                        scaled_sizes[i], rotation_list[i], view=view)
+
+
+def _enhance(pixbuf, key, histogram=None):
+    """Return <pixbuf> enhanced with the values from the render <key>:
+    the enhancer may have changed since the key was made (e.g. while
+    rendering in the background). See image_tools.enhance for
+    <histogram>."""
+    brightness, contrast, saturation, sharpness, autocontrast = key[5:10]
+    if (brightness != 1.0 or contrast != 1.0 or
+        saturation != 1.0 or sharpness != 1.0 or autocontrast):
+        return image_tools.enhance(pixbuf, brightness, contrast,
+                                   saturation, sharpness, autocontrast,
+                                   histogram=histogram)
+    return pixbuf
+
+
+class TiledRendering(object):
+
+    """The rendering of a page, done by tiles of TILE_SIZE pixels: only the
+    tiles needed for display are rendered (and cached)."""
+
+    def __init__(self, renderer, key, pixbuf):
+        self._renderer = renderer
+        self._key = key
+        self._pixbuf = pixbuf
+        #: Size of the rendering.
+        self.size = key[1]
+
+    def _get_tile_range(self, rect):
+        """Return the list of (column, row) of tiles intersecting <rect>
+        (x, y, width, height), relative to the rendering origin."""
+        x, y, width, height = rect
+        x0 = max(0, x) // TILE_SIZE
+        y0 = max(0, y) // TILE_SIZE
+        x1 = min(x + width, self.size[0])
+        y1 = min(y + height, self.size[1])
+        if x1 <= 0 or y1 <= 0:
+            return []
+        return [(column, row)
+                for row in range(y0, (y1 - 1) // TILE_SIZE + 1)
+                for column in range(x0, (x1 - 1) // TILE_SIZE + 1)]
+
+    def get_tiles(self, rect):
+        """Return a list of (x, y, tile) for the tiles intersecting
+        <rect>. Missing tiles are queued for rendering in the background,
+        and their fast rendering is returned in the meantime if ready
+        (otherwise, they are left out: the background shows through)."""
+        renderer = self._renderer
+        fast_key = renderer._get_fast_key(self._key)
+        tiles = []
+        for column, row in self._get_tile_range(rect):
+            tile = renderer._tiles.get(self._key + (column, row))
+            if tile is None:
+                tile = renderer._tiles.get(fast_key + (column, row))
+                if tile is None and fast_key != self._key:
+                    # Something to show first.
+                    self._queue_tile(column, row, fast_key)
+                self._queue_tile(column, row)
+            if tile is not None:
+                tiles.append((column * TILE_SIZE, row * TILE_SIZE, tile))
+        return tiles
+
+    def queue_tiles(self, rect):
+        """Queue the rendering of the tiles intersecting <rect> that are
+        not rendered yet (e.g. to get them ready for scrolling)."""
+        for column, row in self._get_tile_range(rect):
+            if self._key + (column, row) not in self._renderer._tiles:
+                self._queue_tile(column, row)
+
+    def _queue_tile(self, column, row, key=None):
+        renderer = self._renderer
+        if key is None:
+            key = self._key
+        renderer._tile_thread.append_order((key + (column, row),
+                                            renderer._generation,
+                                            self._pixbuf))
+
+# vim: expandtab:sw=4:ts=4
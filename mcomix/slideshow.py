@@ -1,9 +1,14 @@
 """slideshow.py - Slideshow handler."""
 
+import time
 import gtk
 import gobject
 
 from mcomix.preferences import prefs
+from mcomix import log
+
+#: Number of upcoming flips the next pages are scheduled for.
+SCHEDULED_FLIPS = 3
 
 class Slideshow(object):
 
@@ -13,24 +18,77 @@ class Slideshow(object):
         self._window = window
         self._running = False
         self._id = None
+        #: (current page, next page) when the next flip was scheduled.
+        self._due = None
+        #: Number of pages that were not ready when due.
+        self._missed = 0
 
     def _start(self):
         if not self._running:
             self._id = gobject.timeout_add(prefs['slideshow delay'], self._next)
             self._running = True
+            if 0 == prefs['number of pixels to scroll per slideshow event']:
+                # Flipping at a known rate.
+                self._window.imagehandler.set_slideshow_delay(
+                    prefs['slideshow delay'] / 1000.0)
+                self._schedule()
             self._window.update_title()
 
     def _stop(self):
         if self._running:
             gobject.source_remove(self._id)
             self._running = False
+            self._window.imagehandler.set_slideshow_delay(None)
+            self._window.imagehandler.set_deadlines({})
+            self._due = None
             self._window.update_title()
 
+    def _schedule(self):
+        """Register when the pages of the next flips are due for display,
+        so they get extracted and decoded in time."""
+        window = self._window
+        self._due = None
+        if not window.filehandler.file_loaded:
+            return
+        page = window.imagehandler.get_current_page()
+        if not page:
+            return
+        step = 2 if window.displayed_double() else 1
+        now = time.time()
+        delay = prefs['slideshow delay'] / 1000.0
+        deadlines = {}
+        for flip in range(1, SCHEDULED_FLIPS + 1):
+            for due_page in range(page + flip * step, page + (flip + 1) * step):
+                deadlines[due_page] = now + flip * delay
+        window.imagehandler.set_deadlines(deadlines)
+        self._due = (page, page + step)
+
+    def _check_deadline(self):
+        """Report if the page due for the flip about to happen is not
+        ready yet."""
+        if self._due is None:
+            return
+        imagehandler = self._window.imagehandler
+        page, due_page = self._due
+        if page != imagehandler.get_current_page() or \
+           due_page > imagehandler.get_number_of_pages():
+            return
+        if not imagehandler.page_is_available(due_page):
+            reason = 'not extracted'
+        elif imagehandler.get_cached_pixbuf(due_page) is None:
+            reason = 'not decoded'
+        else:
+            return
+        self._missed += 1
+        log.warning('! Slideshow: page %u was not ready in time (%s), '
+                    '%u page(s) late so far', due_page, reason, self._missed)
+
     def _next(self):
         if prefs['number of pixels to scroll per slideshow event'] != 0:
 
             self._window.scroll_with_flipping(0, prefs['number of pixels to scroll per slideshow event'])
         else:
+            self._check_deadline()
             self._window.flip_page(+1)
 
         return True
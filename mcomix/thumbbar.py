@@ -178,6 +178,19 @@ class ThumbnailSidebar(gtk.ScrolledWindow):
         # Update current image selection in the thumb bar.
         self._set_selected_row(self._currently_selected_row)
 
+    def get_thumbnail(self, page):
+        """Return the thumbnail of <page> (without border) if it has
+        already been generated, None otherwise."""
+        if not self._loaded or not 0 < page <= len(self._thumbnail_liststore):
+            return None
+        number, pixbuf, generated = self._thumbnail_liststore[page - 1]
+        if not generated:
+            return None
+        border = self._BORDER_SIZE
+        return pixbuf.subpixbuf(border, border,
+                                pixbuf.get_width() - 2 * border,
+                                pixbuf.get_height() - 2 * border)
+
     def _generate_thumbnail(self, uid):
         """ Generate the pixbuf for C{path} at demand. """
         assert isinstance(uid, int)
@@ -126,6 +126,9 @@ class MainUI(gtk.UIManager):
                 None, None, window.change_hide_all),
             ('manga_mode', 'mcomix-manga', _('_Manga mode'),
                 None, _('Manga mode'), window.change_manga_mode),
+            ('continuous_mode', None, _('_Continuous mode'),
+                None, _('Display all pages in a continuous vertical strip.'),
+                window.change_continuous_mode),
             ('invert_scroll', gtk.STOCK_UNDO, _('Invert smart scroll'),
                 None, _('Invert smart scrolling direction.'), window.change_invert_scroll),
             ('keep_transformation', None, _('_Keep transformation'),
@@ -257,6 +260,7 @@ class MainUI(gtk.UIManager):
                     <menuitem action="fullscreen" />
                     <menuitem action="double_page" />
                     <menuitem action="manga_mode" />
+                    <menuitem action="continuous_mode" />
                     <separator />
                     <menuitem action="best_fit_mode" />
                     <menuitem action="fit_width_mode" />
@@ -350,6 +354,7 @@ class MainUI(gtk.UIManager):
                     <menuitem action="fullscreen" />
                     <menuitem action="double_page" />
                     <menuitem action="manga_mode" />
+                    <menuitem action="continuous_mode" />
                     <separator />
                     <menuitem action="best_fit_mode" />
                     <menuitem action="fit_width_mode" />
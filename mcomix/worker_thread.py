@@ -9,7 +9,7 @@ from mcomix import log
 class WorkerThread(object):
 
     def __init__(self, process_order, name=None, max_threads=1,
-                 sort_orders=False, unique_orders=False):
+                 sort_orders=False, unique_orders=False, get_deadline=None):
         """Create a new pool of worker threads.
 
         Optional <name> will be added to spawned thread names.
@@ -17,12 +17,20 @@ class WorkerThread(object):
         At most <max_threads> will be started for processing.
         If <sort_orders> is True, the orders queue will be sorted
         after each addition. If <unique_orders> is True, duplicate
-        orders will not be added to the queue. """
+        orders will not be added to the queue.
+
+        If <get_deadline> is specified, it is called with an order to get
+        the time (as returned by time.time) it must be processed by, or
+        None if it has no deadline. The order with the earliest deadline
+        is processed first, orders without deadline are processed after
+        them, in the queue order. Deadlines are checked each time an order
+        is picked, so they can change while orders are queued. """
         self._name = name
         self._process_order = process_order
         self._max_threads = max_threads
         self._sort_orders = sort_orders
         self._unique_orders = unique_orders
+        self._get_deadline = get_deadline
         self._stop = False
         self._threads = []
         # Queue of orders waiting for processing.
@@ -54,6 +62,19 @@ class WorkerThread(object):
             return order[0]
         return order
 
+    def _next_order_index(self):
+        """Return the index in the queue of the next order to process."""
+        if self._get_deadline is None:
+            return 0
+        best_index, best_deadline = 0, None
+        for index, order in enumerate(self._orders_queue):
+            deadline = self._get_deadline(order)
+            if deadline is None:
+                continue
+            if best_deadline is None or deadline < best_deadline:
+                best_index, best_deadline = index, deadline
+        return best_index
+
     def _run(self):
         order_uid = None
         while True:
@@ -64,7 +85,7 @@ class WorkerThread(object):
                     self._condition.wait()
                 if self._stop:
                     return
-                order = self._orders_queue.pop(0)
+                order = self._orders_queue.pop(self._next_order_index())
                 if self._unique_orders:
                     order_uid = self._order_uid(order)
             try:
@@ -0,0 +1,64 @@
+
+import os
+import time
+
+from . import MComixTest
+
+from mcomix.archive_toc import TocCache
+
+
+class TocCacheTest(MComixTest):
+
+    def setUp(self):
+        super(TocCacheTest, self).setUp()
+        self.database_path = os.path.join(self.tmp_dir, 'archive_toc.db')
+        self.archive_path = os.path.join(self.tmp_dir, 'book.cbz')
+        with open(self.archive_path, 'wb') as fp:
+            fp.write('book')
+        self.toc = {
+            'mime': 1,
+            'contents': [u'01.jpg', u'02.jpg'],
+            'solid': False,
+        }
+
+    def _cache(self):
+        return TocCache(database_path=self.database_path)
+
+    def test_get(self):
+        cache = self._cache()
+        self.assertIsNone(cache.get(self.archive_path))
+        cache.set(self.archive_path, self.toc)
+        self.assertEqual(cache.get(self.archive_path), self.toc)
+        # Persistent.
+        self.assertEqual(self._cache().get(self.archive_path), self.toc)
+
+    def test_modified_archive(self):
+        cache = self._cache()
+        cache.set(self.archive_path, self.toc)
+        with open(self.archive_path, 'wb') as fp:
+            fp.write('new book')
+        mtime = time.time() + 10
+        os.utime(self.archive_path, (mtime, mtime))
+        self.assertIsNone(cache.get(self.archive_path))
+
+    def test_missing_archive(self):
+        cache = self._cache()
+        cache.set(self.archive_path, self.toc)
+        os.unlink(self.archive_path)
+        self.assertIsNone(cache.get(self.archive_path))
+
+    def test_max_archives(self):
+        cache = self._cache()
+        cache.MAX_ARCHIVES = 2
+        paths = []
+        for n in range(3):
+            path = os.path.join(self.tmp_dir, 'book%u.cbz' % n)
+            with open(path, 'wb') as fp:
+                fp.write('book')
+            cache.set(path, self.toc)
+            paths.append(path)
+            # Make sure access times differ.
+            time.sleep(0.01)
+        self.assertIsNone(cache.get(paths[0]))
+        self.assertEqual(cache.get(paths[2]), self.toc)
+
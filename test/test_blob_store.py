@@ -0,0 +1,58 @@
+
+import os
+
+from . import MComixTest
+
+from mcomix.blob_store import BlobStore
+
+
+class BlobStoreTest(MComixTest):
+
+    def _read(self, path):
+        with open(path, 'rb') as fp:
+            return fp.read()
+
+    def test_in_memory(self):
+        store = BlobStore(max_size=10)
+        path = os.path.join(self.tmp_dir, 'page1.png')
+        self.assertTrue(store.put(path, 'abcdef'))
+        self.assertTrue(path in store)
+        self.assertEqual(store.get(path), 'abcdef')
+        self.assertEqual(store.get_size(), 6)
+        self.assertFalse(os.path.exists(path))
+
+    def test_spill_to_disk(self):
+        store = BlobStore(max_size=10)
+        path1 = os.path.join(self.tmp_dir, 'page1.png')
+        path2 = os.path.join(self.tmp_dir, 'sub', 'page2.png')
+        self.assertTrue(store.put(path1, 'abcdef'))
+        self.assertFalse(store.put(path2, 'ghijkl'))
+        self.assertFalse(path2 in store)
+        self.assertIsNone(store.get(path2))
+        self.assertEqual(self._read(path2), 'ghijkl')
+        self.assertEqual(store.get_size(), 6)
+
+    def test_no_memory(self):
+        store = BlobStore()
+        path = os.path.join(self.tmp_dir, 'page1.png')
+        self.assertFalse(store.put(path, 'abc'))
+        self.assertEqual(self._read(path), 'abc')
+
+    def test_materialize(self):
+        store = BlobStore(max_size=10)
+        path = os.path.join(self.tmp_dir, 'sub', 'page1.png')
+        store.put(path, 'abc')
+        self.assertEqual(store.materialize(path), path)
+        self.assertEqual(self._read(path), 'abc')
+        # Still available from memory.
+        self.assertEqual(store.get(path), 'abc')
+
+    def test_clear(self):
+        store = BlobStore(max_size=10)
+        path = os.path.join(self.tmp_dir, 'page1.png')
+        store.put(path, 'abc')
+        store.clear()
+        self.assertFalse(path in store)
+        self.assertEqual(store.get_size(), 0)
+        self.assertTrue(store.put(path, 'abcdefghij'))
+
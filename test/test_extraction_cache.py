@@ -0,0 +1,115 @@
+
+import os
+import threading
+import time
+
+from . import MComixTest
+
+from mcomix.extraction_cache import ExtractionCache
+
+
+class ExtractionCacheTest(MComixTest):
+
+    def setUp(self):
+        super(ExtractionCacheTest, self).setUp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def _archive(self, name, content='book'):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as fp:
+            fp.write(content)
+        return path
+
+    def _extract(self, book, name, size):
+        with open(os.path.join(book.directory, name), 'wb') as fp:
+            fp.write('x' * size)
+        book.add(name)
+
+    def _close(self, cache, book):
+        cache.close(book)
+        # Closing (then deleting evicted books) is done in the background.
+        for suffix in ('-close', '-delete'):
+            for thread in threading.enumerate():
+                if thread.name.endswith(suffix):
+                    thread.join()
+
+    def test_disabled(self):
+        cache = ExtractionCache(self.cache_dir)
+        self.assertIsNone(cache.open(self._archive('book.cbr')))
+
+    def test_reopen(self):
+        archive = self._archive('book.cbr')
+        cache = ExtractionCache(self.cache_dir, max_size=1000)
+        book = cache.open(archive)
+        self.assertEqual(book.get_files(), set())
+        self._extract(book, u'01.jpg', 10)
+        self._extract(book, u'02.jpg', 10)
+        self._close(cache, book)
+        book = ExtractionCache(self.cache_dir, max_size=1000).open(archive)
+        self.assertEqual(book.get_files(), set([u'01.jpg', u'02.jpg']))
+
+    def test_incomplete_file(self):
+        archive = self._archive('book.cbr')
+        cache = ExtractionCache(self.cache_dir, max_size=1000)
+        book = cache.open(archive)
+        self._extract(book, u'01.jpg', 10)
+        self._extract(book, u'02.jpg', 10)
+        self._close(cache, book)
+        with open(os.path.join(book.directory, u'02.jpg'), 'wb') as fp:
+            fp.write('x')
+        book = cache.open(archive)
+        self.assertEqual(book.get_files(), set([u'01.jpg']))
+
+    def test_modified_archive(self):
+        archive = self._archive('book.cbr')
+        cache = ExtractionCache(self.cache_dir, max_size=1000)
+        book = cache.open(archive)
+        self._extract(book, u'01.jpg', 10)
+        self._close(cache, book)
+        self._archive('book.cbr', 'modified book')
+        book = cache.open(archive)
+        self.assertEqual(book.get_files(), set())
+
+    def test_eviction(self):
+        cache = ExtractionCache(self.cache_dir, max_size=350)
+        archives = [self._archive('book%u.cbr' % n) for n in range(4)]
+        directories = []
+        for n in range(3):
+            book = cache.open(archives[n])
+            self._extract(book, u'01.jpg', 100)
+            self._close(cache, book)
+            directories.append(book.directory)
+        # Reading the first book again makes it the most recently used.
+        book = cache.open(archives[0])
+        self._close(cache, book)
+        book = cache.open(archives[3])
+        self._extract(book, u'01.jpg', 100)
+        self._close(cache, book)
+        self.assertEqual([os.path.exists(directory) for directory in directories],
+                         [True, False, True])
+        self.assertTrue(os.path.exists(book.directory))
+        # Wait for evicted books to be deleted.
+        for thread in threading.enumerate():
+            if thread.name.endswith('-delete'):
+                thread.join()
+        self.assertEqual(len(os.listdir(self.cache_dir)), 6)
+
+    def test_eviction_existing_books(self):
+        cache = ExtractionCache(self.cache_dir, max_size=1000)
+        archives = [self._archive('book%u.cbr' % n) for n in range(3)]
+        directories = []
+        for n in range(2):
+            book = cache.open(archives[n])
+            self._extract(book, u'01.jpg', 100)
+            self._close(cache, book)
+            directories.append(book.directory)
+        # The first book was read last in a previous session.
+        mtime = time.time() - 100
+        os.utime(directories[1] + '.manifest', (mtime, mtime))
+        cache = ExtractionCache(self.cache_dir, max_size=250)
+        book = cache.open(archives[2])
+        self._extract(book, u'01.jpg', 100)
+        self._close(cache, book)
+        self.assertEqual([os.path.exists(directory) for directory in directories],
+                         [True, False])
+
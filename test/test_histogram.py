@@ -0,0 +1,101 @@
+# coding: utf-8
+
+from PIL import Image, ImageDraw, ImageOps
+
+from . import MComixTest
+
+from mcomix import histogram
+from mcomix import image_tools
+
+
+def _reference_histogram_image(hist_data, height=170, fill=170, text=True):
+    """Draw the histogram pixel by pixel, as histogram.draw_histogram_data
+    used to, and return it as a PIL image."""
+    im = Image.new('RGB', (258, height - 4), (30, 30, 30))
+    maximum = max(hist_data[:768] + [1])
+    y_scale = float(height - 6) / maximum
+    r = [int(hist_data[n] * y_scale) for n in xrange(256)]
+    g = [int(hist_data[n] * y_scale) for n in xrange(256, 512)]
+    b = [int(hist_data[n] * y_scale) for n in xrange(512, 768)]
+    im_data = im.load()
+    # Draw the filling colours
+    for x in xrange(256):
+        for y in xrange(1, max(r[x], g[x], b[x]) + 1):
+            r_px = y <= r[x] and fill or 0
+            g_px = y <= g[x] and fill or 0
+            b_px = y <= b[x] and fill or 0
+            im_data[x + 1, height - 5 - y] = (r_px, g_px, b_px)
+    # Draw the outlines
+    for channel, values in enumerate((r, g, b)):
+        for x in xrange(1, 256):
+            for y in range(values[x-1] + 1, values[x] + 1) + [values[x]] * (values[x] != 0):
+                px = list(im_data[x + 1, height - 5 - y])
+                px[channel] = 255
+                im_data[x + 1, height - 5 - y] = tuple(px)
+            for y in range(values[x] + 1, values[x-1] + 1):
+                px = list(im_data[x, height - 5 - y])
+                px[channel] = 255
+                im_data[x, height - 5 - y] = tuple(px)
+    if text:
+        maxstr = 'max: ' + str(maximum)
+        draw = ImageDraw.Draw(im)
+        draw.rectangle((0, 0, len(maxstr) * 6 + 2, 10), fill=(30, 30, 30))
+        draw.text((2, 0), maxstr, fill=(255, 255, 255))
+    im = ImageOps.expand(im, 1, (80, 80, 80))
+    im = ImageOps.expand(im, 1, (0, 0, 0))
+    return im
+
+def _create_image(width, height):
+    """Return a RGB image with a wide spread of values in each channel."""
+    im = Image.new('RGB', (width, height))
+    im_data = im.load()
+    for x in xrange(width):
+        for y in xrange(height):
+            im_data[x, y] = ((x * 7 + y) % 256,
+                             (x * y) % 256,
+                             (255 - x * 3) % 256)
+    return im
+
+
+class HistogramTest(MComixTest):
+
+    def test_get_histogram(self):
+        im = _create_image(64, 48)
+        pixbuf = image_tools.pil_to_pixbuf(im)
+        self.assertEqual(histogram.get_histogram(pixbuf), im.histogram()[:768])
+
+    def test_get_histogram_downsampled(self):
+        # Left half red, right half blue: twice as many pixels as MAX_PIXELS.
+        width, height = 1024, histogram.MAX_PIXELS * 2 // 1024
+        im = Image.new('RGB', (width, height), (0, 0, 255))
+        im.paste((255, 0, 0), (0, 0, width // 2, height))
+        hist = histogram.get_histogram(image_tools.pil_to_pixbuf(im))
+        self.assertEqual(len(hist), 768)
+        pixels = width * height
+        for channel in xrange(3):
+            self.assertAlmostEqual(sum(hist[256 * channel:256 * (channel + 1)]),
+                                   pixels, delta=pixels // 100)
+        for count in (hist[255], hist[0], hist[512], hist[767]):
+            self.assertAlmostEqual(count, pixels // 2, delta=pixels // 100)
+        self.assertAlmostEqual(hist[256], pixels, delta=1)
+
+    def _check_drawing(self, hist_data, **kwargs):
+        pixbuf = histogram.draw_histogram_data(hist_data, **kwargs)
+        im = image_tools.pixbuf_to_pil(pixbuf).convert('RGB')
+        reference = _reference_histogram_image(hist_data, **kwargs)
+        self.assertEqual(im.size, reference.size)
+        self.assertEqual(im.tobytes(), reference.tobytes())
+
+    def test_draw_histogram_data(self):
+        hist_data = _create_image(64, 48).histogram()[:768]
+        self._check_drawing(hist_data)
+        self._check_drawing(hist_data, height=100, fill=0, text=False)
+
+    def test_draw_histogram_data_single_colour(self):
+        im = Image.new('RGB', (16, 16), (10, 128, 250))
+        self._check_drawing(im.histogram()[:768])
+
+    def test_draw_histogram_data_empty(self):
+        self._check_drawing([0] * 768)
+
+# vim: expandtab:sw=4:ts=4
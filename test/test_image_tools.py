@@ -340,6 +340,27 @@ class ImageToolsTest(object):
         pixbuf = image_tools.load_pixbuf_size(tmp_file.name, *target_size)
         self.assertEqual((pixbuf.get_width(), pixbuf.get_height()), expected_size)
 
+    def test_load_pixbuf_reduced(self):
+        for name in (
+            'pattern.jpg',
+            'pattern-opaque-rgb.png',
+        ):
+            image = get_test_image(name)
+            image_path = get_image_path(image.name)
+            # Not reduced if smaller than target dimensions.
+            pixbuf = image_tools.load_pixbuf_reduced(image_path, *image.size)
+            self.assertFalse(image_tools.is_reduced(pixbuf))
+            self.assertEqual((pixbuf.get_width(), pixbuf.get_height()), image.size)
+            self.assertEqual(image_tools.get_original_size(pixbuf), image.size)
+            # Reduced, but still covering the target dimensions.
+            target_size = image.size[0] / 4, image.size[1] / 8
+            pixbuf = image_tools.load_pixbuf_reduced(image_path, *target_size)
+            self.assertTrue(image_tools.is_reduced(pixbuf))
+            self.assertEqual(image_tools.get_original_size(pixbuf), image.size)
+            self.assertGreaterEqual(pixbuf.get_width(), target_size[0])
+            self.assertGreaterEqual(pixbuf.get_height(), target_size[1])
+            self.assertLess(pixbuf.get_width(), image.size[0])
+
     def test_pixbuf_to_pil(self):
         for image in (
             'transparent.png',
@@ -371,6 +392,61 @@ class ImageToolsTest(object):
             self.assertImagesEqual(pixbuf, expected_im, msg=msg)
         # TODO: test keep_orientation
 
+    def test_get_enhance_lut(self):
+        from PIL import ImageChops, ImageEnhance, ImageOps
+        im = Image.open(get_image_path('pattern-opaque-rgb.png')).convert('RGB')
+        for brightness, contrast, autocontrast in (
+            (1.0, 1.0, True),
+            (1.5, 1.0, False),
+            (0.6, 1.0, False),
+            (1.0, 1.4, False),
+            (0.8, 0.5, False),
+            (1.3, 1.0, True),
+        ):
+            expected = im
+            if brightness != 1.0:
+                expected = ImageEnhance.Brightness(expected).enhance(brightness)
+            if autocontrast:
+                expected = ImageOps.autocontrast(expected, cutoff=0.1)
+            elif contrast != 1.0:
+                expected = ImageEnhance.Contrast(expected).enhance(contrast)
+            lut = image_tools.get_enhance_lut(im.histogram(), im.getbands(),
+                                              brightness, contrast,
+                                              autocontrast)
+            result = im.point(lut)
+            # Allow for rounding differences.
+            extrema = ImageChops.difference(result, expected).getextrema()
+            for band_min, band_max in extrema:
+                self.assertLessEqual(band_max, 1, msg=(
+                    'get_enhance_lut(brightness=%s, contrast=%s, '
+                    'autocontrast=%s) failed' % (brightness, contrast,
+                                                 autocontrast)))
+        # Alpha is left unchanged.
+        im = im.convert('RGBA')
+        lut = image_tools.get_enhance_lut(im.histogram(), im.getbands(), 1.5)
+        self.assertEqual(lut[3 * 256:], range(256))
+
+    def test_get_most_common_edge_colour(self):
+        pixbuf = new_pixbuf((20, 10), False, 0x102030FF)
+        # A few pixels of a close colour on the left edge: same group,
+        # but less common.
+        new_pixbuf((1, 3), False, 0x112131FF).copy_area(0, 0, 1, 3,
+                                                         pixbuf, 0, 0)
+        # Another colour in the middle is ignored.
+        new_pixbuf((10, 10), False, 0xFF0000FF).copy_area(0, 0, 10, 10,
+                                                          pixbuf, 5, 0)
+        expected = [0x10 * 257, 0x20 * 257, 0x30 * 257]
+        self.assertEqual(image_tools.get_most_common_edge_colour(pixbuf),
+                         expected)
+        edges = image_tools.get_edge_colours(pixbuf)
+        self.assertEqual(image_tools.get_most_common_colour(edges), expected)
+        # Double page: left edge of the first page, right edge of the second.
+        other = new_pixbuf((20, 10), False, 0x0000FFFF)
+        new_pixbuf((2, 10), False, 0x102030FF).copy_area(0, 0, 2, 10,
+                                                         other, 18, 0)
+        self.assertEqual(image_tools.get_most_common_edge_colour((pixbuf, other)),
+                         expected)
+
     def test_get_image_info(self):
         for image in _TEST_IMAGES:
             image_path = get_image_path(image.name)
@@ -0,0 +1,120 @@
+
+import os
+import time
+
+from . import MComixTest
+
+from mcomix.page_geometry import GeometryIndex, PageGeometry
+
+
+class GeometryIndexTest(MComixTest):
+
+    def setUp(self):
+        super(GeometryIndexTest, self).setUp()
+        self.database_path = os.path.join(self.tmp_dir, 'geometry.db')
+        self.book_path = os.path.join(self.tmp_dir, 'book.cbz')
+        with open(self.book_path, 'wb') as fp:
+            fp.write('book')
+        self.probed = []
+
+    def _probe(self, path):
+        self.probed.append(path)
+        return 'JPEG', 100, 200, 90
+
+    def _index(self):
+        return GeometryIndex(self._probe, database_path=self.database_path)
+
+    def test_probe(self):
+        index = self._index()
+        index.open(self.book_path)
+        self.assertIsNone(index.get('01.jpg'))
+        geometry = index.probe('01.jpg', '/tmp/01.jpg', wait=True)
+        self.assertEqual(geometry, PageGeometry('JPEG', 100, 200, 90))
+        self.assertEqual(index.get('01.jpg'), geometry)
+        # Already known: no probing.
+        index.probe('01.jpg', '/tmp/01.jpg', wait=True)
+        self.assertEqual(self.probed, ['/tmp/01.jpg'])
+        index.close()
+        self.assertIsNone(index.get('01.jpg'))
+
+    def test_background_probe(self):
+        index = self._index()
+        index.open(self.book_path)
+        self.assertIsNone(index.probe('01.jpg', '/tmp/01.jpg'))
+        # Wait for the background probing to finish.
+        for n in range(100):
+            if index.get('01.jpg') is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(index.get('01.jpg'), PageGeometry('JPEG', 100, 200, 90))
+        index.close()
+
+    def test_background_probe_notification(self):
+        probed = []
+        index = GeometryIndex(self._probe, database_path=self.database_path,
+                              probed=lambda name, path: probed.append((name, path)))
+        index.open(self.book_path)
+        index.probe('01.jpg', '/tmp/01.jpg', wait=True)
+        index.probe('02.jpg', '/tmp/02.jpg')
+        for n in range(100):
+            if probed:
+                break
+            time.sleep(0.01)
+        # Only pages probed in the background are notified.
+        self.assertEqual(probed, [('02.jpg', '/tmp/02.jpg')])
+        index.close()
+
+    def test_persistence(self):
+        index = self._index()
+        index.open(self.book_path)
+        index.probe('01.jpg', '/tmp/01.jpg', wait=True)
+        index.probe('02.jpg', '/tmp/02.jpg', wait=True)
+        index.close()
+        index = self._index()
+        index.open(self.book_path)
+        self.assertEqual(index.get('02.jpg'), PageGeometry('JPEG', 100, 200, 90))
+        index.close()
+        self.assertEqual(len(self.probed), 2)
+
+    def test_modified_book(self):
+        index = self._index()
+        index.open(self.book_path)
+        index.probe('01.jpg', '/tmp/01.jpg', wait=True)
+        index.close()
+        with open(self.book_path, 'ab') as fp:
+            fp.write('modified')
+        index.open(self.book_path)
+        self.assertIsNone(index.get('01.jpg'))
+        index.close()
+
+    def test_not_stored(self):
+        index = self._index()
+        index.open()
+        index.probe('/tmp/01.jpg', '/tmp/01.jpg', wait=True)
+        index.close()
+        self.assertFalse(os.path.exists(self.database_path))
+
+    def test_probe_failure(self):
+        def probe(path):
+            raise IOError('invalid image')
+        index = GeometryIndex(probe, database_path=self.database_path)
+        index.open(self.book_path)
+        self.assertIsNone(index.probe('01.jpg', '/tmp/01.jpg', wait=True))
+        self.assertIsNone(index.get('01.jpg'))
+        index.close()
+
+    def test_set(self):
+        index = self._index()
+        index.open(self.book_path)
+        geometry = PageGeometry('PNG', 300, 400, 270)
+        index.set('01.png', geometry)
+        self.assertEqual(index.get('01.png'), geometry)
+        # Known: no probing.
+        self.assertEqual(index.probe('01.png', '/tmp/01.png', wait=True), geometry)
+        self.assertEqual(self.probed, [])
+        index.close()
+        index = self._index()
+        index.open(self.book_path)
+        self.assertEqual(index.get('01.png'), geometry)
+        index.close()
+
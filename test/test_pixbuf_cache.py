@@ -0,0 +1,120 @@
+
+from . import MComixTest
+
+from mcomix.pixbuf_cache import PixbufCache
+
+
+class FakePixbuf(object):
+
+    def __init__(self, width, height):
+        self._width = width
+        self._height = height
+
+    def get_rowstride(self):
+        return self._width * 3
+
+    def get_height(self):
+        return self._height
+
+def _pixbuf(size):
+    # A pixbuf using <size> bytes.
+    return FakePixbuf(size, 1)
+
+def _pixbuf_size(kb):
+    return kb * 3
+
+
+class PixbufCacheTest(MComixTest):
+
+    def test_unbounded(self):
+        cache = PixbufCache()
+        for n in range(10):
+            cache[n] = _pixbuf(1000)
+        self.assertEqual(len(cache), 10)
+        self.assertEqual(cache.get_size(), _pixbuf_size(10000))
+
+    def test_byte_budget(self):
+        cache = PixbufCache(max_size=_pixbuf_size(300))
+        for n in range(3):
+            cache[n] = _pixbuf(100)
+        self.assertEqual(sorted(cache.keys()), [0, 1, 2])
+        # A big page: evict as much as necessary.
+        cache.set_current(3)
+        cache[3] = _pixbuf(250)
+        self.assertEqual(sorted(cache.keys()), [3])
+        self.assertEqual(cache.get_size(), _pixbuf_size(250))
+
+    def test_evict_by_distance(self):
+        cache = PixbufCache(max_size=_pixbuf_size(300))
+        for n in (5, 9, 6):
+            cache[n] = _pixbuf(100)
+        cache.set_current(5)
+        cache[4] = _pixbuf(100)
+        # Page 9 is the farthest.
+        self.assertEqual(sorted(cache.keys()), [4, 5, 6])
+        cache.set_current(4)
+        cache[3] = _pixbuf(100)
+        self.assertEqual(sorted(cache.keys()), [3, 4, 5])
+
+    def test_evict_lru_at_same_distance(self):
+        cache = PixbufCache(max_size=_pixbuf_size(300))
+        cache.set_current(5)
+        for n in (4, 6):
+            cache[n] = _pixbuf(100)
+        # Page 4 and 6 are at the same distance, but 4 was used more recently.
+        self.assertIsNotNone(cache.get(4))
+        cache[5] = _pixbuf(150)
+        self.assertEqual(sorted(cache.keys()), [4, 5])
+
+    def test_pinned_pages(self):
+        cache = PixbufCache(max_size=_pixbuf_size(100))
+        cache.set_current(0, pinned=(0, 1))
+        cache[0] = _pixbuf(100)
+        cache[1] = _pixbuf(100)
+        cache[2] = _pixbuf(100)
+        # Pinned pages stay, even over budget.
+        self.assertEqual(sorted(cache.keys()), [0, 1])
+        cache.set_current(1, pinned=(1,))
+        self.assertEqual(sorted(cache.keys()), [1])
+
+    def test_custom_keys(self):
+        cache = PixbufCache(max_size=_pixbuf_size(200),
+                            get_page=lambda key: key[0])
+        cache.set_current(1)
+        cache[(1, 'a')] = _pixbuf(100)
+        cache[(3, 'a')] = _pixbuf(100)
+        cache[(2, 'b')] = _pixbuf(100)
+        self.assertEqual(sorted(cache.keys()), [(1, 'a'), (2, 'b')])
+
+    def test_set_max_size(self):
+        cache = PixbufCache()
+        cache.set_current(0)
+        for n in range(5):
+            cache[n] = _pixbuf(100)
+        cache.set_max_size(_pixbuf_size(200))
+        self.assertEqual(sorted(cache.keys()), [0, 1])
+
+    def test_replace(self):
+        cache = PixbufCache()
+        cache[0] = _pixbuf(100)
+        cache[0] = _pixbuf(50)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get_size(), _pixbuf_size(50))
+        del cache[0]
+        self.assertEqual(cache.get_size(), 0)
+
+    def test_stats(self):
+        cache = PixbufCache(max_size=_pixbuf_size(100))
+        cache.set_current(0)
+        cache[0] = _pixbuf(100)
+        cache.get(0)
+        cache.get(1)
+        cache[1] = _pixbuf(100)
+        stats = cache.get_stats()
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(stats.size, _pixbuf_size(100))
+        self.assertEqual((stats.hits, stats.misses, stats.evictions), (1, 1, 1))
+        cache.clear()
+        stats = cache.get_stats()
+        self.assertEqual(stats, (0, 0, 0, 0, 0))
+
@@ -0,0 +1,83 @@
+
+from . import MComixTest
+
+from mcomix.prefetch import Prefetcher
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class PrefetcherTest(MComixTest):
+
+    def setUp(self):
+        super(PrefetcherTest, self).setUp()
+        self.clock = FakeClock()
+        self.prefetcher = Prefetcher(clock=self.clock)
+
+    def _navigate(self, pages, delay=1.0, page_width=1):
+        for page in pages:
+            self.prefetcher.page_changed(page, page_width)
+            self.clock.now += delay
+
+    def test_no_history(self):
+        # Current page, next one, previous one, then the following ones.
+        self.assertEqual(self.prefetcher.get_page_list(5, 1, 5, 100),
+                         [4, 5, 3, 6, 7])
+        self.assertIsNone(self.prefetcher.get_direction())
+        self.assertIsNone(self.prefetcher.get_rate())
+
+    def test_book_bounds(self):
+        self.assertEqual(self.prefetcher.get_page_list(1, 1, 5, 100),
+                         [0, 1, 2, 3])
+        self.assertEqual(self.prefetcher.get_page_list(10, 2, 6, 10),
+                         [9, 8, 7])
+
+    def test_no_cache(self):
+        self.assertEqual(self.prefetcher.get_page_list(5, 2, 2, 100), [4, 5])
+
+    def test_forward(self):
+        self._navigate(range(1, 8))
+        self.assertEqual(self.prefetcher.get_direction(), 1.0)
+        self.assertEqual(self.prefetcher.get_page_list(7, 1, 8, 100),
+                         [6, 7, 5, 8, 9, 10, 11, 12])
+
+    def test_backward(self):
+        self._navigate(range(20, 13, -1))
+        self.assertEqual(self.prefetcher.get_direction(), -1.0)
+        self.assertEqual(self.prefetcher.get_page_list(14, 1, 5, 100),
+                         [13, 12, 14, 11, 10])
+
+    def test_back_and_forth(self):
+        self._navigate([10, 11, 10, 11, 10, 11])
+        direction = self.prefetcher.get_direction()
+        self.assertTrue(0 < direction < 0.75)
+        # As many pages behind as ahead.
+        self.assertEqual(self.prefetcher.get_page_list(11, 1, 9, 100),
+                         [10, 11, 9, 12, 13, 14, 8, 7, 6])
+
+    def test_slow_reader(self):
+        # A page every minute: no need to fetch far ahead.
+        self._navigate(range(1, 6), delay=60.0)
+        self.assertEqual(self.prefetcher.get_page_list(5, 1, 10, 100),
+                         [4, 5, 3, 6])
+
+    def test_jump(self):
+        self._navigate(range(1, 6))
+        self._navigate([50])
+        self.assertIsNone(self.prefetcher.get_direction())
+
+    def test_slideshow(self):
+        self.prefetcher.set_slideshow_delay(5.0)
+        # 2 pages every 5 seconds, nothing behind.
+        self.assertEqual(self.prefetcher.get_page_list(5, 2, 12, 100),
+                         [4, 5, 6, 7, 8, 9, 10, 11, 12, 13])
+        self.prefetcher.set_slideshow_delay(None)
+        self.assertEqual(self.prefetcher.get_page_list(5, 2, 12, 100),
+                         [4, 5, 6, 7, 3, 2, 8, 9, 10, 11, 12, 13])
+
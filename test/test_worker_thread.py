@@ -0,0 +1,58 @@
+
+import threading
+import time
+
+from . import MComixTest
+
+from mcomix.worker_thread import WorkerThread
+
+
+class WorkerThreadTest(MComixTest):
+
+    def _process(self, orders, deadlines=None, **kwargs):
+        processed = []
+        done = threading.Event()
+        def process_order(order):
+            processed.append(order)
+            if len(processed) == len(orders):
+                done.set()
+        if deadlines is not None:
+            kwargs['get_deadline'] = deadlines.get
+        thread = WorkerThread(process_order, **kwargs)
+        # Queue all the orders before the thread can pick one.
+        with thread:
+            thread.extend_orders(orders)
+        done.wait(5)
+        thread.stop()
+        return processed
+
+    def test_queue_order(self):
+        self.assertEqual(self._process([3, 1, 2]), [3, 1, 2])
+
+    def test_sort_orders(self):
+        self.assertEqual(self._process([3, 1, 2], sort_orders=True), [1, 2, 3])
+
+    def test_deadlines(self):
+        now = time.time()
+        deadlines = { 4: now + 2, 2: now + 1, 5: now + 3 }
+        self.assertEqual(self._process([1, 2, 3, 4, 5], deadlines),
+                         [2, 4, 5, 1, 3])
+
+    def test_changing_deadlines(self):
+        deadlines = {}
+        processed = []
+        done = threading.Event()
+        def process_order(order):
+            processed.append(order)
+            if 1 == order:
+                # Deadlines can change while orders are queued.
+                deadlines[3] = time.time()
+            if 3 == len(processed):
+                done.set()
+        thread = WorkerThread(process_order, get_deadline=deadlines.get)
+        with thread:
+            thread.extend_orders([1, 2, 3])
+        done.wait(5)
+        thread.stop()
+        self.assertEqual(processed, [1, 3, 2])
+
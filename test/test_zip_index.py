@@ -0,0 +1,92 @@
+
+import os
+import time
+import zipfile
+
+from . import MComixTest
+
+from mcomix.archive import zip_index
+from mcomix.archive.zip import ZipArchive
+
+
+class ZipIndexTest(MComixTest):
+
+    def setUp(self):
+        super(ZipIndexTest, self).setUp()
+        self.archive_path = os.path.join(self.tmp_dir, 'book.cbz')
+        self.contents = {
+            'stored.txt': 'stored ' * 100,
+            'deflated.txt': 'deflated ' * 100,
+            'dir/empty.txt': '',
+        }
+        self._create_archive(self.archive_path)
+
+    def _create_archive(self, path, prefix=''):
+        with open(path, 'wb') as fp:
+            fp.write(prefix)
+            zip = zipfile.ZipFile(fp, 'a' if prefix else 'w')
+            zip.writestr('stored.txt', self.contents['stored.txt'],
+                         zipfile.ZIP_STORED)
+            zip.writestr('deflated.txt', self.contents['deflated.txt'],
+                         zipfile.ZIP_DEFLATED)
+            zip.writestr('dir/empty.txt', '', zipfile.ZIP_DEFLATED)
+            zip.comment = 'comment'
+            zip.close()
+
+    def test_index(self):
+        index = zip_index.get_index(self.archive_path)
+        self.assertIsNotNone(index)
+        self.assertEqual(index.namelist(),
+                         ['stored.txt', 'deflated.txt', 'dir/empty.txt'])
+        self.assertEqual(index.getinfo('stored.txt').compress_type,
+                         zip_index.ZIP_STORED)
+        self.assertEqual(index.getinfo('deflated.txt').compress_type,
+                         zip_index.ZIP_DEFLATED)
+        self.assertFalse(index.is_encrypted())
+        self.assertTrue(index.is_py_supported())
+
+    def test_shared_index(self):
+        index = zip_index.get_index(self.archive_path)
+        self.assertIs(zip_index.get_index(self.archive_path), index)
+        # Modified archive: indexed again.
+        self._create_archive(self.archive_path, prefix='data')
+        mtime = time.time() + 10
+        os.utime(self.archive_path, (mtime, mtime))
+        self.assertIsNot(zip_index.get_index(self.archive_path), index)
+
+    def test_not_a_zip(self):
+        path = os.path.join(self.tmp_dir, 'book.txt')
+        with open(path, 'wb') as fp:
+            fp.write('not a zip' * 10)
+        self.assertIsNone(zip_index.get_index(path))
+        self.assertIsNone(zip_index.get_index(os.path.join(self.tmp_dir,
+                                                           'missing.cbz')))
+
+    def _check_read(self, path):
+        archive = ZipArchive(path)
+        try:
+            self.assertIsNone(archive.zip)
+            self.assertEqual(sorted(archive.iter_contents()),
+                             sorted(self.contents.keys()))
+            for name, content in self.contents.iteritems():
+                self.assertEqual(archive.read(name), content)
+        finally:
+            archive.close()
+
+    def test_read(self):
+        self._check_read(self.archive_path)
+
+    def test_read_prepended_data(self):
+        path = os.path.join(self.tmp_dir, 'prefixed.cbz')
+        self._create_archive(path, prefix='#' * 1000)
+        self._check_read(path)
+
+    def test_read_after_close(self):
+        archive = ZipArchive(self.archive_path)
+        list(archive.iter_contents())
+        content = archive.read('stored.txt')
+        archive.close()
+        # Contents are copied out of the map.
+        self.assertEqual(content, self.contents['stored.txt'])
+        self.assertRaises(ValueError, archive.read, 'stored.txt')
+